@@ -3,6 +3,9 @@
 # Migration has 20 Vietnamese categories (lines 643-667).
 # This mapping converts English/Vietnamese keywords → exact migration.sql category names
 
+import sys
+from types import MappingProxyType
+
 CATEGORIES_MAPPING = {
     # === Technology ===
     # Maps to: Công nghệ thông tin, Máy tính, Trí tuệ và Dữ liệu
@@ -170,3 +173,9 @@ CATEGORIES_MAPPING = {
     "General": "Khác",
     "Khác": "Khác"
 }
+
+# Read-only at runtime. Keys/values are interned once here so lookups and the
+# category name caches downstream compare by identity instead of char by char.
+CATEGORIES_MAPPING = MappingProxyType(
+    {sys.intern(k): sys.intern(v) for k, v in CATEGORIES_MAPPING.items()}
+)
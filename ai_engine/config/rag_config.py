@@ -35,6 +35,13 @@ GEMINI_MODELS = [
 
 GEMINI_MODEL = GEMINI_MODELS[0] # Default
 
+# Per (API key, model) quotas (free tier). ModelManager throttles to RATE_LIMIT_SAFETY of
+# these before sending, instead of finding out through 429s. Models not listed are unthrottled.
+GEMINI_RATE_LIMITS = {
+    "gemini-2.5-flash": {"rpm": 10, "tpm": 250_000, "rpd": 250},
+    "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250_000, "rpd": 1000},
+}
+
 # Search Configuration
 DEFAULT_TOP_K = 5
 SCORE_THRESHOLD = 0.76
@@ -44,8 +51,31 @@ MIN_QUERY_LENGTH = 3
 ENABLE_GARBAGE_FILTER = True
 ENABLE_INTENT_CLASSIFICATION = True
 QUERY_CACHE_THRESHOLD = 2.0  # DISABLED (Previously 0.95). High value prevents cache hits to ensure Context is always populated.
+FALLBACK_CACHE_THRESHOLD = 0.95  # Stricter than the answer caches: 0.89-0.93 paraphrase matches gave wrong no-result answers
 SEARCH_EXPAND_FACTOR = 2  # Fetch more results than needed, then filter
 
+# CLI semantic answer cache (src/rag/semantic_cache.py)
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Cosine similarity for a paraphrase to reuse an answer
+SEMANTIC_CACHE_TTL = 24 * 3600  # Seconds before a cached answer expires
+SEMANTIC_CACHE_MAX_ENTRIES = 512
+
+# In-process cache of smalltalk / general-QA LLM replies, keyed on (intent, normalized question)
+RESPONSE_CACHE_MAX_ENTRIES = 512
+
+# In-process cache of query embeddings, keyed on the punctuation-stripped lowercased query
+EMBED_CACHE_MAX_ENTRIES = 2048
+# Questions recently written to Chroma query_memory; repeats skip the upsert
+QUERY_MEMORY_SEEN_MAX_ENTRIES = 4096
+
+# Chat history appends are queued and written by a background thread in batches
+SESSION_FLUSH_INTERVAL_MS = 50
+SESSION_FLUSH_MAX_BATCH = 32  # ...or sooner once this many lines are queued
+# Messages read back when a session is reloaded (prompts only use the last 8);
+# older ones are parsed on demand by ChatSession.get_full_history()
+SESSION_LOAD_TAIL_MESSAGES = 16
+# Sessions kept in memory by RAGEngine; least recently used ones are dropped (state is on disk)
+SESSION_CACHE_SIZE = 1024
+
 # Generation Parameters
 TEMPERATURE = 0.2
 MAX_OUTPUT_TOKENS = 512
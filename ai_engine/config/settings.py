@@ -72,6 +72,7 @@ class Settings:
     DB_USER = os.getenv("DB_USER", "root")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "root")
     DB_NAME = os.getenv("DB_NAME", "library_db")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
 
     @staticmethod
     def ensure_directories():
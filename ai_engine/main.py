@@ -9,10 +9,10 @@ command = sys.argv[1] if len(sys.argv) > 1 else "ai_engine"
 setup_logging(command, log_to_file=True)
 
 # NOW import modules after logging is configured
+# Indexer / chat pull in the embedding model and vector DB, so they are imported
+# inside their branches like the other heavy commands
 from src.crawler import GoogleBooksCrawler
 from src.data_processor import run_processor
-from src.indexer import Indexer
-from src.rag.chat import main as chat_main
 
 
 def main():
@@ -26,9 +26,20 @@ def main():
             "chat",
             "download-images",
             "export-be",
+            "sync-to-mysql",
             "api"
         ],
-        help="crawl | process | index | chat | download-images | export-be | api"
+        help="crawl | process | index | chat | download-images | export-be | sync-to-mysql | api"
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="sync-to-mysql: use LOAD DATA LOCAL INFILE for large initial loads"
+    )
+    parser.add_argument(
+        "--new-session",
+        action="store_true",
+        help="chat: start a new session instead of resuming the last one"
     )
 
     args = parser.parse_args()
@@ -41,6 +52,7 @@ def main():
         run_processor()
 
     elif args.command == "index":
+        from src.indexer import Indexer
         indexer = Indexer()
         indexer.run_indexing()
 
@@ -54,8 +66,14 @@ def main():
         from src.export_for_be import export_for_be
         export_for_be()
 
+    elif args.command == "sync-to-mysql":
+        print(">>> SYNCING TO MYSQL")
+        from src.mysql.sync_data import sync_to_mysql
+        sync_to_mysql(bulk_load=args.bulk_load)
+
     elif args.command == "chat":
-        chat_main()
+        from src.rag.chat import main as chat_main
+        chat_main(new_session=args.new_session)
 
 
     elif args.command == "api":
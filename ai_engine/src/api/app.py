@@ -5,6 +5,7 @@ Flask REST API for the ai_engine project using the /ai prefix as requested.
 Endpoints:
   GET    /ai/health
   POST   /ai/chat                -> chat with the "AI" (RAG-lite using SearchEngine)
+  POST   /ai/chat/stream         -> same as /ai/chat, streamed as Server-Sent Events
   POST   /ai/search              -> semantic search for books
   GET    /ai/recommend/<book_id> -> recommend similar books
   GET    /ai/filters             -> available filters (categories, years, authors)
@@ -23,14 +24,15 @@ Notes:
   simple persistence across restarts.
 """
 import os
+import re
 import threading
 import logging
 import uuid
-import json
 from datetime import datetime
 from typing import Any, Dict, Optional, List
 
-from flask import Flask, request, jsonify
+import orjson
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 from config.settings import settings
@@ -123,6 +125,7 @@ logger = logging.getLogger("ai_engine_api")
 
 # ---- Ensure chat session folder exists ----
 CHAT_SESSION_DIR = os.path.join(settings.DATA_PROCESSED_DIR, "chat_sessions")
+CHAT_ERROR_ANSWER = "Đã có lỗi xảy ra khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
 os.makedirs(CHAT_SESSION_DIR, exist_ok=True)
 
 # ---- Singletons (lazy init) ----
@@ -224,8 +227,8 @@ def load_session(session_id: str) -> Dict:
     path = _session_path(session_id)
     if os.path.exists(path):
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
         except Exception as e:
             logger.error("Failed to load session %s: %s", session_id, e)
     # default new session shape
@@ -239,8 +242,8 @@ def load_session(session_id: str) -> Dict:
 def save_session(session: Dict):
     path = _session_path(session["id"])
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(session, f, ensure_ascii=False, indent=2)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(session, option=orjson.OPT_INDENT_2))
     except Exception as e:
         logger.error("Failed to save session %s: %s", session.get("id"), e)
 
@@ -406,17 +409,111 @@ def api_chat():
         "history": [...]
       }
     """
+    params, err = _parse_chat_request()
+    if err:
+        return err
+    message, session_id, top_k, filters = params
+
+    # ===== 4. LOAD/CREATE SESSION =====
+    session = load_session(session_id)
+    append_message(session, "user", message)
+
+    # ===== 5. INITIALIZE RAG ENGINE =====
+    try:
+        rag = get_rag_engine(top_k=top_k)
+    except Exception as e:
+        return error(f"Failed to init RAG Engine: {e}", 500)
+    # 2) Generate Answer using RAG Engine (handles intent + search + history)
+    try:
+        result = rag.generate_answer(question=message, session_id=session_id, filters=filters)
+        answer = result["answer"]
+        intent = result.get("intent", "UNKNOWN")
+        # Only return sources for SEARCH intent, empty for others
+        results = result.get("sources", [])
+        logger.info(f"Chat response - Intent: {intent}, Sources count: {len(results)}")
+
+    except Exception as e:
+        logger.exception("RAG generation failed")
+        answer = CHAT_ERROR_ANSWER
+        results = []
+
+    append_message(session, "assistant", answer)
+
+    # Save session (already saved in append_message)
+    return success({
+        "session_id": session_id,
+        "answer": answer,
+        "sources": _format_sources(results),
+        "history": session["messages"]
+    })
+
+
+@app.route("/ai/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """
+    Same body as /ai/chat, answered as Server-Sent Events so the UI can render the
+    answer while Gemini is still generating it:
+      data: {"type": "token", "text": "..."}      (repeated; book lists arrive first)
+      data: {"type": "done", "session_id": "...", "answer": "...", "sources": [...], "history": [...]}
+    Token texts concatenate to the answer; "done.answer" is authoritative.
+    """
+    params, err = _parse_chat_request()
+    if err:
+        return err
+    message, session_id, top_k, filters = params
+
+    session = load_session(session_id)
+    append_message(session, "user", message)
+
+    try:
+        rag = get_rag_engine(top_k=top_k)
+    except Exception as e:
+        return error(f"Failed to init RAG Engine: {e}", 500)
+
+    def events():
+        result = {}
+        try:
+            for event in rag.stream_answer(message, session_id=session_id, filters=filters):
+                if event["type"] == "done":
+                    result = event
+                else:
+                    yield _sse(event)
+            answer = result["answer"]
+            results = result.get("sources", [])
+        except Exception:
+            logger.exception("RAG generation failed")
+            answer = CHAT_ERROR_ANSWER
+            results = []
+
+        append_message(session, "assistant", answer)
+        yield _sse({
+            "type": "done",
+            "session_id": session_id,
+            "answer": answer,
+            "sources": _format_sources(results),
+            "history": session["messages"]
+        })
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _sse(event: Dict) -> bytes:
+    return b"data: " + orjson.dumps(event, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
+
+
+def _parse_chat_request():
+    """Validate a /ai/chat body -> ((message, session_id, top_k, filters), None) or (None, error)."""
     payload = request.get_json(silent=True) or {}
     message = (payload.get("message") or "").strip()
     if not message:
-        return error("Missing 'message' in body", 400)
+        return None, error("Missing 'message' in body", 400)
 
     session_id = (payload.get("session_id") or "").strip()
     if session_id:
         # Validate session_id format
-        import re
         if not re.match(r'^[a-zA-Z0-9_-]{1,64}$', session_id):
-            return error("Invalid session_id format. Use only alphanumeric, dash, underscore (max 64 chars).", 400)
+            return None, error("Invalid session_id format. Use only alphanumeric, dash, underscore (max 64 chars).", 400)
     else:
         session_id = "s_" + uuid.uuid4().hex[:12]
 
@@ -432,41 +529,16 @@ def api_chat():
     filters = _normalize_filters(filters)
 
     # Extract category from filters if provided by FE
-    category_filter = None
     if filters and filters.get("category"):
-        category_filter = filters.get("category")
-        logger.info(f"Chat with category filter from FE: {category_filter}")
+        logger.info(f"Chat with category filter from FE: {filters.get('category')}")
 
-    # ===== 4. LOAD/CREATE SESSION =====
-    session = load_session(session_id)
-    append_message(session, "user", message)
+    return (message, session_id, top_k, filters), None
 
-    # ===== 5. INITIALIZE RAG ENGINE =====
-    try:
-        rag = get_rag_engine(top_k=top_k)
-    except Exception as e:
-        return error(f"Failed to init RAG Engine: {e}", 500)
-    # 2) Generate Answer using RAG Engine (handles intent + search + history)
-    try:
-        result = rag.generate_answer(question=message, session_id=session_id, filters=filters)
-        answer = result["answer"]
-        intent = result.get("intent", "UNKNOWN")
-        # Only return sources for SEARCH intent, empty for others
-        results = result.get("sources", [])
-        logger.info(f"Chat response - Intent: {intent}, Sources count: {len(results)}")
-
-    except Exception as e:
-        logger.exception("RAG generation failed")
-        answer = "Đã có lỗi xảy ra khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
-        results = []
-
-    append_message(session, "assistant", answer)
 
-    # Save session (already saved in append_message)
-    # Build sources structure to return
-    sources = []
-    for r in results:
-        sources.append({
+def _format_sources(results: List[Dict]) -> List[Dict]:
+    """Build sources structure to return"""
+    return [
+        {
             "identifier": r.get("identifier"),
             "title": r.get("title"),
             "authors": r.get("authors"),
@@ -474,14 +546,9 @@ def api_chat():
             "publish_year": r.get("publish_year"),
             "score": r.get("score"),
             "richtext": r.get("richtext")
-        })
-
-    return success({
-        "session_id": session_id,
-        "answer": answer,
-        "sources": sources,
-        "history": session["messages"]
-    })
+        }
+        for r in results
+    ]
 
 
 @app.route("/ai/chat/history/<session_id>", methods=["GET"])
@@ -1,6 +1,7 @@
 import mysql.connector
 from mysql.connector import pooling
 import logging
+import threading
 from config.settings import settings
 
 logger = logging.getLogger("Database")
@@ -8,19 +9,25 @@ logger = logging.getLogger("Database")
 
 class DatabaseConnection:
     _pool = None
+    _pool_lock = threading.Lock()
 
     @classmethod
     def get_pool(cls):
-        if cls._pool is None:
+        if cls._pool is not None:
+            return cls._pool
+        with cls._pool_lock:
+            if cls._pool is not None:
+                return cls._pool
             cls._pool = pooling.MySQLConnectionPool(
                 pool_name="library_pool",
-                pool_size=5,
+                pool_size=settings.DB_POOL_SIZE,
                 host=settings.DB_HOST,
                 port=settings.DB_PORT,
                 user=settings.DB_USER,
                 password=settings.DB_PASSWORD,
                 database=settings.DB_NAME,
-                autocommit=False
+                autocommit=False,
+                use_pure=False  # C extension: faster executemany/row parsing
             )
             logger.info("Database connection pool created")
         return cls._pool
@@ -33,4 +40,21 @@ class DatabaseConnection:
 
 # Usage example
 def get_db():
-    return DatabaseConnection.get_connection()
\ No newline at end of file
+    return DatabaseConnection.get_connection()
+
+
+def get_bulk_load_db():
+    """
+    Dedicated (non-pooled) connection with LOCAL INFILE enabled.
+    Only for bulk loads (DataInserter.bulk_load_books); the server must have local_infile=ON.
+    """
+    return mysql.connector.connect(
+        host=settings.DB_HOST,
+        port=settings.DB_PORT,
+        user=settings.DB_USER,
+        password=settings.DB_PASSWORD,
+        database=settings.DB_NAME,
+        autocommit=False,
+        use_pure=False,
+        allow_local_infile=True
+    )
@@ -5,6 +5,7 @@ tìm sách trên Google Books API, và tạo mô tả chi tiết tối đa 1000
 """
 
 import os
+import time
 import logging
 from typing import Optional, Dict, Any, Tuple
 from pathlib import Path
@@ -14,10 +15,11 @@ from dotenv import load_dotenv
 
 # Import prompt functions
 from src.rag.prompt import (
-    get_description_prompt_with_preview_text,
-    get_description_prompt_with_existing_desc,
     get_description_prompt_metadata_only,
-    get_description_prompt_for_template_ai
+    get_description_prompt_for_template_ai,
+    get_description_prompt,
+    get_description_prompts_batch,
+    estimate_output_tokens
 )
 
 # Constants
@@ -27,6 +29,19 @@ REQUEST_TIMEOUT = 15
 MAX_PREVIEW_LENGTH = 5000
 MIN_DESCRIPTION_LENGTH = 500
 DEFAULT_MAX_DESCRIPTION_LENGTH = 1000
+# Per-call Gemini timeout; a stalled call is retried once, then the smaller
+# metadata-only prompt is tried before falling back to the template
+LLM_TIMEOUT_SECONDS = float(os.getenv("DESCRIPTION_LLM_TIMEOUT", "15"))
+LLM_TIMEOUT_RETRIES = 1
+
+# Gemini Batch Mode (bulk backfill, không dùng cho request realtime)
+BATCH_MODEL = "gemini-2.0-flash"
+BATCH_POLL_INTERVAL = 30  # seconds
+# Give up (cancel the job, use templates) if the job is still running after this long
+BATCH_MAX_WAIT = float(os.getenv("DESCRIPTION_BATCH_MAX_WAIT", str(6 * 3600)))  # seconds
+BATCH_TERMINAL_STATES = {
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"
+}
 
 # Category keywords for smart template matching
 # NOTE: Đây chỉ là từ khóa để PHÁT HIỆN loại sách, KHÔNG GIỚI HẠN category từ FE
@@ -73,6 +88,7 @@ class BookDescriptionGenerator:
         self.gemini_api_key = os.getenv("GEMINI_API_KEY") or self.google_api_key
         self.base_url = GOOGLE_BOOKS_BASE_URL
         self._gemini_model = None  # Lazy loading
+        self._batch_client = None  # Lazy loading
         logger.info("BookDescriptionGenerator initialized")
 
     def _get_api_key(self, key_name: str) -> str:
@@ -98,6 +114,14 @@ class BookDescriptionGenerator:
                 logger.warning(f"Gemini AI not available: {str(e)}")
         return self._gemini_model
 
+    @property
+    def batch_client(self):
+        """Lazy load google-genai client (Batch Mode chỉ có trong SDK mới)."""
+        if self._batch_client is None:
+            from google import genai
+            self._batch_client = genai.Client(api_key=self.gemini_api_key)
+        return self._batch_client
+
     def _build_search_strategies(self, title: Optional[str], authors: Optional[str], category: Optional[str]) -> list[str]:
         """
         Build prioritized list of search query strategies.
@@ -352,58 +376,109 @@ class BookDescriptionGenerator:
 
     def _get_appropriate_prompt(self, metadata: Dict[str, str], max_length: int) -> str:
         """Get appropriate prompt based on available data."""
-        if metadata['preview_text']:
-            logger.info(f"Using preview text ({len(metadata['preview_text'])} chars)")
-            return get_description_prompt_with_preview_text(
-                title=metadata['title'],
-                authors=metadata['authors'],
-                categories=metadata['categories'],
-                publisher=metadata['publisher'],
-                published_date=metadata['published_date'],
-                preview_text=metadata['preview_text'],
-                max_length=max_length
-            )
+        logger.info(f"Building prompt (preview: {len(metadata['preview_text'])} chars, "
+                    f"existing description: {len(metadata['existing_desc'])} chars)")
+        return get_description_prompt(metadata, max_length)
 
-        if metadata['existing_desc']:
-            logger.info(f"Using existing description ({len(metadata['existing_desc'])} chars)")
-            return get_description_prompt_with_existing_desc(
-                title=metadata['title'],
-                authors=metadata['authors'],
-                categories=metadata['categories'],
-                publisher=metadata['publisher'],
-                published_date=metadata['published_date'],
-                existing_desc=metadata['existing_desc'],
-                max_length=max_length
-            )
+    def _truncate_description(self, description: str, max_length: int) -> str:
+        """Truncate description to max_length at a word boundary."""
+        if len(description) > max_length:
+            logger.info(f"Description too long ({len(description)} chars), truncating...")
+            description = description[:max_length].rsplit(' ', 1)[0] + "..."
+        return description
 
-        return get_description_prompt_metadata_only(
-            title=metadata['title'],
-            authors=metadata['authors'],
-            categories=metadata['categories'],
-            published_date=metadata['published_date'],
-            max_length=max_length
-        )
+    def _stream_with_gemini(self, prompt: str, max_length: int) -> str:
+        """
+        Stream a Gemini response and stop reading once it passes max_length.
+        Anything past the limit would be truncated anyway, so the rest of the
+        generation is abandoned instead of waited for.
+        """
+        from google.api_core import exceptions as google_exceptions
+
+        for attempt in range(LLM_TIMEOUT_RETRIES + 1):
+            try:
+                response = self.gemini_model.generate_content(
+                    prompt,
+                    stream=True,
+                    generation_config={"max_output_tokens": estimate_output_tokens(max_length)},
+                    request_options={"timeout": LLM_TIMEOUT_SECONDS}
+                )
+                text = ""
+                for chunk in response:
+                    try:
+                        piece = chunk.text
+                    except Exception:
+                        # Blocked or part-less chunk: the SDK raises on .text, nothing more will come
+                        logger.warning("Gemini stream returned a blocked/empty chunk, ending stream")
+                        break
+                    text += piece or ""
+                    if len(text) > max_length:
+                        logger.info(f"Response passed {max_length} chars, stopping stream early")
+                        break
+                return text.strip()
+            except (google_exceptions.DeadlineExceeded, TimeoutError):
+                logger.warning(f"Gemini call timed out after {LLM_TIMEOUT_SECONDS}s "
+                               f"(attempt {attempt + 1}/{LLM_TIMEOUT_RETRIES + 1})")
+        raise TimeoutError(f"Gemini did not respond within {LLM_TIMEOUT_SECONDS}s")
 
     def _generate_with_gemini(self, prompt: str, max_length: int) -> str:
         """Generate description using Gemini AI with retry logic."""
-        response = self.gemini_model.generate_content(prompt)
-        description = response.text.strip()
+        description = self._stream_with_gemini(prompt, max_length)
 
         # Retry if description is too short
         if len(description) < MIN_DESCRIPTION_LENGTH:
             logger.warning(f"Description too short ({len(description)} chars), regenerating...")
             retry_prompt = prompt + f"\n\n**LƯU Ý QUAN TRỌNG:** Mô tả phải có TỐI THIỂU {MIN_DESCRIPTION_LENGTH} ký tự. Hãy viết CHI TIẾT hơn."
-            retry_response = self.gemini_model.generate_content(retry_prompt)
-            description = retry_response.text.strip()
+            description = self._stream_with_gemini(retry_prompt, max_length)
 
         # Truncate if too long
-        if len(description) > max_length:
-            logger.info(f"Description too long ({len(description)} chars), truncating...")
-            description = description[:max_length].rsplit(' ', 1)[0] + "..."
+        description = self._truncate_description(description, max_length)
 
         logger.info(f"Generated description: {len(description)} characters")
         return description
 
+    def _generate_batch_with_gemini(self, prompts: list[str], max_length: int) -> list[Optional[str]]:
+        """
+        Generate many descriptions in one Gemini Batch Mode job (inline requests).
+        Returns one text per prompt, in order; None where that request failed.
+        """
+        client = self.batch_client
+        job = client.batches.create(
+            model=BATCH_MODEL,
+            src=[
+                {
+                    "contents": [{"role": "user", "parts": [{"text": p}]}],
+                    "config": {"max_output_tokens": estimate_output_tokens(max_length)},
+                }
+                for p in prompts
+            ],
+            config={"display_name": f"book-descriptions-{int(time.time())}"},
+        )
+        logger.info(f"Submitted batch job {job.name} ({len(prompts)} requests)")
+
+        deadline = time.monotonic() + BATCH_MAX_WAIT
+        while job.state.name not in BATCH_TERMINAL_STATES:
+            if time.monotonic() >= deadline:
+                try:
+                    client.batches.cancel(name=job.name)
+                except Exception as e:
+                    logger.warning(f"Could not cancel batch job {job.name}: {e}")
+                raise TimeoutError(f"Batch job {job.name} chưa xong sau {BATCH_MAX_WAIT:.0f}s, đã hủy")
+            time.sleep(BATCH_POLL_INTERVAL)
+            job = client.batches.get(name=job.name)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise Exception(f"Batch job {job.name} kết thúc với trạng thái {job.state.name}")
+
+        texts = []
+        for item in job.dest.inlined_responses:
+            if item.response and item.response.text:
+                texts.append(item.response.text.strip())
+            else:
+                logger.warning(f"Batch request failed: {item.error}")
+                texts.append(None)
+        return texts
+
     def generate_detailed_description(self,
                                       book_data: Optional[Dict[str, Any]],
                                       input_title: Optional[str],
@@ -439,7 +514,21 @@ class BookDescriptionGenerator:
             prompt = self._get_appropriate_prompt(metadata, max_length)
 
             try:
-                return self._generate_with_gemini(prompt, max_length)
+                try:
+                    return self._generate_with_gemini(prompt, max_length)
+                except TimeoutError:
+                    if not (metadata['preview_text'] or metadata['existing_desc']):
+                        raise
+                    # Retry with the smallest prompt, which is also the fastest to process
+                    logger.warning("Retrying with metadata-only prompt after timeout...")
+                    prompt = get_description_prompt_metadata_only(
+                        title=metadata['title'],
+                        authors=metadata['authors'],
+                        categories=metadata['categories'],
+                        published_date=metadata['published_date'],
+                        max_length=max_length
+                    )
+                    return self._generate_with_gemini(prompt, max_length)
             except Exception as e:
                 logger.error(f"Failed to generate description with Gemini AI: {str(e)}")
                 # Fall back to template
@@ -559,8 +648,7 @@ class BookDescriptionGenerator:
                     existing_desc=existing_desc
                 )
 
-                response = self.gemini_model.generate_content(ai_prompt)
-                ai_description = response.text.strip()
+                ai_description = self._stream_with_gemini(ai_prompt, max_length)
 
                 if 200 <= len(ai_description) <= max_length:
                     logger.info(f"Successfully generated unique AI description ({len(ai_description)} chars)")
@@ -596,6 +684,23 @@ Tác giả {book_authors} kết hợp lý thuyết và thực tiễn, trình bà
 
         return description.strip()
 
+    def _build_result(self, book_data: Optional[Dict[str, Any]],
+                      title: Optional[str], authors: Optional[str], category: Optional[str],
+                      description: str) -> Dict[str, Any]:
+        """Build the success response returned by generate_description()."""
+        return {
+            "status": "success",
+            "message": "Đã tạo mô tả thành công",
+            "data": {
+                "title": book_data.get('title', title) if book_data else (title or 'không rõ'),
+                "authors": book_data.get('authors', [authors] if authors else []) if book_data else ([authors] if authors else []),
+                "category": category or 'không rõ',
+                "description": description,
+                "description_length": len(description),
+                "source": "google_books" if book_data else "template",
+            }
+        }
+
     def generate_description(self,
                              title: Optional[str] = None,
                              authors: Optional[str] = None,
@@ -658,18 +763,7 @@ Tác giả {book_authors} kết hợp lý thuyết và thực tiễn, trình bà
                 book_data, title, authors, category, max_length=1000
             )
 
-            result = {
-                "status": "success",
-                "message": "Đã tạo mô tả thành công",
-                "data": {
-                    "title": book_data.get('title', title) if book_data else (title or 'không rõ'),
-                    "authors": book_data.get('authors', [authors] if authors else []) if book_data else ([authors] if authors else []),
-                    "category": category or 'không rõ',
-                    "description": description,
-                    "description_length": len(description),
-                    "source": "google_books" if book_data else "template",
-                }
-            }
+            result = self._build_result(book_data, title, authors, category, description)
 
             logger.info(f"Description generated successfully: {len(description)} characters")
             return result
@@ -689,3 +783,57 @@ Tác giả {book_authors} kết hợp lý thuyết và thực tiễn, trình bà
                 "message": f"Lỗi khi tạo mô tả: {str(e)}",
                 "data": None
             }
+
+    def generate_descriptions_batch(self,
+                                    books: list[Dict[str, Optional[str]]],
+                                    max_length: int = DEFAULT_MAX_DESCRIPTION_LENGTH) -> list[Dict[str, Any]]:
+        """
+        Tạo mô tả cho nhiều sách qua Gemini Batch Mode (rẻ hơn ~50%, throughput cao hơn).
+        Dùng cho job backfill/refresh hàng loạt; job có thể mất vài phút tới vài giờ,
+        request realtime vẫn dùng generate_description().
+
+        Args:
+            books: Danh sách dict {"title", "authors", "category"} (mỗi field optional)
+            max_length: Độ dài tối đa mỗi mô tả
+
+        Returns:
+            Danh sách kết quả cùng thứ tự và cùng định dạng với generate_description()
+        """
+        results: list[Optional[Dict[str, Any]]] = [None] * len(books)
+        pending = []  # (index, book_data, metadata)
+
+        for i, book in enumerate(books):
+            title, authors, category = book.get('title'), book.get('authors'), book.get('category')
+            if not any([title, authors, category]):
+                results[i] = {
+                    "status": "error",
+                    "message": "Cần ít nhất một trong ba tham số: title, authors, hoặc category",
+                    "data": None
+                }
+                continue
+            book_data = self.search_google_books(title, authors, category)
+            metadata = self._extract_book_metadata(book_data, title, authors, category)
+            pending.append((i, book_data, metadata))
+
+        texts: list[Optional[str]] = [None] * len(pending)
+        if pending and self.gemini_api_key:
+            prompts = get_description_prompts_batch([m for _, _, m in pending], max_length)
+            try:
+                texts = self._generate_batch_with_gemini(prompts, max_length)
+            except Exception as e:
+                logger.error(f"Batch generation failed: {str(e)}, using template fallback...")
+
+        for (i, book_data, _), text in zip(pending, texts):
+            book = books[i]
+            if text and len(text) >= MIN_DESCRIPTION_LENGTH:
+                description = self._truncate_description(text, max_length)
+            else:
+                description = self._generate_template_description(
+                    book_data, book.get('title'), book.get('authors'), book.get('category'), max_length
+                )
+            results[i] = self._build_result(
+                book_data, book.get('title'), book.get('authors'), book.get('category'), description
+            )
+
+        logger.info(f"Batch description generation done: {len(books)} books")
+        return results
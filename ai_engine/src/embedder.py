@@ -1,4 +1,6 @@
 import logging
+import threading
+from concurrent.futures import Future
 import torch
 from sentence_transformers import SentenceTransformer
 from config.settings import settings
@@ -52,3 +54,60 @@ class Embedder:
         except Exception as e:
             logger.error(f"Error embedding batch: {e}")
             return []
+
+
+class BatchingEmbedder:
+    """
+    Wraps an Embedder so concurrent query embeddings (one per API request thread)
+    go through one embed_batch() call instead of one model forward pass each.
+    No fixed wait window: a query arriving while the model is idle runs at once;
+    queries arriving while a batch is running are coalesced into the next batch.
+    Everything else (passages, embed_batch, .model) goes straight to the wrapped Embedder.
+    """
+
+    def __init__(self, embedder: Embedder, max_batch: int = 32):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self._pending = []  # [(text, Future)]
+        self._lock = threading.Lock()
+        self._has_work = threading.Event()
+        threading.Thread(target=self._run, name="embed-batcher", daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+    def embed_text(self, text, is_query=False):
+        if not text or not is_query:
+            return self.embedder.embed_text(text, is_query=is_query)
+        future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            self._has_work.set()
+        try:
+            return future.result()
+        except Exception:
+            return None  # Same contract as Embedder.embed_text(); the batcher logged the error
+
+    def _run(self):
+        while True:
+            self._has_work.wait()
+            with self._lock:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                if not self._pending:
+                    self._has_work.clear()
+
+            try:
+                vectors = self.embedder.embed_batch([text for text, _ in batch], is_query=True)
+                if len(vectors) != len(batch):  # embed_batch logs and returns [] on failure
+                    vectors = [None] * len(batch)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+                if len(batch) > 1:
+                    logger.debug(f"Embedded {len(batch)} queued queries in one batch")
+            except Exception as e:
+                # Keep the worker alive: callers block on future.result() with no timeout
+                logger.error(f"Error in embed batcher: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
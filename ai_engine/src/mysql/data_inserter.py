@@ -1,5 +1,9 @@
+import csv
 import logging
+import os
 import re
+import tempfile
+from contextlib import contextmanager
 from typing import Optional, List
 
 from src.database import get_db
@@ -9,21 +13,38 @@ from config.categories import CATEGORIES_MAPPING  # Import categories mapping
 logger = logging.getLogger("DataInserter")
 
 
+def _parse_year(year_str) -> Optional[int]:
+    """Parse publish_year ("2019", "N/A", "" or None) into an int or None."""
+    return int(year_str) if year_str and year_str[0].isdigit() and year_str.isdigit() else None
+
+
+def print_insert_stats(stats: dict):
+    """Print insertion statistics (single inserter or aggregated across workers)"""
+    print("\n" + "="*60)
+    print("DATA INSERTION STATISTICS")
+    print("="*60)
+    print(f"Books inserted:      {stats['books_inserted']}")
+    print(f"Books skipped:       {stats['books_skipped']}")
+    print(f"Publishers created:  {stats['publishers_created']}")
+    print(f"Categories created:  {stats['categories_created']}")
+    print(f"Authors created:     {stats['authors_created']}")
+    print("="*60 + "\n")
+
+
 class DataInserter:
     """
     Insert processed book data into MySQL database.
     Handles publishers, categories, authors, and N-N relationships.
     """
     
-    def __init__(self):
-        self.conn = get_db()
-        self.cursor = self.conn.cursor(dictionary=True)
+    def __init__(self, conn=None):
+        # Accept an injected (pooled) connection so callers can run one inserter per worker
+        self.conn = conn or get_db()
+        # Plain tuple cursor: every read here is 1-2 columns, no need for per-row dicts
+        self.cursor = self.conn.cursor()
         
-        # Caches to avoid duplicate queries
-        self._publisher_cache = {}
-        self._category_cache = {}
-        self._author_cache = {}
-        self._shelf_cache = {}
+        # Caches to avoid duplicate queries (name/code -> id), filled once up front
+        self._prefetch_caches()
         
         # Stats
         self.stats = {
@@ -34,77 +55,56 @@ class DataInserter:
             "authors_created": 0
         }
     
-    def insert_book(self, processed_data: dict) -> Optional[int]:
+    def _prefetch_caches(self):
+        """
+        Load all publishers/categories/authors/shelves into caches up front.
+        Lookup tables are small, so one SELECT per table replaces a SELECT per new name.
+        """
+        self.cursor.execute("SELECT name, publisher_id FROM publishers")
+        self._publisher_cache = dict(self.cursor.fetchall())
+        
+        self.cursor.execute("SELECT name, category_id FROM categories")
+        self._category_cache = dict(self.cursor.fetchall())
+        
+        self.cursor.execute("SELECT name, author_id FROM authors")
+        self._author_cache = dict(self.cursor.fetchall())
+        
+        self.cursor.execute("SELECT code, shelf_id FROM shelves")
+        self._shelf_cache = dict(self.cursor.fetchall())
+        
+        logger.info(
+            f"Prefetched caches: {len(self._publisher_cache)} publishers, "
+            f"{len(self._category_cache)} categories, {len(self._author_cache)} authors, "
+            f"{len(self._shelf_cache)} shelves"
+        )
+    
+    def insert_book(self, processed_data: dict, resolved: Optional[dict] = None) -> Optional[int]:
         """
         Insert a single book from DataProcessor output.
         
         Args:
             processed_data: Output from DataProcessor.clean_item()
+            resolved: Output of _resolve_batch() for a batch containing this book
+                      (resolved on the fly when not given)
             
         Returns:
             book_id if successful, None otherwise
         """
+        title = processed_data.get("title")
         try:
-            # Extract data
-            api_id = processed_data.get("id")
+            resolved = resolved or self._resolve_batch([processed_data])
             identifier = processed_data.get("identifier")
-            title = processed_data.get("title")
-            description = processed_data.get("description", "")
             
-            # Parse year - FIX: use publish_year
-            year_str = processed_data.get("publish_year", "N/A")
-            publish_year = int(year_str) if year_str.isdigit() else None
-            
-            # Language mapping
-            lang_code = processed_data.get("language", "en")
-            language = self._map_language(lang_code)
-            
-            # Cover URL - Support both field names
-            cover_url = processed_data.get("cover_url") or processed_data.get("thumbnail")
-            
-            # Publisher
-            publisher_name = processed_data.get("publisher", "Unknown")
-            publisher_id = self._get_or_create_publisher(publisher_name)
-            
-            # Category
-            category_raw = processed_data.get("category", "General")
-            categories = self._normalize_categories([category_raw])
-            
-            # Authors
-            authors_str = processed_data.get("authors", "Unknown")
-            authors = self._parse_authors(authors_str)
-            
-            # Assign shelf
-            shelf_id = self._assign_shelf(categories)
-            
-            # Check if book already exists (by identifier)
-            if identifier:
-                self.cursor.execute(
-                    "SELECT book_id FROM books WHERE identifier = %s",
-                    (identifier,)
-                )
-                existing = self.cursor.fetchone()
-                if existing:
-                    logger.info(f"Book already exists: {title} (identifier: {identifier})")
-                    self.stats["books_skipped"] += 1
-                    return existing['book_id']
-            
-            # Insert book
+            # Insert book; on duplicate identifier (uq_books_identifier) keep the row
+            # and get its book_id back through LAST_INSERT_ID (no SELECT round-trip)
             self.cursor.execute("""
                 INSERT INTO books (
                     identifier, title, description, publish_year,
                     language, cover_url, publisher_id, shelf_id,
                     status, total_copies, available_copies, total_borrow_count
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                identifier,
-                title,
-                description if description else None,  # Full description
-                publish_year,
-                language,
-                cover_url,
-                publisher_id,
-                shelf_id,
+                ON DUPLICATE KEY UPDATE book_id = LAST_INSERT_ID(book_id)
+            """, self._book_row(processed_data, resolved) + (
                 'ACTIVE',
                 0,  # total_copies - No physical copies yet
                 0,  # available_copies
@@ -113,19 +113,19 @@ class DataInserter:
             
             book_id = self.cursor.lastrowid
             
-            # Link categories
-            for category in categories:
-                category_id = self._get_or_create_category(category)
-                self._link_book_category(book_id, category_id)
+            if self.cursor.rowcount != 1:
+                logger.debug("Book already exists: %s (identifier: %s)", title, identifier)
+                self.stats["books_skipped"] += 1
+                return book_id
             
-            # Link authors
-            for author in authors:
-                author_id = self._get_or_create_author(author)
-                self._link_book_author(book_id, author_id)
+            # Link categories and authors
+            category_raw = processed_data.get("category", "General")
+            self._link_book_categories(book_id, resolved["category_ids"][category_raw])
+            self._link_book_authors(book_id, resolved["author_ids"][processed_data.get("authors", "Unknown")])
             
             self.conn.commit()
             self.stats["books_inserted"] += 1
-            logger.info(f"Inserted: {title} (book_id={book_id})")
+            logger.debug("Inserted: %s (book_id=%s)", title, book_id)
             
             return book_id
             
@@ -135,6 +135,192 @@ class DataInserter:
             self.stats["books_skipped"] += 1
             return None
     
+    def _book_row(self, processed_data: dict, resolved: dict) -> tuple:
+        """
+        Build the books column values shared by insert_book() and bulk_load_books():
+        (identifier, title, description, publish_year, language, cover_url, publisher_id, shelf_id)
+        """
+        description = processed_data.get("description", "")
+        
+        publish_year = _parse_year(processed_data.get("publish_year"))
+        
+        # Language mapping
+        language = self._map_language(processed_data.get("language", "en"))
+        
+        # Cover URL - Support both field names
+        cover_url = processed_data.get("cover_url") or processed_data.get("thumbnail")
+        
+        # Publisher / categories (pre-resolved per batch) and shelf
+        publisher_id = resolved["publisher_ids"][processed_data.get("publisher", "Unknown")]
+        categories = resolved["categories"][processed_data.get("category", "General")]
+        shelf_id = self._assign_shelf(categories)
+        
+        return (
+            processed_data.get("identifier"),
+            processed_data.get("title"),
+            description if description else None,  # Full description
+            publish_year,
+            language,
+            cover_url,
+            publisher_id,
+            shelf_id,
+        )
+    
+    def insert_books_bulk(self, books: List[dict]) -> int:
+        """
+        Insert a batch of books from DataProcessor output.
+
+        Args:
+            books: List of DataProcessor.clean_item() outputs
+
+        Returns:
+            Number of books inserted from this batch
+        """
+        try:
+            resolved = self._resolve_batch(books)
+        except Exception as e:
+            # Fall back to resolving book by book so one bad name doesn't drop the batch
+            logger.error(f"Failed to resolve batch names: {e}")
+            self.conn.rollback()
+            resolved = None
+        
+        inserted_before = self.stats["books_inserted"]
+        for processed_data in books:
+            self.insert_book(processed_data, resolved)
+        return self.stats["books_inserted"] - inserted_before
+    
+    def bulk_load_books(self, books: List[dict]) -> int:
+        """
+        Load a large batch of books with LOAD DATA LOCAL INFILE (initial sync path).
+        Foreign keys are resolved in Python first, books already in the table are
+        skipped, then books and N-N links are each loaded from one temporary CSV.
+        
+        Requires a connection opened with allow_local_infile (see src.database.get_bulk_load_db).
+        
+        Returns:
+            Number of books inserted from this batch
+        """
+        try:
+            resolved = self._resolve_batch(books)
+            
+            # Drop books already in the table (and duplicates inside the batch)
+            by_identifier = {b.get("identifier"): b for b in books if b.get("identifier")}
+            existing = self._fetch_book_ids(list(by_identifier))
+            new_books = [b for ident, b in by_identifier.items() if ident not in existing]
+            
+            rows = [self._book_row(b, resolved) for b in new_books]
+            self._load_data_infile(
+                "books",
+                "(identifier, title, @description, @publish_year, language, @cover_url, @publisher_id, shelf_id) "
+                "SET description = NULLIF(@description, ''), publish_year = NULLIF(@publish_year, ''), "
+                "cover_url = NULLIF(@cover_url, ''), publisher_id = NULLIF(@publisher_id, '')",
+                rows
+            )
+            inserted = self.cursor.rowcount
+            
+            # Read back assigned book_ids with one SELECT, then load link tables
+            book_ids = self._fetch_book_ids([b["identifier"] for b in new_books])
+            category_links, author_links = [], []
+            for b in new_books:
+                book_id = book_ids.get(b["identifier"])
+                if book_id is None:
+                    continue
+                category_ids = resolved["category_ids"][b.get("category", "General")]
+                author_ids = resolved["author_ids"][b.get("authors", "Unknown")]
+                category_links.extend((book_id, cid) for cid in category_ids)
+                author_links.extend((book_id, aid) for aid in author_ids)
+            
+            self._load_data_infile("book_categories", "(book_id, category_id)", category_links)
+            self._load_data_infile("book_authors", "(book_id, author_id)", author_links)
+            
+            self.conn.commit()
+            self.stats["books_inserted"] += inserted
+            self.stats["books_skipped"] += len(books) - inserted
+            logger.info(f"Bulk loaded {inserted}/{len(books)} books")
+            return inserted
+        
+        except Exception as e:
+            logger.error(f"Bulk load failed for batch of {len(books)} books: {e}")
+            self.conn.rollback()
+            self.stats["books_skipped"] += len(books)
+            return 0
+    
+    @contextmanager
+    def relaxed_checks(self):
+        """
+        Disable foreign key checks on this session for a bulk load, restore after.
+        Safe because bulk_load_books() pre-resolves every foreign key in Python.
+        unique_checks stays on: files are loaded by parallel workers, and LOAD DATA IGNORE
+        plus the get-or-create upserts rely on unique keys to reject cross-file duplicates.
+        """
+        self.cursor.execute("SET foreign_key_checks = 0")
+        try:
+            yield
+        finally:
+            self.cursor.execute("SET foreign_key_checks = 1")
+    
+    def _fetch_book_ids(self, identifiers: List[str], chunk_size: int = 1000) -> dict:
+        """Map identifier -> book_id for identifiers that exist in the books table"""
+        book_ids = {}
+        for i in range(0, len(identifiers), chunk_size):
+            chunk = identifiers[i:i + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            self.cursor.execute(
+                f"SELECT identifier, book_id FROM books WHERE identifier IN ({placeholders})",
+                chunk
+            )
+            book_ids.update(self.cursor.fetchall())
+        return book_ids
+    
+    def _load_data_infile(self, table: str, columns: str, rows: List[tuple]):
+        """Write rows to a temporary CSV and LOAD DATA LOCAL INFILE it into table"""
+        if not rows:
+            return
+        
+        fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix=f"{table}_")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                # None -> "" (mapped back to NULL via NULLIF in the SET clause)
+                csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n").writerows(rows)
+            
+            self.cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table} "
+                "CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY ',' ENCLOSED BY '\"' ESCAPED BY '' "
+                f"LINES TERMINATED BY '\\n' {columns}",
+                (csv_path,)
+            )
+        finally:
+            os.remove(csv_path)
+    
+    def _resolve_batch(self, books: List[dict]) -> dict:
+        """
+        Resolve every distinct publisher/category/author string in the batch once.
+        Books in a batch mostly share these, so per-book work becomes dict lookups
+        keyed by the raw field value.
+        """
+        publishers_raw = {b.get("publisher", "Unknown") for b in books}
+        categories_raw = {b.get("category", "General") for b in books}
+        authors_raw = {b.get("authors", "Unknown") for b in books}
+        
+        categories = {raw: self._normalize_categories([raw]) for raw in categories_raw}
+        authors = {raw: self._parse_authors(raw) for raw in authors_raw}
+        
+        resolved = {
+            "publisher_ids": {raw: self._get_or_create_publisher(raw) for raw in publishers_raw},
+            "categories": categories,
+            "category_ids": {
+                raw: [self._get_or_create_category(c) for c in names]
+                for raw, names in categories.items()
+            },
+            "author_ids": {
+                raw: [self._get_or_create_author(a) for a in names]
+                for raw, names in authors.items()
+            },
+        }
+        self.conn.commit()
+        return resolved
+
     def _map_language(self, lang_code: str) -> str:
         """Map language code to full name"""
         mapping = {
@@ -156,20 +342,12 @@ class DataInserter:
             if not cat or cat == "N/A":
                 continue
             
-            # Split by , and process each category
-            parts = cat.split(',')
-            for part in parts:
-                part = part.strip()
-                
-                # Map to Vietnamese if exists in mapping
-                vietnamese = CATEGORIES_MAPPING.get(part)
-                if vietnamese:
-                    normalized.append(vietnamese)
-                else:
-                    # Fallback: use normalized English name
-                    normalized.append(part)
-        
-        return list(set(normalized)) if normalized else ["Tổng hợp"]
+            # Split by , and map each part to Vietnamese (fallback: the English name itself)
+            parts = (p.strip() for p in cat.split(','))
+            normalized.extend(CATEGORIES_MAPPING.get(p) or p for p in parts if p)
+        
+        # Order-preserving dedup (first category drives shelf assignment)
+        return list(dict.fromkeys(normalized)) if normalized else ["Tổng hợp"]
     
     def _parse_authors(self, authors_str: str) -> List[str]:
         """Parse authors string to list"""
@@ -191,22 +369,15 @@ class DataInserter:
         if name in self._publisher_cache:
             return self._publisher_cache[name]
         
-        # Check exists
+        # Cache is prefetched, so a miss means the publisher is new
+        # (or was just created by a concurrent worker: LAST_INSERT_ID returns its id)
         self.cursor.execute(
-            "SELECT publisher_id FROM publishers WHERE name = %s",
+            "INSERT INTO publishers (name) VALUES (%s) "
+            "ON DUPLICATE KEY UPDATE publisher_id = LAST_INSERT_ID(publisher_id)",
             (name,)
         )
-        result = self.cursor.fetchone()
-        
-        if result:
-            publisher_id = result['publisher_id']
-        else:
-            # Insert new
-            self.cursor.execute(
-                "INSERT INTO publishers (name) VALUES (%s)",
-                (name,)
-            )
-            publisher_id = self.cursor.lastrowid
+        publisher_id = self.cursor.lastrowid
+        if self.cursor.rowcount == 1:
             self.stats["publishers_created"] += 1
             logger.debug(f"Created publisher: {name}")
         
@@ -225,19 +396,12 @@ class DataInserter:
             return self._category_cache[name]
         
         self.cursor.execute(
-            "SELECT category_id FROM categories WHERE name = %s",
+            "INSERT INTO categories (name) VALUES (%s) "
+            "ON DUPLICATE KEY UPDATE category_id = LAST_INSERT_ID(category_id)",
             (name,)
         )
-        result = self.cursor.fetchone()
-        
-        if result:
-            category_id = result['category_id']
-        else:
-            self.cursor.execute(
-                "INSERT INTO categories (name) VALUES (%s)",
-                (name,)
-            )
-            category_id = self.cursor.lastrowid
+        category_id = self.cursor.lastrowid
+        if self.cursor.rowcount == 1:
             self.stats["categories_created"] += 1
             logger.debug(f"Created category: {name}")
         
@@ -249,20 +413,15 @@ class DataInserter:
         if name in self._author_cache:
             return self._author_cache[name]
         
+        # Cache is prefetched, so a miss means the author is new
+        # (or was just created by a concurrent worker: LAST_INSERT_ID returns its id)
         self.cursor.execute(
-            "SELECT author_id FROM authors WHERE name = %s",
+            "INSERT INTO authors (name) VALUES (%s) "
+            "ON DUPLICATE KEY UPDATE author_id = LAST_INSERT_ID(author_id)",
             (name,)
         )
-        result = self.cursor.fetchone()
-        
-        if result:
-            author_id = result['author_id']
-        else:
-            self.cursor.execute(
-                "INSERT INTO authors (name) VALUES (%s)",
-                (name,)
-            )
-            author_id = self.cursor.lastrowid
+        author_id = self.cursor.lastrowid
+        if self.cursor.rowcount == 1:
             self.stats["authors_created"] += 1
             logger.debug(f"Created author: {name}")
         
@@ -317,51 +476,36 @@ class DataInserter:
         if code in self._shelf_cache:
             return self._shelf_cache[code]
         
-        self.cursor.execute(
-            "SELECT shelf_id FROM shelves WHERE code = %s",
-            (code,)
-        )
-        result = self.cursor.fetchone()
-        
-        if result:
-            shelf_id = result['shelf_id']
-            self._shelf_cache[code] = shelf_id
-            return shelf_id
-        
         # Fallback to first shelf
         return 1
     
-    def _link_book_category(self, book_id: int, category_id: int):
-        """Link book to category (N-N)"""
+    def _link_book_categories(self, book_id: int, category_ids: List[int]):
+        """Link book to categories (N-N) in one multi-row INSERT"""
+        if not category_ids:
+            return
         try:
-            self.cursor.execute("""
+            self.cursor.executemany("""
                 INSERT IGNORE INTO book_categories (book_id, category_id)
                 VALUES (%s, %s)
-            """, (book_id, category_id))
+            """, [(book_id, category_id) for category_id in category_ids])
         except Exception as e:
-            logger.error(f"Failed to link category: {e}")
+            logger.error(f"Failed to link categories: {e}")
     
-    def _link_book_author(self, book_id: int, author_id: int):
-        """Link book to author (N-N)"""
+    def _link_book_authors(self, book_id: int, author_ids: List[int]):
+        """Link book to authors (N-N) in one multi-row INSERT"""
+        if not author_ids:
+            return
         try:
-            self.cursor.execute("""
+            self.cursor.executemany("""
                 INSERT IGNORE INTO book_authors (book_id, author_id)
                 VALUES (%s, %s)
-            """, (book_id, author_id))
+            """, [(book_id, author_id) for author_id in author_ids])
         except Exception as e:
-            logger.error(f"Failed to link author: {e}")
+            logger.error(f"Failed to link authors: {e}")
     
     def print_stats(self):
         """Print insertion statistics"""
-        print("\n" + "="*60)
-        print("DATA INSERTION STATISTICS")
-        print("="*60)
-        print(f"Books inserted:      {self.stats['books_inserted']}")
-        print(f"Books skipped:       {self.stats['books_skipped']}")
-        print(f"Publishers created:  {self.stats['publishers_created']}")
-        print(f"Categories created:  {self.stats['categories_created']}")
-        print(f"Authors created:     {self.stats['authors_created']}")
-        print("="*60 + "\n")
+        print_insert_stats(self.stats)
     
     def close(self):
         """Close database connection"""
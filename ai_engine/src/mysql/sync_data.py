@@ -0,0 +1,131 @@
+"""
+Sync processed JSON books (clean_books_*.json) into MySQL.
+
+Usage:
+    python main.py sync-to-mysql [--bulk-load]
+    python -m src.mysql.sync_data [--bulk-load]
+
+--bulk-load uses LOAD DATA LOCAL INFILE (fastest path for large initial loads,
+requires local_infile=ON on the MySQL server) with foreign key checks disabled
+for the session. Unique checks stay on, so files that share identifiers or
+author/category/publisher names can still load in parallel without duplicates.
+"""
+
+import glob
+import logging
+import os
+import queue
+import sys
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+import ijson
+
+from config.settings import settings
+from src.database import get_db, get_bulk_load_db
+from src.mysql.data_inserter import DataInserter, print_insert_stats
+
+logger = logging.getLogger("SyncData")
+
+# Number of books accumulated before handing off to the inserter
+SYNC_BATCH_SIZE = 1000
+# Parsed batches buffered ahead of the inserter (bounds memory to a few batches)
+SYNC_PREFETCH_BATCHES = 2
+
+
+def _iter_books(json_file: str):
+    """Stream books one at a time instead of loading the whole file into memory."""
+    with open(json_file, "rb") as f:
+        yield from ijson.items(f, "item")
+
+
+def _iter_batches(json_file: str):
+    """Group streamed books into lists of SYNC_BATCH_SIZE."""
+    batch = []
+    for book in _iter_books(json_file):
+        batch.append(book)
+        if len(batch) >= SYNC_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prefetch_batches(json_file: str):
+    """
+    Parse batches in a background thread while the caller inserts the previous one,
+    so JSON parsing overlaps with MySQL round-trips.
+    """
+    done = object()
+    batches = queue.Queue(maxsize=SYNC_PREFETCH_BATCHES)
+    error = []
+
+    def reader():
+        try:
+            for batch in _iter_batches(json_file):
+                batches.put(batch)
+        except Exception as e:
+            error.append(e)
+        finally:
+            batches.put(done)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    while (batch := batches.get()) is not done:
+        yield batch
+    if error:
+        raise error[0]
+
+
+def _sync_file(json_file: str, bulk_load: bool = False) -> dict:
+    """Ingest one JSON file on its own connection. Returns inserter stats."""
+    logger.info(f"Syncing {os.path.basename(json_file)}")
+    inserter = DataInserter(conn=get_bulk_load_db() if bulk_load else get_db())
+    insert_batch = inserter.bulk_load_books if bulk_load else inserter.insert_books_bulk
+
+    try:
+        with inserter.relaxed_checks() if bulk_load else nullcontext():
+            for batch in _prefetch_batches(json_file):
+                insert_batch(batch)
+                # Per-book lines are DEBUG only; report progress once per batch
+                logger.info(
+                    f"{os.path.basename(json_file)}: {inserter.stats['books_inserted']} inserted, "
+                    f"{inserter.stats['books_skipped']} skipped so far"
+                )
+        return inserter.stats
+    finally:
+        inserter.close()
+
+
+def sync_to_mysql(bulk_load: bool = False):
+    """
+    Insert all processed JSON files into MySQL, one worker per file.
+
+    Args:
+        bulk_load: Use LOAD DATA LOCAL INFILE instead of row INSERTs
+    """
+    pattern = os.path.join(settings.DATA_PROCESSED_DIR, "clean_books_*.json")
+    json_files = sorted(glob.glob(pattern))
+
+    if not json_files:
+        logger.warning(f"No processed files found: {pattern}")
+        return
+
+    # Each worker holds one pooled connection, so never exceed the pool size
+    max_workers = min(len(json_files), settings.DB_POOL_SIZE)
+    logger.info(f"Found {len(json_files)} processed files, syncing with {max_workers} workers")
+
+    total_stats = Counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_stats in executor.map(lambda f: _sync_file(f, bulk_load), json_files):
+            total_stats.update(file_stats)
+
+    print_insert_stats(total_stats)
+
+
+if __name__ == "__main__":
+    from config.logging_config import setup_logging
+    setup_logging("sync_mysql", log_to_file=True)
+    sync_to_mysql(bulk_load="--bulk-load" in sys.argv)
@@ -1,10 +1,146 @@
-from .rag_engine_new import RAGEngine
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
+try:
+    import readline  # Line editing, history and tab completion (not available on Windows)
+except ImportError:
+    readline = None
 
-def main():
-    """Main chat loop for CLI testing"""
+from config.settings import settings
 
-    rag = RAGEngine(top_k=5)
+# RAGEngine / SemanticCache pull in the embedding model, Chroma, numpy and the Gemini SDK.
+# They are imported inside main() so --help and early exits don't pay for them.
+if TYPE_CHECKING:
+    from .rag_engine_new import RAGEngine
+    from .semantic_cache import SemanticCache
+
+# Used when the engine has no suggestions of its own
+DEFAULT_SUGGESTIONS = (
+    "Tìm sách về Python",
+    "Sách Machine Learning hay nhất",
+    "Thư viện có bao nhiêu cuốn sách",
+    "Giờ mở cửa thư viện?",
+    "Quy định mượn sách như thế nào?",
+)
+
+
+def answer_question(rag: "RAGEngine", cache: "SemanticCache", question: str, session_id: str,
+                    prefetched=None, on_token=None) -> dict:
+    """
+    generate_answer() behind the semantic cache; cache hits still update the session.
+    prefetched: Future of an answer computed ahead of time (suggestions), used if it succeeded.
+    on_token: Streaming callback passed to generate_answer() (cached answers are not streamed).
+    """
+    # Smalltalk / stats are answered locally and never cached (see CACHEABLE_INTENTS):
+    # skip the lookup, whose similarity tier would embed the question for nothing
+    if rag.is_smalltalk(question) or rag.is_library_stats_query(question):
+        result = None
+    else:
+        result = cache.get(question)
+    if result is None and prefetched is not None:
+        try:
+            result = prefetched.result()
+        except Exception:
+            result = None
+        if result is not None and (result.get("intent") == "ERROR" or not result.get("cacheable")):
+            result = None  # Failed (or session-specific) answer: retry synchronously below
+        if result is not None:
+            cache.put(question, result)
+    if result is None:
+        result = rag.generate_answer(question, session_id=session_id, on_token=on_token)
+        cache.put(question, result)
+        return result
+
+    record_turn(rag, session_id, question, result)
+    return result
+
+
+def prefetch_answer(rag: "RAGEngine", question: str, session_id: str) -> dict:
+    """generate_answer() in a throwaway session, which is discarded (files included) afterwards."""
+    try:
+        return rag.generate_answer(question, session_id=session_id)
+    finally:
+        rag.discard_session(session_id)
+
+
+def record_turn(rag: "RAGEngine", session_id: str, question: str, result: dict):
+    """Write an answer that did not go through generate_answer() into the session."""
+    session = rag.get_session(session_id)
+    session.add_message("user", question)
+    session.add_message("model", result["answer"])
+    if result.get("sources"):
+        # Keep follow-up questions ("cuốn thứ 2") pointing at the cached book list
+        session.last_search_results = result["sources"]
+        session.save()
+
+
+def setup_readline(suggestions: list, history_file: str):
+    """
+    Tab-complete suggestions and previous questions, persisting history across runs.
+    Completed text is verbatim, so it hits the semantic cache's exact tier.
+    """
+    if readline is None:
+        return
+
+    try:
+        readline.read_history_file(history_file)
+    except OSError:
+        pass
+
+    def complete(text, state):
+        line = readline.get_line_buffer().lower()
+        history = [readline.get_history_item(i) for i in range(1, readline.get_current_history_length() + 1)]
+        matches = [c for c in dict.fromkeys([*suggestions, *history]) if c and c.lower().startswith(line)]
+        return matches[state] if state < len(matches) else None
+
+    readline.set_completer_delims("")  # Complete the whole line, not single words
+    readline.set_completer(complete)
+    readline.parse_and_bind("tab: complete")
+
+
+def load_session_id(path: str, new_session: bool = False) -> str:
+    """
+    Reuse the CLI session id from the previous run (history, follow-ups and cache carry over).
+    new_session=True starts a fresh session and remembers it instead.
+    """
+    if not new_session and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            session_id = f.read().strip()
+        if session_id:
+            return session_id
+
+    session_id = str(uuid.uuid4())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(session_id)
+    return session_id
+
+
+def main(new_session: bool = False):
+    """
+    Main chat loop for CLI testing
+
+    Args:
+        new_session: Start a new session instead of resuming the last CLI session
+    """
+    from rich.console import Console
+
+    with Console().status("Đang khởi động chatbot (mô hình embedding, vector DB)..."):
+        from .rag_engine_new import RAGEngine
+        from .semantic_cache import SemanticCache
+
+        rag = RAGEngine(top_k=5)
+        cache = SemanticCache(
+            rag.embedder,
+            os.path.join(settings.DATA_PROCESSED_DIR, "chat_sessions", "semantic_cache.sqlite")
+        )
+    session_id = load_session_id(
+        os.path.join(settings.DATA_PROCESSED_DIR, "chat_sessions", ".cli_session"),
+        new_session=new_session
+    )
 
     print("=" * 60)
     print("AI Library RAG Chatbot")
@@ -12,25 +148,31 @@ def main():
     print("Gõ 'exit' để thoát\n")
 
     # Lấy gợi ý trực tiếp từ engine để khớp với logic intent mới
-    default_suggestions = [
-        "Tìm sách về Python",
-        "Sách Machine Learning hay nhất",
-        "Thư viện có bao nhiêu cuốn sách",
-        "Giờ mở cửa thư viện?",
-        "Quy định mượn sách như thế nào?",
-    ]
-
     try:
-        engine_suggestions = rag.get_suggested_questions()
-        suggestions = engine_suggestions if engine_suggestions else default_suggestions
+        suggestions = tuple(rag.get_suggested_questions()) or DEFAULT_SUGGESTIONS
     except Exception:
-        suggestions = default_suggestions
+        suggestions = DEFAULT_SUGGESTIONS
+    # "1".."N" -> suggestion, so picking one is a single dict lookup
+    suggestion_by_key = {str(i): q for i, q in enumerate(suggestions, start=1)}
+    cache.warm(suggestions)
+    history_file = os.path.join(settings.DATA_PROCESSED_DIR, "chat_sessions", ".chat_history")
+    setup_readline(suggestions, history_file)
+
+    # Answer the suggestions in the background while the user reads/types.
+    # Each runs in its own throwaway session so the user's history stays clean;
+    # the session is deleted as soon as its answer is ready.
+    prefetch_pool = ThreadPoolExecutor(max_workers=len(suggestions))
+    prefetch = {
+        q: prefetch_pool.submit(prefetch_answer, rag, q, f"{session_id}_prefetch_{i}")
+        for i, q in enumerate(suggestions)
+        if cache.get(q) is None
+    }
 
     print("Gợi ý câu hỏi:")
     for i, q in enumerate(suggestions, start=1):
         print(f"  {i}. {q}")
 
-    print(f"\nBạn có thể nhập số (1-{len(suggestions)}) hoặc gõ câu hỏi riêng.\n")
+    print(f"\nBạn có thể nhập số (1-{len(suggestions)}) hoặc gõ câu hỏi riêng (Tab để gợi ý).\n")
 
     # Main chat loop
     while True:
@@ -49,31 +191,41 @@ def main():
             break
 
         # Check if user input is a number (selecting suggestion)
-        if question.isdigit():
-            idx = int(question) - 1
-            if 0 <= idx < len(suggestions):
-                question = suggestions[idx]
-                print(f">> Bạn chọn: {question}")
-            else:
-                print(f"Số không hợp lệ. Vui lòng chọn từ 1-{len(suggestions)}.")
-                continue
+        if question in suggestion_by_key:
+            question = suggestion_by_key[question]
+            print(f">> Bạn chọn: {question}")
+        elif question.isdigit():
+            print(f"Số không hợp lệ. Vui lòng chọn từ 1-{len(suggestions)}.")
+            continue
 
         # Generate answer
         try:
-            # Use a static session ID for CLI (or generate random one at start)
-            if not hasattr(main, "session_id"):
-                import uuid
-                main.session_id = str(uuid.uuid4())
-                
-            result = rag.generate_answer(question, session_id=main.session_id)
-            answer = result["answer"]
             print("\nBot:")
-            print(answer)
+            # Stream tokens as they arrive; when piped, print the final answer only
+            streamed = []
+            on_token = None
+            if sys.stdout.isatty():
+                def on_token(text):
+                    streamed.append(text)
+                    print(text, end="", flush=True)
+
+            result = answer_question(rag, cache, question, session_id, prefetch.pop(question, None), on_token)
+            answer = result["answer"]
+            shown = "".join(streamed)
+            if answer.startswith(shown):
+                print(answer[len(shown):])
+            else:
+                print("\n" + answer)
         except Exception as e:
             print(f"\nLỗi: {e}")
 
         print("-" * 60)
 
+    if readline is not None:
+        readline.write_history_file(history_file)
+    prefetch_pool.shutdown(wait=False, cancel_futures=True)
+    cache.close()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(new_session="--new-session" in sys.argv)
\ No newline at end of file
@@ -1,12 +1,128 @@
 import logging
+import random
+import re
+import threading
 import time
-from typing import List, Optional, Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from itertools import chain
+from zoneinfo import ZoneInfo
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+
+import httpx
 from google import genai
 from google.genai import types
 from google.api_core import exceptions as google_exceptions
 
 logger = logging.getLogger("ModelManager")
 
+# Backoff (seconds) a (key, model) pair is skipped after a rate limit instead of being re-hit.
+# Doubles on each consecutive 429 up to the max, resets on success; +/-20% jitter.
+KEY_BACKOFF_INITIAL = 1.0
+KEY_BACKOFF_MAX = 30.0
+# After every key and model failed, further calls fail fast for this long (circuit breaker)
+EXHAUSTED_COOLDOWN_SECONDS = 60
+# Proactive throttling: stay under this fraction of each quota, and never block a call
+# longer than RATE_LIMIT_MAX_WAIT waiting for a slot (fall back / fail instead)
+RATE_LIMIT_SAFETY = 0.9
+RATE_LIMIT_MAX_WAIT = 30.0
+# Gemini daily quotas reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+# Error classification: typed exceptions / HTTP status first, message regex as fallback
+_ERROR_KIND_BY_TYPE = {
+    google_exceptions.ResourceExhausted: "rate_limit",
+    google_exceptions.TooManyRequests: "rate_limit",
+    google_exceptions.PermissionDenied: "rate_limit",
+    google_exceptions.NotFound: "model",
+    google_exceptions.BadRequest: "model",
+}
+_ERROR_KIND_BY_CODE = {429: "rate_limit", 403: "rate_limit", 404: "model", 400: "model"}
+_RATE_LIMIT_RE = re.compile(r"429|resource|exhausted|quota|403|permission|rate.?limit", re.IGNORECASE)
+_MODEL_ERROR_RE = re.compile(r"404|not found|support|bad request", re.IGNORECASE)
+
+
+def _error_kind(e: Exception) -> str:
+    """Classify a GenAI error: "rate_limit", "model" (switch model) or "other"."""
+    kind = _ERROR_KIND_BY_TYPE.get(type(e))
+    if kind:
+        return kind
+    # google-genai APIError carries the HTTP status as .code
+    kind = _ERROR_KIND_BY_CODE.get(getattr(e, "code", None))
+    if kind:
+        return kind
+
+    err_str = str(e)
+    if _RATE_LIMIT_RE.search(err_str):
+        return "rate_limit"
+    if _MODEL_ERROR_RE.search(err_str):
+        return "model"
+    return "other"
+
+
+def _estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough input token count for TPM accounting (~2 chars/token for Vietnamese text)."""
+    return sum(len(t) for t in texts if t) // 2
+
+
+class RateLimiter:
+    """
+    Sliding-window RPM / TPM and a daily request count for one (key, model) pair.
+    delay() says how long until a request fits; record() accounts for a sent request.
+    """
+
+    def __init__(self, rpm: int, tpm: int, rpd: int):
+        self.rpm = max(1, int(rpm * RATE_LIMIT_SAFETY))
+        self.tpm = max(1, int(tpm * RATE_LIMIT_SAFETY))
+        self.rpd = max(1, int(rpd * RATE_LIMIT_SAFETY))
+        self._sent = deque()  # (monotonic time, tokens) within the last 60s
+        self._window_tokens = 0
+        self._day = None
+        self._day_count = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._sent and now - self._sent[0][0] >= 60:
+            self._window_tokens -= self._sent.popleft()[1]
+        today = datetime.now(QUOTA_TIMEZONE).date()
+        if today != self._day:
+            self._day, self._day_count = today, 0
+
+    def delay(self, tokens: int) -> float:
+        """Seconds until a request of `tokens` fits in every window (inf: daily quota used up)."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if self._day_count >= self.rpd:
+                return float("inf")
+            wait = 0.0
+            if len(self._sent) >= self.rpm:
+                wait = self._sent[len(self._sent) - self.rpm][0] + 60 - now
+            if self._window_tokens + tokens > self.tpm:
+                # Oldest entries expire first: find how many must leave the window
+                excess = self._window_tokens + tokens - self.tpm
+                for sent_at, sent_tokens in self._sent:
+                    excess -= sent_tokens
+                    if excess <= 0:
+                        wait = max(wait, sent_at + 60 - now)
+                        break
+            return max(wait, 0.0)
+
+    def record(self, tokens: int):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._sent.append((now, tokens))
+            self._window_tokens += tokens
+            self._day_count += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {"rpm": len(self._sent), "tpm": self._window_tokens, "rpd": self._day_count}
+
 
 def extract_text_from_response(response: Any) -> Optional[str]:
     """
@@ -77,10 +193,14 @@ class ModelManager:
     """
     Manages usage of multiple API Keys and Models to handle rate limits.
     Strategy:
-    1. Round-robin through API Keys for 429/ResourceExhausted errors.
-    2. If all keys fail, switch to next model in list (lighter model).
+    1. Send with the current API Key (one request in the normal case).
+    2. On 429/ResourceExhausted, race the request on all other keys concurrently.
+       Throttled keys are skipped for an exponential backoff instead of being re-hit.
+    3. If all keys are throttled, switch to next model in list (lighter model).
+    Pairs over their RPM/TPM/RPD quota (rate_limits) are skipped before sending, not after a 429.
     """
-    def __init__(self, api_keys: List[str], models: List[str]):
+    def __init__(self, api_keys: List[str], models: List[str],
+                 rate_limits: Optional[Dict[str, Dict[str, int]]] = None):
         if not api_keys:
             raise ValueError("No API Keys provided for ModelManager")
         if not models:
@@ -92,24 +212,79 @@ class ModelManager:
         self.current_key_idx = 0
         self.current_model_idx = 0
         
-        # Initialize clients for all keys (lazy or upfront)
-        # Here we create client on demand or cache them
-        self._clients = [genai.Client(api_key=k) for k in self.api_keys]
+        # Clients are created on first use per key; all share one HTTP connection pool
+        # so keys reuse the same keep-alive TLS connections instead of one pool each
+        self._clients: Dict[int, genai.Client] = {}
+        self._clients_lock = threading.Lock()
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=20),
+            timeout=httpx.Timeout(60.0)
+        )
+        # (key_idx, model) -> monotonic time until which the pair is skipped
+        self._ready_at = {}
+        # (key_idx, model) -> next backoff in seconds
+        self._backoff = {}
+        # Monotonic time until which generate_content() raises without calling the API
+        self._exhausted_until = 0.0
+        # (key_idx, model) -> RateLimiter, for models with known quotas
+        self._limiters = {
+            (k, model): RateLimiter(**rate_limits[model])
+            for k in range(len(api_keys)) for model in models
+            if rate_limits and model in rate_limits
+        }
+        # One worker per key so a fan-out never queues behind itself
+        self._executor = ThreadPoolExecutor(max_workers=len(self.api_keys), thread_name_prefix="genai")
+
+    def _pair_delay(self, key_idx: int, model: str, tokens: int, now: float) -> float:
+        """Seconds until (key, model) can take this request: backoff and quota windows."""
+        delay = self._ready_at.get((key_idx, model), 0) - now
+        limiter = self._limiters.get((key_idx, model))
+        if limiter:
+            delay = max(delay, limiter.delay(tokens))
+        return max(delay, 0.0)
+
+    def _available_keys(self, model: str, tokens: int = 0) -> List[int]:
+        """Key indices neither cooling down nor over quota for this model, starting from the current key."""
+        now = time.monotonic()
+        order = [(self.current_key_idx + i) % len(self.api_keys) for i in range(len(self.api_keys))]
+        return [k for k in order if self._pair_delay(k, model, tokens, now) == 0]
+
+    def _record_sent(self, key_idx: int, model: str, tokens: int):
+        limiter = self._limiters.get((key_idx, model))
+        if limiter:
+            limiter.record(tokens)
 
-    def _get_client(self):
-        return self._clients[self.current_key_idx]
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Current quota usage per "key_idx/model", for logging."""
+        return {f"{k}/{model}": limiter.stats() for (k, model), limiter in self._limiters.items()}
 
-    def _rotate_key(self) -> bool:
+    def _mark_rate_limited(self, key_idx: int, model: str):
+        pair = (key_idx, model)
+        backoff = self._backoff.get(pair, KEY_BACKOFF_INITIAL)
+        self._ready_at[pair] = time.monotonic() + backoff * random.uniform(0.8, 1.2)
+        self._backoff[pair] = min(backoff * 2, KEY_BACKOFF_MAX)
+
+    def _mark_ok(self, key_idx: int, model: str):
+        self._ready_at.pop((key_idx, model), None)
+        self._backoff.pop((key_idx, model), None)
+
+    def _wait_for_any_key(self, tokens: int) -> bool:
         """
-        Switch to next API Key.
-        Returns: True if rotated, False if cycled through all keys (round completed).
+        No (key, model) pair can take the request: sleep until the earliest one can.
+        Returns False without sleeping if that is more than RATE_LIMIT_MAX_WAIT away.
         """
-        prev_idx = self.current_key_idx
-        self.current_key_idx = (self.current_key_idx + 1) % len(self.api_keys)
-        logger.warning(f"Switched API Key: {prev_idx} -> {self.current_key_idx}")
-        
-        # If we wrapped around to 0, we've tried all keys
-        return self.current_key_idx != 0
+        now = time.monotonic()
+        delay = min(
+            self._pair_delay(k, model, tokens, now)
+            for k in range(len(self.api_keys)) for model in self.models[self.current_model_idx:]
+        )
+        if delay > RATE_LIMIT_MAX_WAIT:
+            logger.warning(f"No key available within {RATE_LIMIT_MAX_WAIT:.0f}s | usage: {self.stats()}")
+            return False
+        if delay > 0:
+            logger.warning(f"All keys backing off or at quota, waiting {delay:.1f}s")
+            time.sleep(delay)
+        return True
 
     def _switch_model(self) -> bool:
         """
@@ -122,67 +297,194 @@ class ModelManager:
             return True
         return False
 
-    def generate_content(self, prompt: str, temperature: float, max_tokens: int) -> Optional[str]:
+    def _get_client(self, key_idx: int) -> genai.Client:
+        client = self._clients.get(key_idx)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key_idx)
+                if client is None:
+                    client = self._clients[key_idx] = genai.Client(
+                        api_key=self.api_keys[key_idx],
+                        http_options=types.HttpOptions(httpx_client=self._http)
+                    )
+        return client
+
+    def _call(self, key_idx: int, model: str, prompt: str, config, tokens: int) -> Optional[str]:
+        self._record_sent(key_idx, model, tokens)
+        response = self._get_client(key_idx).models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config
+        )
+        # Use safe extraction to handle various response formats
+        return extract_text_from_response(response)
+
+    def _race(self, key_ids: List[int], model: str, prompt: str, config,
+              tokens: int) -> Tuple[int, Optional[str]]:
         """
-        Attempt to generate content with retries on Rate Limit.
+        Send the request with every given key concurrently.
+        Returns (key_idx, text) of the first success, or raises the last error.
         """
-        # We try (Keys * Models) times roughly
-        max_attempts = len(self.api_keys) * len(self.models) * 2 
-        
-        for attempt in range(max_attempts):
-            client = self._get_client()
-            model = self.models[self.current_model_idx]
-            
+        futures = {self._executor.submit(self._call, k, model, prompt, config, tokens): k for k in key_ids}
+        error = None
+        for future in as_completed(futures):
+            key_idx = futures[future]
             try:
-                response = client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        temperature=temperature,
-                        max_output_tokens=max_tokens
-                    )
-                )
-                # Use safe extraction to handle various response formats
-                return extract_text_from_response(response)
-
+                text = future.result()
             except Exception as e:
-                # Check for Rate Limit errors
-                # Google GenAI raises custom exceptions, string check is fallback
-                err_str = str(e).lower()
-                logger.error(f"Generate Error (Key {self.current_key_idx} | Model {model}): {type(e).__name__} - {e}")
-                
-                is_rate_limit = "429" in err_str or "resource" in err_str or "exhausted" in err_str or "quota" in err_str or "403" in err_str or "permission" in err_str
-                is_model_error = "404" in err_str or "not found" in err_str or "support" in err_str or "bad request" in err_str
-
-                if is_model_error:
-                    logger.warning(f"Model {model} error. Switching model immediately...")
-                    if self._switch_model():
-                        self.current_key_idx = 0 # Try new model with first key
+                logger.error(f"Generate Error (Key {key_idx} | Model {model}): {type(e).__name__} - {e}")
+                if _error_kind(e) == "rate_limit":
+                    self._mark_rate_limited(key_idx, model)
+                error = e
+                continue
+            self._mark_ok(key_idx, model)
+            # Requests already in flight cannot be aborted; drop any not yet started
+            for other in futures:
+                other.cancel()
+            return key_idx, text
+        raise error
+
+    def generate_content(self, prompt: str, temperature: float, max_tokens: int,
+                         system_instruction: Optional[str] = None) -> Optional[str]:
+        """
+        Attempt to generate content, falling back across keys and models on Rate Limit.
+        Fails fast for EXHAUSTED_COOLDOWN_SECONDS once every key and model has failed.
+        """
+        remaining = self._exhausted_until - time.monotonic()
+        if remaining > 0:
+            raise RuntimeError(f"All API keys and models exhausted, retry in {remaining:.0f}s")
+
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+            system_instruction=system_instruction
+        )
+        tokens = _estimate_tokens(prompt, system_instruction)
+        last_error = None
+        waited = False
+
+        while True:
+            attempted = False
+            model_idx = self.current_model_idx
+
+            while model_idx < len(self.models):
+                model = self.models[model_idx]
+                keys = self._available_keys(model, tokens)
+                model_failed = False
+
+                # Current key alone first, then every remaining key at once
+                for batch in (keys[:1], keys[1:]):
+                    if not batch:
                         continue
-                    else:
-                        raise e # No more models
-
-                if is_rate_limit:
-                    logger.warning(f"Rate limit hit on Key {self.current_key_idx} Model {model}. Rotating...")
-                    
-                    # Try next key
-                    rotated_key = self._rotate_key()
-                    
-                    # If we cycled all keys, try switching model
-                    if not rotated_key:
-                        switched_model = self._switch_model()
-                        if not switched_model:
-                            logger.error("Exhausted all Keys and Models!")
-                            raise e # Give up
-                        else:
-                            # Reset key index when switching model to try new model with all keys
-                            self.current_key_idx = 0
-                    
-                    time.sleep(1) # Brief pause
-                    continue
+                    attempted = True
+                    try:
+                        key_idx, text = self._race(batch, model, prompt, config, tokens)
+                    except Exception as e:
+                        last_error = e
+                        kind = _error_kind(e)
+                        if kind == "rate_limit":
+                            logger.warning(f"Rate limit hit on Model {model}. Rotating keys...")
+                            continue
+                        if kind == "model":
+                            model_failed = True
+                            break
+                        # Other error (auth, payload), raise immediately
+                        logger.error(f"Critical GenAI Error: {e}")
+                        raise e
+                    self.current_key_idx = key_idx
+                    self._exhausted_until = 0.0
+                    return text
+
+                if model_failed:
+                    logger.warning(f"Model {model} error. Switching model immediately...")
+                    # Broken model: skip it for later calls too
+                    if model_idx == self.current_model_idx:
+                        self._switch_model()
                 else:
-                    # Other error (auth, payload), raise immediately
+                    logger.warning(f"All keys rate limited for Model {model}")
+                model_idx += 1
+
+            # Nothing was sendable because every key is backing off or at quota: wait once for the earliest
+            if attempted or waited or not self._wait_for_any_key(tokens):
+                break
+            waited = True
+
+        logger.error("Exhausted all Keys and Models!")
+        self._exhausted_until = time.monotonic() + EXHAUSTED_COOLDOWN_SECONDS
+        if last_error:
+            raise last_error
+        return None
+
+    def generate_content_stream(self, prompt: str, temperature: float, max_tokens: int,
+                                system_instruction: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream generated text chunk by chunk.
+        Keys/models are tried one at a time (a stream cannot be raced); errors surface on the
+        first chunk, so fallback happens before anything has been yielded to the caller.
+        """
+        remaining = self._exhausted_until - time.monotonic()
+        if remaining > 0:
+            raise RuntimeError(f"All API keys and models exhausted, retry in {remaining:.0f}s")
+
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+            system_instruction=system_instruction
+        )
+        tokens = _estimate_tokens(prompt, system_instruction)
+        last_error = None
+        model_idx = self.current_model_idx
+
+        # Every key is backing off or at quota: wait once for the earliest rather than fail
+        if not any(self._available_keys(m, tokens) for m in self.models[model_idx:]):
+            self._wait_for_any_key(tokens)
+
+        while model_idx < len(self.models):
+            model = self.models[model_idx]
+            model_failed = False
+
+            for key_idx in self._available_keys(model, tokens):
+                try:
+                    self._record_sent(key_idx, model, tokens)
+                    stream = iter(self._get_client(key_idx).models.generate_content_stream(
+                        model=model,
+                        contents=prompt,
+                        config=config
+                    ))
+                    first = next(stream, None)
+                except Exception as e:
+                    last_error = e
+                    logger.error(f"Generate Error (Key {key_idx} | Model {model}): {type(e).__name__} - {e}")
+                    kind = _error_kind(e)
+                    if kind == "rate_limit":
+                        self._mark_rate_limited(key_idx, model)
+                        continue
+                    if kind == "model":
+                        model_failed = True
+                        break
                     logger.error(f"Critical GenAI Error: {e}")
                     raise e
-                    
-        return None
+
+                self._mark_ok(key_idx, model)
+                self.current_key_idx = key_idx
+                self._exhausted_until = 0.0
+                if first is None:
+                    return
+                for chunk in chain((first,), stream):
+                    text = getattr(chunk, "text", None)
+                    if isinstance(text, str) and text:
+                        yield text
+                return
+
+            if model_failed:
+                logger.warning(f"Model {model} error. Switching model immediately...")
+                if model_idx == self.current_model_idx:
+                    self._switch_model()
+            else:
+                logger.warning(f"All keys rate limited for Model {model}")
+            model_idx += 1
+
+        logger.error("Exhausted all Keys and Models!")
+        self._exhausted_until = time.monotonic() + EXHAUSTED_COOLDOWN_SECONDS
+        if last_error:
+            raise last_error
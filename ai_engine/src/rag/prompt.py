@@ -4,6 +4,35 @@ PROMPT + THÔNG TIN THƯ VIỆN (SINGLE SOURCE OF TRUTH)
 =====================================================
 """
 
+import html
+import math
+import re
+import sys
+import unicodedata
+from functools import lru_cache
+from string import Formatter
+from typing import Callable, Dict, List
+
+__all__ = [
+    "LIBRARY_INFO",
+    "LIBRARY_CONTEXT",
+    "SYSTEM_PROMPT",
+    "USER_PROMPT_TEMPLATE",
+    "FOLLOWUP_PROMPT_TEMPLATE",
+    "SMALLTALK_PROMPT_TEMPLATE",
+    "GENERAL_QA_PROMPT_TEMPLATE",
+    "compile_template",
+    "render_user_prompt",
+    "format_books_block",
+    "get_description_prompt_with_preview_text",
+    "get_description_prompt_with_existing_desc",
+    "get_description_prompt_metadata_only",
+    "get_description_prompt_for_template_ai",
+    "get_description_prompt",
+    "get_description_prompts_batch",
+    "estimate_output_tokens",
+]
+
 # =====================================================
 # THÔNG TIN THƯ VIỆN (HARD-CODE – CHƯA CẦN DATABASE)
 # =====================================================
@@ -34,72 +63,25 @@ LIBRARY_INFO = {
 # SYSTEM PROMPT (LUẬT CỨNG – CHỐNG ẢO GIÁC)
 # =====================================================
 
-SYSTEM_PROMPT = """
-Bạn là TRỢ LÝ THƯ VIỆN AI thông minh và thân thiện.
-
-============================
-PHẠM VI TRI THỨC
-============================
-
-Bạn có HAI NGUỒN THÔNG TIN RIÊNG BIỆT:
-
-(1) TRI THỨC SÁCH
-- CHỈ sử dụng thông tin trong "Danh sách sách"
-- TUYỆT ĐỐI KHÔNG bịa tên sách, tác giả, nội dung
-- Có thể so sánh, đánh giá, gợi ý dựa trên thông tin có sẵn
-
-(2) TRI THỨC THƯ VIỆN
-- Giờ mở cửa, nội quy, quy định mượn – trả, phí phạt
-- CHỈ được dùng thông tin trong "Thông tin thư viện"
-
-============================
-XỬ LÝ CÂU HỎI FOLLOW-UP
-============================
-
-Khi người dùng hỏi tiếp (follow-up), hãy:
-- Đọc kỹ "Lịch sử hội thoại" để hiểu ngữ cảnh
-- Nếu hỏi "cuốn nào hay nhất/dễ nhất/phù hợp nhất" → chọn từ danh sách sách đã đưa ra trước đó
-- Nếu hỏi "cuốn thứ 2" hoặc "cuốn đầu tiên" → tham chiếu đến vị trí trong danh sách
-- Nếu hỏi thêm chi tiết về một cuốn cụ thể → cung cấp thông tin có sẵn
-
-============================
-NGUYÊN TẮC TRẢ LỜI
-============================
-
-- Hỏi SÁCH → dùng danh sách sách, có thể gợi ý/so sánh
-- Hỏi NỘI QUY / GIỜ MỞ CỬA → dùng thông tin thư viện
-- Hỏi SO SÁNH / GỢI Ý → phân tích dựa trên tiêu đề, tác giả, năm xuất bản
-- Không pha trộn nguồn thông tin
-- Không suy đoán thông tin không có
-- Không đủ dữ liệu → nói rõ là không có
-
-============================
-PHONG CÁCH
-============================
-- Tiếng Việt tự nhiên, thân thiện
-- Rõ ràng, ngắn gọn nhưng đầy đủ
-- Không lan man, không lặp lại thông tin
-- Khi gợi ý sách, giải thích ngắn gọn lý do
-"""
+SYSTEM_PROMPT = sys.intern("""
+Bạn là TRỢ LÝ THƯ VIỆN AI thân thiện. Quy tắc:
+- Hai nguồn riêng biệt, không pha trộn: (1) "Danh sách sách" cho câu hỏi về sách; (2) "Thông tin thư viện" cho giờ mở cửa, nội quy, mượn – trả, phí phạt.
+- Chỉ dùng dữ liệu được cung cấp; không bịa hay suy đoán tên sách, tác giả, nội dung, quy định.
+- Không đủ dữ liệu → nói rõ là không có.
+- So sánh/gợi ý: phân tích dựa trên tiêu đề, tác giả, năm xuất bản; giải thích ngắn gọn lý do.
+- Follow-up: đọc "Lịch sử hội thoại"; "hay nhất/phù hợp nhất" → chọn từ danh sách đã đưa; "cuốn thứ 2", "cuốn đầu tiên" → theo vị trí trong danh sách.
+- Trả lời bằng tiếng Việt tự nhiên, rõ ràng, ngắn gọn nhưng đủ ý, không lặp lại.
+""")
 
 # =====================================================
 # USER PROMPT TEMPLATE (BẮT BUỘC ĐỦ BIẾN)
 # =====================================================
+# Static parts (library info, instructions) come first and per-request parts
+# (books, question) last, so SYSTEM_PROMPT + library block is an identical
+# prefix on every call and Gemini's implicit prompt cache can reuse it.
 
 USER_PROMPT_TEMPLATE = """
-============================
-Câu hỏi của người dùng:
-============================
-{question}
-
-============================
-Danh sách sách liên quan:
-============================
-{books}
-
-============================
 Thông tin thư viện:
-============================
 - Giờ mở cửa: {opening_hours}
 
 - Nội quy thư viện:
@@ -111,16 +93,93 @@ Thông tin thư viện:
 - Phí phạt & khóa tài khoản:
 {penalty_policy}
 
-============================
 Hướng dẫn trả lời:
-============================
 1. Nếu hỏi về sách cụ thể → trả lời dựa trên danh sách sách
 2. Nếu hỏi "cuốn nào hay/dễ/phù hợp nhất" → phân tích và gợi ý 1-2 cuốn với lý do
 3. Nếu hỏi về thư viện (giờ, nội quy, mượn trả) → dùng thông tin thư viện
 4. Nếu là câu hỏi follow-up → tham chiếu lịch sử hội thoại
 5. KHÔNG bịa thông tin không có trong dữ liệu
+
+Danh sách sách liên quan:
+{books}
+
+Câu hỏi của người dùng:
+{question}
 """
 
+# =====================================================
+# TEMPLATE PRE-COMPILATION
+# =====================================================
+
+def compile_template(template: str, **static) -> Callable[..., str]:
+    """
+    Parse a str.format template once and return a render(**fields) function.
+    Fields given in `static` are substituted at compile time, so per-call
+    rendering is a single join over the remaining dynamic fields.
+    """
+    parts = []  # literal strings and field names, alternating
+    literal = ""
+    for text, field, spec, conv in Formatter().parse(template):
+        literal += text
+        if field is None:
+            continue
+        if spec or conv:
+            raise ValueError(f"Unsupported format spec in template field '{field}'")
+        if field in static:
+            literal += str(static[field])
+        else:
+            parts.append(literal)
+            parts.append(field)
+            literal = ""
+    parts.append(literal)
+
+    literals = parts[0::2]
+    fields = parts[1::2]
+
+    def render(**values) -> str:
+        out = [literals[0]]
+        for field, text in zip(fields, literals[1:]):
+            out.append(str(values[field]))
+            out.append(text)
+        return "".join(out)
+
+    return render
+
+
+# Library info never changes at runtime: render it into the prompt once
+LIBRARY_CONTEXT = {
+    "opening_hours": LIBRARY_INFO["opening_hours"],
+    "library_rules": "\n".join(f"- {r}" for r in LIBRARY_INFO["library_rules"]),
+    "borrow_policy": "\n".join(f"- {k}: {v}" for k, v in LIBRARY_INFO["borrow_policy"].items()),
+    "penalty_policy": "\n".join(f"- {k}: {v}" for k, v in LIBRARY_INFO["penalty_policy"].items()),
+}
+
+# USER_PROMPT_TEMPLATE with library info filled in; render(question=..., books=...).
+# SYSTEM_PROMPT is not prepended: pass it as system_instruction so every call shares one object.
+render_user_prompt = compile_template(USER_PROMPT_TEMPLATE, **LIBRARY_CONTEXT)
+
+# Long titles/author lists are clipped: they cost tokens in every prompt
+# and in the answer header without helping the model pick a book
+MAX_BOOK_TITLE_CHARS = 120
+MAX_BOOK_AUTHORS_CHARS = 80
+
+
+def _clip(text, limit: int) -> str:
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+_format_book_line = "{0}. {1} – {2} ({3})".format
+
+
+def format_books_block(books: List[Dict]) -> str:
+    """Numbered "title – authors (year)" lines for the {books}/{previous_books} fields."""
+    return "\n".join([
+        _format_book_line(i, _clip(b['title'], MAX_BOOK_TITLE_CHARS),
+                          _clip(b['authors'], MAX_BOOK_AUTHORS_CHARS), b.get('publish_year', ''))
+        for i, b in enumerate(books, 1)
+    ])
+
 # =====================================================
 # FOLLOW-UP PROMPT TEMPLATE (CAU HOI TIEP NOI)
 # =====================================================
@@ -128,30 +187,22 @@ Hướng dẫn trả lời:
 FOLLOWUP_PROMPT_TEMPLATE = """
 Bạn là TRỢ LÝ THƯ VIỆN AI thông minh.
 
-============================
 Lịch sử hội thoại:
-============================
 {history}
 
-============================
 Danh sách sách đã đề cập trước đó:
-============================
 {previous_books}
 
-============================
 Câu hỏi tiếp theo của người dùng:
-============================
 {question}
 
-============================
 Hướng dẫn trả lời:
-============================
 1. Đây là câu hỏi TIẾP NỐI, hãy dựa vào ngữ cảnh trước đó
 2. Nếu hỏi "cuốn nào hay/dễ/tốt nhất" → chọn từ danh sách sách đã đề cập và giải thích lý do
 3. Nếu hỏi "cuốn thứ X" → tham chiếu đến vị trí trong danh sách
 4. Nếu hỏi chi tiết về một cuốn → cung cấp thông tin có sẵn
-5. Trả lời tự nhiên, thân thiện, có thể dùng emoji
-6. KHÔNG bịa thông tin không có
+5. Trả lời ngắn gọn, đi thẳng vào vấn đề.
+6. KHÔNG dùng icon/emoji. KHÔNG dùng định dạng bôi đen (**text**).
 """
 
 # =====================================================
@@ -173,7 +224,7 @@ Hãy trả lời một cách thân thiện, tự nhiên bằng tiếng Việt.
 - Nếu hỏi về bạn: giới thiệu bạn là trợ lý AI thư viện
 - Nếu là câu hỏi chung: trả lời ngắn gọn, thông minh
 
-Trả lời ngắn gọn (1-3 câu), thân thiện, có thể dùng emoji phù hợp.
+Trả lời ngắn gọn (1-3 câu), thân thiện. KHÔNG dùng emoji.
 KHÔNG đưa ra danh sách sách nếu không được hỏi.
 """
 
@@ -191,147 +242,91 @@ Câu hỏi của người dùng: "{question}"
 
 Hướng dẫn trả lời:
 1. Nếu là câu hỏi kiến thức chung (toán, khoa học, lịch sử, v.v.): Trả lời chính xác, ngắn gọn
-2. Nếu là câu hỏi về sách nhưng thư viện không có (không có trong ngữ cảnh): Nói rõ thư viện chưa có sách phù hợp HOẶC gợi ý chung chung (nhưng KHÔNG được bịa tên sách cụ thể).
-3. TUYỆT ĐỐI KHÔNG BỊA RA TÊN SÁCH, TÁC GIẢ NẾU KHÔNG CÓ DỮ LIỆU ĐẦU VÀO.
-4. Nếu là câu hỏi cá nhân hoặc không phù hợp: Nhẹ nhàng từ chối và hướng về chức năng thư viện
-5. Nếu là câu hỏi tiếp nối: Dựa vào lịch sử để trả lời chính xác
+2. Nếu là câu hỏi về sách nhưng thư viện không có: Nói rõ thư viện chưa có sách phù hợp
+3. Nếu là câu hỏi cá nhân hoặc không phù hợp: Nhẹ nhàng từ chối và hướng về chức năng thư viện
+4. Nếu là câu hỏi tiếp nối: Dựa vào lịch sử để trả lời chính xác
 
-Trả lời bằng tiếng Việt, thân thiện, chính xác. Có thể dùng emoji phù hợp.
+Trả lời bằng tiếng Việt, thân thiện, chính xác.
+KHÔNG dùng emoji/icon. KHÔNG dùng định dạng bôi đen (**text**).
+KHÔNG bịa tên sách hoặc thông tin không chính xác.
 """
 
 # =====================================================
-# DESCRIPTION GENERATION PROMPTS
+# DESCRIPTION PROMPT HELPERS (DÙNG CHO description.py)
 # =====================================================
 
-def get_description_prompt_with_preview_text(
-    title: str,
-    authors: str,
-    categories: str,
-    publisher: str,
-    published_date: str,
-    preview_text: str,
-    max_length: int = 1000
-) -> str:
-    """Generate prompt for description when preview text is available."""
-    return f"""Bạn là chuyên gia viết mô tả sách chuyên nghiệp.
+# Shared by every description prompt: kept to one line each, since these
+# prompts are sent once per book and input tokens dominate the batch cost
+_DESC_ROLE = "Viết mô tả sách bằng tiếng Việt, giữ nguyên tên riêng (tên sách, tác giả, NXB)."
+_DESC_RULES = "không bịa thông tin ngoài dữ liệu; văn phong rõ ràng, tự nhiên."
 
-THÔNG TIN SÁCH:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- Nhà xuất bản: {publisher}
-- Năm xuất bản: {published_date}
+# Token budgets for the free-text snippets inserted into description prompts.
+# Chars are a poor proxy: Vietnamese runs ~2 chars/token, English ~4.
+PREVIEW_TEXT_TOKEN_BUDGET = 1500
+EXISTING_DESC_TOKEN_BUDGET = 400
+_CHARS_PER_TOKEN = {"vi": 2.0, "en": 4.0}
+OUTPUT_TOKEN_HEADROOM = 64  # so a reply is not cut mid-sentence right at the limit
 
-NỘI DUNG XEM TRƯỚC:
-{preview_text}
+# Rendered prompts are memoized (args are plain strings), so retries and
+# model fallbacks for the same book reuse the built string
+DESCRIPTION_PROMPT_CACHE_SIZE = 1024
 
-YÊU CẦU:
-1. Viết mô tả chi tiết, hấp dẫn cho cuốn sách
-2. Độ dài: {max_length} ký tự (tối thiểu 500, tối đa {max_length})
-3. Sử dụng thông tin từ nội dung xem trước
-4. Viết bằng tiếng Việt, văn phong chuyên nghiệp
-5. KHÔNG bịa thông tin không có
+# Routing thresholds for get_description_prompt()
+MIN_RICH_EXISTING_DESC_CHARS = 400  # enough on its own: skip the (larger) preview prompt
+MIN_USEFUL_PREVIEW_CHARS = 300      # shorter previews carry too little to be worth sending
 
-Hãy viết mô tả:"""
 
+def _detect_lang(text: str) -> str:
+    """Cheap language hint: Vietnamese text has many non-ASCII (diacritic) chars."""
+    sample = text[:1000]
+    non_ascii = sum(1 for c in sample if ord(c) > 127)
+    return "vi" if non_ascii > len(sample) * 0.05 else "en"
 
-def get_description_prompt_with_existing_desc(
-    title: str,
-    authors: str,
-    categories: str,
-    publisher: str,
-    published_date: str,
-    existing_desc: str,
-    max_length: int = 1000
-) -> str:
-    """Generate prompt for description when existing description is available."""
-    return f"""Bạn là chuyên gia viết mô tả sách chuyên nghiệp.
-
-THÔNG TIN SÁCH:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- Nhà xuất bản: {publisher}
-- Năm xuất bản: {published_date}
-
-MÔ TẢ HIỆN CÓ:
-{existing_desc}
-
-YÊU CẦU:
-1. Viết lại mô tả chi tiết hơn, hấp dẫn hơn cho cuốn sách
-2. Độ dài: {max_length} ký tự (tối thiểu 500, tối đa {max_length})
-3. Dựa trên mô tả hiện có nhưng mở rộng và cải thiện
-4. Viết bằng tiếng Việt, văn phong chuyên nghiệp
-5. KHÔNG bịa thông tin không có
-
-Hãy viết mô tả:"""
-
-
-def get_description_prompt_metadata_only(
-    title: str,
-    authors: str,
-    categories: str,
-    published_date: str,
-    max_length: int = 1000
-) -> str:
-    """Generate prompt for description when only metadata is available."""
-    return f"""Bạn là chuyên gia viết mô tả sách chuyên nghiệp.
 
-THÔNG TIN SÁCH:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- Năm xuất bản: {published_date}
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"[^\S\n]+")
 
-YÊU CẦU:
-1. Viết mô tả chi tiết, hấp dẫn cho cuốn sách dựa trên metadata
-2. Độ dài: {max_length} ký tự (tối thiểu 500, tối đa {max_length})
-3. Suy luận hợp lý từ tên sách, tác giả và thể loại
-4. Viết bằng tiếng Việt, văn phong chuyên nghiệp
-5. KHÔNG bịa thông tin cụ thể như số trang, nội dung chi tiết
 
-Hãy viết mô tả:"""
+def _clean_preview(text: str) -> str:
+    """
+    Strip token-wasting noise from Google Books preview text: HTML tags/entities,
+    BOM/NBSP and NFD variants, repeated whitespace, and page-number-like lines
+    (more than 70% digits).
+    """
+    text = unicodedata.normalize("NFC", html.unescape(_TAG_RE.sub(" ", text)))
+    text = text.replace("\ufeff", "")
+    lines = []
+    for line in text.splitlines():
+        line = _SPACE_RE.sub(" ", line).strip()
+        if line and sum(c.isdigit() for c in line) < 0.7 * len(line):
+            lines.append(line)
+    return "\n".join(lines)
 
 
-def get_description_prompt_for_template_ai(
-    book_title: str,
-    book_authors: str,
-    book_categories: str,
-    publisher: str,
-    published_date: str,
-    page_count: str,
-    existing_desc: str = ""
-) -> str:
-    """Generate prompt for template-based AI description."""
-    context = f"""
-MÔ TẢ HIỆN CÓ: {existing_desc}
-""" if existing_desc else ""
-
-    return f"""Bạn là chuyên gia viết mô tả sách chuyên nghiệp.
+def _estimate_tokens(text: str, lang_hint: str) -> int:
+    return math.ceil(len(text) / _CHARS_PER_TOKEN[lang_hint])
 
-THÔNG TIN SÁCH:
-- Tên sách: {book_title}
-- Tác giả: {book_authors}
-- Thể loại: {book_categories}
-- Nhà xuất bản: {publisher}
-- Năm xuất bản: {published_date}
-- Số trang: {page_count}
-{context}
 
-YÊU CẦU:
-1. Viết mô tả ĐỘC ĐÁO, không theo template cứng
-2. Độ dài: 500-800 ký tự
-3. Nêu bật giá trị của sách cho người đọc
-4. Phù hợp với thể loại và đối tượng đọc giả
-5. Viết bằng tiếng Việt, văn phong chuyên nghiệp, hấp dẫn
+def estimate_output_tokens(max_length_chars: int, lang: str = "vi") -> int:
+    """
+    max_output_tokens for a reply of at most max_length_chars: the prompts ask for
+    "tối đa N ký tự" but Gemini does not reliably obey it, so cap it at the API level.
+    """
+    return math.ceil(max_length_chars / _CHARS_PER_TOKEN[lang]) + OUTPUT_TOKEN_HEADROOM
 
-Hãy viết mô tả:"""
 
+def _truncate_to_tokens(text: str, max_tokens: int, lang_hint: str = None) -> str:
+    """Cut text to roughly max_tokens (heuristic chars/token), at a word boundary."""
+    if not text:
+        return text
+    lang = lang_hint or _detect_lang(text)
+    if _estimate_tokens(text, lang) <= max_tokens:
+        return text
+    limit = int(max_tokens * _CHARS_PER_TOKEN[lang])
+    return text[:limit].rsplit(' ', 1)[0] + "..."
 
-# =====================================================
-# DESCRIPTION PROMPT HELPERS (DÙNG CHO description.py)
-# =====================================================
 
+@lru_cache(maxsize=DESCRIPTION_PROMPT_CACHE_SIZE)
 def get_description_prompt_with_preview_text(
     title: str,
     authors: str,
@@ -342,27 +337,17 @@ def get_description_prompt_with_preview_text(
     max_length: int
 ) -> str:
     """Tạo prompt khi có preview text từ Google Books."""
-    return f"""
-Bạn là trợ lý AI chuyên viết mô tả sách bằng tiếng Việt.
-
-Thông tin sách:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- NXB: {publisher}
-- Năm xuất bản: {published_date}
+    preview_text = _truncate_to_tokens(_clean_preview(preview_text), PREVIEW_TEXT_TOKEN_BUDGET)
+    return f"""{_DESC_ROLE}
+Sách: {title} | Tác giả: {authors} | Thể loại: {categories} | NXB: {publisher} | Năm: {published_date}
 
-Đoạn trích nội dung:
+Trích đoạn:
 {preview_text}
 
-Yêu cầu:
-- Viết mô tả CHI TIẾT, mạch lạc, tối đa {max_length} ký tự
-- Tập trung vào nội dung và giá trị của sách
-- Không bịa thông tin ngoài dữ liệu
-- Văn phong rõ ràng, tự nhiên, thân thiện
-""".strip()
+Yêu cầu: chi tiết, mạch lạc, tối đa {max_length} ký tự; tập trung vào nội dung và giá trị của sách; {_DESC_RULES}"""
 
 
+@lru_cache(maxsize=DESCRIPTION_PROMPT_CACHE_SIZE)
 def get_description_prompt_with_existing_desc(
     title: str,
     authors: str,
@@ -373,26 +358,17 @@ def get_description_prompt_with_existing_desc(
     max_length: int
 ) -> str:
     """Tạo prompt khi có mô tả sẵn từ Google Books."""
-    return f"""
-Bạn là trợ lý AI chuyên viết mô tả sách bằng tiếng Việt.
-
-Thông tin sách:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- NXB: {publisher}
-- Năm xuất bản: {published_date}
+    existing_desc = _truncate_to_tokens(existing_desc, EXISTING_DESC_TOKEN_BUDGET)
+    return f"""{_DESC_ROLE}
+Sách: {title} | Tác giả: {authors} | Thể loại: {categories} | NXB: {publisher} | Năm: {published_date}
 
 Mô tả hiện có:
 {existing_desc}
 
-Yêu cầu:
-- Viết lại mô tả CHI TIẾT, trau chuốt, tối đa {max_length} ký tự
-- Giữ đúng ý chính, có thể mở rộng nhưng không bịa thông tin
-- Văn phong rõ ràng, tự nhiên, thân thiện
-""".strip()
+Yêu cầu: viết lại chi tiết, trau chuốt, tối đa {max_length} ký tự; giữ đúng ý chính, có thể mở rộng; {_DESC_RULES}"""
 
 
+@lru_cache(maxsize=DESCRIPTION_PROMPT_CACHE_SIZE)
 def get_description_prompt_metadata_only(
     title: str,
     authors: str,
@@ -401,23 +377,13 @@ def get_description_prompt_metadata_only(
     max_length: int
 ) -> str:
     """Tạo prompt khi chỉ có metadata (không có preview/desc)."""
-    return f"""
-Bạn là trợ lý AI chuyên viết mô tả sách bằng tiếng Việt.
-
-Thông tin sách:
-- Tên sách: {title}
-- Tác giả: {authors}
-- Thể loại: {categories}
-- Năm xuất bản: {published_date}
+    return f"""{_DESC_ROLE}
+Sách: {title} | Tác giả: {authors} | Thể loại: {categories} | Năm: {published_date}
 
-Yêu cầu:
-- Viết mô tả CHI TIẾT dựa trên metadata, tối đa {max_length} ký tự
-- Không bịa nội dung cụ thể nếu không có dữ liệu
-- Tập trung vào phạm vi kiến thức, đối tượng phù hợp, giá trị tham khảo
-- Văn phong rõ ràng, tự nhiên, thân thiện
-""".strip()
+Yêu cầu: chi tiết, tối đa {max_length} ký tự, dựa trên metadata; nêu phạm vi kiến thức, đối tượng phù hợp, giá trị tham khảo; không bịa nội dung cụ thể; văn phong rõ ràng, tự nhiên."""
 
 
+@lru_cache(maxsize=DESCRIPTION_PROMPT_CACHE_SIZE)
 def get_description_prompt_for_template_ai(
     book_title: str,
     book_authors: str,
@@ -428,20 +394,54 @@ def get_description_prompt_for_template_ai(
     existing_desc: str
 ) -> str:
     """Prompt dùng cho chế độ AI khi tạo mô tả từ template thông minh."""
+    existing_desc = _truncate_to_tokens(existing_desc, EXISTING_DESC_TOKEN_BUDGET)
     existing_block = f"\nMô tả hiện có:\n{existing_desc}\n" if existing_desc else ""
-    return f"""
-Bạn là trợ lý AI chuyên viết mô tả sách bằng tiếng Việt.
-
-Thông tin sách:
-- Tên sách: {book_title}
-- Tác giả: {book_authors}
-- Thể loại: {book_categories}
-- NXB: {publisher}
-- Năm xuất bản: {published_date}
-- Số trang: {page_count}
+    return f"""{_DESC_ROLE}
+Sách: {book_title} | Tác giả: {book_authors} | Thể loại: {book_categories} | NXB: {publisher} | Năm: {published_date} | Số trang: {page_count}
 {existing_block}
-Yêu cầu:
-- Viết mô tả độc đáo, súc tích (200-1000 ký tự)
-- Tập trung vào nội dung, đối tượng phù hợp, điểm nổi bật
-- Không bịa thông tin ngoài dữ liệu
-""".strip()
+Yêu cầu: độc đáo, súc tích (200-1000 ký tự); nêu nội dung, đối tượng phù hợp, điểm nổi bật; {_DESC_RULES}"""
+
+
+def get_description_prompt(book: Dict[str, str], max_length: int) -> str:
+    """
+    Chọn template rẻ nhất mà vẫn đủ thông tin:
+    mô tả hiện có đủ dài > preview text đủ dài > mô tả hiện có ngắn > chỉ metadata.
+    `book` là dict metadata của BookDescriptionGenerator._extract_book_metadata().
+    """
+    existing_desc = book.get('existing_desc') or ''
+    preview_text = book.get('preview_text') or ''
+
+    if len(preview_text) >= MIN_USEFUL_PREVIEW_CHARS and len(existing_desc) < MIN_RICH_EXISTING_DESC_CHARS:
+        return get_description_prompt_with_preview_text(
+            title=book['title'],
+            authors=book['authors'],
+            categories=book['categories'],
+            publisher=book['publisher'],
+            published_date=book['published_date'],
+            preview_text=preview_text,
+            max_length=max_length
+        )
+
+    if existing_desc:
+        return get_description_prompt_with_existing_desc(
+            title=book['title'],
+            authors=book['authors'],
+            categories=book['categories'],
+            publisher=book['publisher'],
+            published_date=book['published_date'],
+            existing_desc=existing_desc,
+            max_length=max_length
+        )
+
+    return get_description_prompt_metadata_only(
+        title=book['title'],
+        authors=book['authors'],
+        categories=book['categories'],
+        published_date=book['published_date'],
+        max_length=max_length
+    )
+
+
+def get_description_prompts_batch(books: List[Dict[str, str]], max_length: int) -> List[str]:
+    """Prompt cho nhiều sách (Gemini Batch Mode), cùng thứ tự với `books`."""
+    return [get_description_prompt(book, max_length) for book in books]
@@ -12,172 +12,707 @@ Thêm từ HEAD:
 
 import os
 import re
-import json
+import atexit
 import logging
+import queue
+import sqlite3
+import threading
+import time
 import unicodedata
-from typing import List, Dict
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 
-
-def remove_diacritics(text: str) -> str:
-    """
-    Remove Vietnamese diacritics from text.
-    Example: "xin chào" -> "xin chao"
-    """
-    # Normalize to NFD form (separates base char and diacritics)
-    # Normalize to NFD form (separates base char and diacritics)
-    nfkd_form = unicodedata.normalize('NFD', text)
-    # Remove combining diacritical marks
-    text_without_accent = ''.join(c for c in nfkd_form if not unicodedata.combining(c))
-    # Manual replace for 'đ' and 'Đ' which are not decomposable in NFD
-    return text_without_accent.replace('đ', 'd').replace('Đ', 'D')
+import numpy as np
+import orjson
 
 from config.settings import settings
 from src.search_engine import SearchEngine
-from src.rag.prompt import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE, LIBRARY_INFO
+from src.embedder import BatchingEmbedder
+from src.rag.prompt import (
+    LIBRARY_INFO,
+    SYSTEM_PROMPT,
+    SMALLTALK_PROMPT_TEMPLATE,
+    GENERAL_QA_PROMPT_TEMPLATE,
+    FOLLOWUP_PROMPT_TEMPLATE,
+    compile_template,
+    format_books_block,
+    render_user_prompt,
+)
 from src.rag.model_manager import ModelManager
 from config.rag_config import (
     GEMINI_API_KEYS,
     GEMINI_MODELS,
     GEMINI_MODEL,
+    GEMINI_RATE_LIMITS,
     DEFAULT_TOP_K,
+    EMBED_CACHE_MAX_ENTRIES,
     SCORE_THRESHOLD,
     MIN_QUERY_LENGTH,
     TEMPERATURE,
     MAX_OUTPUT_TOKENS,
     QUERY_CACHE_THRESHOLD,
-    SEARCH_EXPAND_FACTOR
+    FALLBACK_CACHE_THRESHOLD,
+    QUERY_MEMORY_SEEN_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    SEARCH_EXPAND_FACTOR,
+    SESSION_CACHE_SIZE,
+    SESSION_FLUSH_INTERVAL_MS,
+    SESSION_FLUSH_MAX_BATCH,
+    SESSION_LOAD_TAIL_MESSAGES
 )
 
 # Logger cho module RAG
 logger = logging.getLogger("RAGEngine")
 
 
-# =====================================================
-# PROMPT TEMPLATES (THÊM TỪ HEAD)
-# =====================================================
-# Lý do: Các template này giúp Gemini trả lời thông minh hơn
-# cho các trường hợp smalltalk và câu hỏi tổng quát
+# Cosine similarity never exceeds 1, so a higher QUERY_CACHE_THRESHOLD can never hit:
+# skip the query-memory round trip to Chroma instead of making it for nothing
+_QUERY_MEMORY_ENABLED = QUERY_CACHE_THRESHOLD <= 1.0
 
-SMALLTALK_PROMPT_TEMPLATE = """
-Bạn là trợ lý AI thân thiện của thư viện.
+# Parsed once; call with the same keyword arguments as .format()
+render_smalltalk_prompt = compile_template(SMALLTALK_PROMPT_TEMPLATE)
+render_general_qa_prompt = compile_template(GENERAL_QA_PROMPT_TEMPLATE)
+render_followup_prompt = compile_template(FOLLOWUP_PROMPT_TEMPLATE)
 
-Lịch sử hội thoại:
-{history}
+# Hardcoded library info answers, rendered once (LIBRARY_INFO is static)
+_bp = LIBRARY_INFO['borrow_policy']
+_pp = LIBRARY_INFO['penalty_policy']
+OPENING_HOURS_ANSWER = f"Thư viện mở cửa: {LIBRARY_INFO['opening_hours']}. Ngoài giờ này thư viện đóng cửa."
+BORROW_POLICY_ANSWER = f"Quy định mượn sách:\n- {_bp['fee']}\n- {_bp['duration']}\n- {_bp['renew']}"
+RETURN_POLICY_ANSWER = f"Quy định trả sách:\n- {_pp['late_return']}\n- {_pp['account_lock']}\n- {_pp['lost_book']}"
+PENALTY_POLICY_ANSWER = f"Quy định phí phạt:\n- {_pp['late_return']}\n- {_pp['account_lock']}\n- {_pp['lost_book']}"
+LIBRARY_RULES_ANSWER = "Nội quy thư viện:\n" + "\n".join(f"- {r}" for r in LIBRARY_INFO['library_rules'])
+LIBRARY_INFO_FALLBACK_ANSWER = f"Thư viện mở cửa: {LIBRARY_INFO['opening_hours']}. Nếu cần thông tin cụ thể, vui lòng hỏi lại."
 
-Người dùng nói: "{question}"
 
-Hãy trả lời một cách thân thiện, tự nhiên bằng tiếng Việt.
-- Nếu là lời chào: chào lại và giới thiệu ngắn gọn bạn có thể giúp tìm sách, tra cứu thông tin thư viện
-- Nếu là cảm ơn: đáp lại lịch sự và hỏi có cần giúp gì thêm không
-- Nếu là tạm biệt: chào tạm biệt thân thiện
-- Nếu hỏi về bạn: giới thiệu bạn là trợ lý AI thư viện
-- Nếu là câu hỏi chung: trả lời ngắn gọn, thông minh
+# ==================================================
+# KEYWORD PATTERNS (compiled once, one scan per query)
+# ==================================================
 
-Trả lời ngắn gọn (1-3 câu), thân thiện. KHÔNG dùng emoji.
-KHÔNG đưa ra danh sách sách nếu không được hỏi.
-"""
+# str.translate deletes these in one C pass (cheaper than re.sub for a fixed character set)
+_PUNCT_TABLE = str.maketrans('', '', '?.!,;:')
+_WORD_CHAR_RE = re.compile(r"[a-zA-Z\u00c0-\u1ef90-9]")
 
-GENERAL_QA_PROMPT_TEMPLATE = """
-Bạn là trợ lý AI thông minh của thư viện.
 
-Lịch sử hội thoại gần đây:
-{history}
+def _strip_marks(ch: str) -> str:
+    # Normalize to NFD form (separates base char and diacritics), drop the marks
+    return ''.join(c for c in unicodedata.normalize('NFD', ch) if not unicodedata.combining(c))
 
-Câu hỏi của người dùng: "{question}"
 
-Hướng dẫn trả lời:
-1. Nếu là câu hỏi kiến thức chung (toán, khoa học, lịch sử, v.v.): Trả lời chính xác, ngắn gọn
-2. Nếu là câu hỏi về sách nhưng thư viện không có: Nói rõ thư viện chưa có sách phù hợp
-3. Nếu là câu hỏi cá nhân hoặc không phù hợp: Nhẹ nhàng từ chối và hướng về chức năng thư viện
-4. Nếu là câu hỏi tiếp nối: Dựa vào lịch sử để trả lời chính xác
+# One str.translate() table for the whole Latin range (Vietnamese included), built once.
+# 'đ'/'Đ' are not decomposable in NFD, so they are mapped by hand; combining marks
+# (already-decomposed input) are deleted.
+_DIACRITIC_MAP = {cp: _strip_marks(chr(cp)) for cp in range(0xC0, 0x1EFA)
+                  if _strip_marks(chr(cp)) != chr(cp)}
+_DIACRITIC_MAP.update({ord('đ'): 'd', ord('Đ'): 'D'})
+_DIACRITIC_MAP.update({cp: None for cp in range(0x300, 0x370)})
 
-Trả lời bằng tiếng Việt, thân thiện, chính xác.
-KHÔNG dùng emoji/icon. KHÔNG dùng định dạng bôi đen (**text**).
-KHÔNG bịa tên sách hoặc thông tin không chính xác.
-"""
 
-FOLLOWUP_PROMPT_TEMPLATE = """
-Bạn là TRỢ LÝ THƯ VIỆN AI thông minh.
-
-============================
-Lịch sử hội thoại:
-============================
-{history}
-
-============================
-Danh sách sách đã đề cập trước đó:
-============================
-{previous_books}
-
-============================
-Câu hỏi tiếp theo của người dùng:
-============================
-{question}
-
-============================
-Hướng dẫn trả lời:
-============================
-1. Đây là câu hỏi TIẾP NỐI, hãy dựa vào ngữ cảnh trước đó
-2. Nếu hỏi "cuốn nào hay/dễ/tốt nhất" → chọn từ danh sách sách đã đề cập và giải thích lý do
-3. Nếu hỏi "cuốn thứ X" → tham chiếu đến vị trí trong danh sách
-4. Nếu hỏi chi tiết về một cuốn → cung cấp thông tin có sẵn
-5. Trả lời ngắn gọn, đi thẳng vào vấn đề.
-6. KHÔNG dùng icon/emoji. KHÔNG dùng định dạng bôi đen (**text**).
-"""
+@lru_cache(maxsize=1024)
+def remove_diacritics(text: str) -> str:
+    """
+    Remove Vietnamese diacritics from text.
+    Example: "xin chào" -> "xin chao"
+    Memoized: every intent check of a turn normalizes the same question again.
+    """
+    return text.translate(_DIACRITIC_MAP)
+
+
+@lru_cache(maxsize=1024)
+def _fold(text: str) -> str:
+    """Lowercased, diacritic-free text for keyword matching, computed once per question."""
+    return remove_diacritics(text.lower())
+
+
+@lru_cache(maxsize=1024)
+def _fold_clean(text: str) -> str:
+    """_fold() without surrounding whitespace and punctuation (smalltalk / book-related checks)."""
+    return _fold(text.strip()).translate(_PUNCT_TABLE)
+
+
+def _substring_pattern(keywords: List[str]) -> "re.Pattern":
+    """Match any keyword anywhere in the text (same as any(k in q for k in keywords))."""
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    """
+    Single-word keywords must be a whole whitespace-separated word
+    (so "hi" does not match "chi tiet"); multi-word keywords match as substrings.
+    """
+    words = [re.escape(k) for k in keywords if " " not in k]
+    phrases = [re.escape(k) for k in keywords if " " in k]
+    alternatives = []
+    if words:
+        alternatives.append(r"(?<!\S)(?:" + "|".join(words) + r")(?!\S)")
+    alternatives.extend(phrases)
+    return re.compile("|".join(alternatives))
+
+
+_HELP_RE = _substring_pattern(["giup toi", "giup minh", "help", "help me", "ho tro"])
+_BOOK_CONTEXT_RE = _substring_pattern(["sach", "cuon", "quyen", "tim", "co", "muon"])
+
+_SMALLTALK_RE = _keyword_pattern([
+    # Chao hoi
+    "xin chao", "chao ban", "chao", "chao buoi sang", "chao buoi toi",
+    "chao buoi trua", "chao buoi chieu",
+    # Tieng Anh
+    "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
+    # Cam on
+    "cam on", "cam on ban", "cam on nhieu",
+    # Tieng Anh
+    "thank", "thanks", "thank you", "tks", "ty",
+    # Tam biet
+    "tam biet", "hen gap lai", "gap lai sau", "bye bye",
+    # Tieng Anh
+    "bye", "goodbye", "see you", "see ya",
+    # Hoi tham
+    "ban la ai", "ten gi", "khoe khong", "ban on khong", "ban co khoe khong",
+    # Tieng Anh
+    "how are you", "what's up", "who are you", "what is your name",
+    # Cac cau don gian
+    "alo", "yo", "hii", "hiii", "helloo", "helo",
+    # Xin loi / OK
+    "xin loi", "sorry", "ok", "okay", "duoc", "duoc roi", "dc", "dk",
+    # Giup do (only if no book context)
+    "giup toi", "giup minh", "help", "help me", "ho tro"
+])
+
+# Hardcoded smalltalk replies - KHONG CAN GOI AI. Checked in order.
+_SMALLTALK_REPLIES = [
+    (_keyword_pattern(["xin chao", "chao ban", "chao", "hello", "hi", "hey", "alo", "yo",
+                       "hii", "hiii", "helloo", "helo",
+                       "good morning", "good afternoon", "good evening"]),
+     "Xin chào! Tôi là trợ lý thư viện AI. Tôi có thể giúp bạn tìm sách, tra cứu thông tin thư viện. Bạn cần gì nào?"),
+    (_keyword_pattern(["cam on", "cam on ban", "thank", "thanks", "thank you", "tks", "ty"]),
+     "Không có gì! Nếu bạn cần gì thêm, cứ hỏi nhé!"),
+    (_keyword_pattern(["tam biet", "bye", "goodbye", "see you", "see ya", "hen gap lai", "gap lai sau"]),
+     "Tạm biệt! Hẹn gặp lại bạn!"),
+    (_keyword_pattern(["ban la ai", "ten gi", "who are you", "what is your name"]),
+     "Tôi là Trợ lý AI của Thư viện. Tôi có thể giúp bạn tìm sách, tra cứu giờ mở cửa, nội quy và các thông tin khác về thư viện."),
+    (_keyword_pattern(["khoe khong", "ban on khong", "how are you", "what's up"]),
+     "Tôi vẫn khỏe! Cảm ơn bạn đã hỏi. Bạn cần tìm sách gì hôm nay?"),
+    (_keyword_pattern(["giup toi", "giup minh", "help", "ho tro"]),
+     "Tôi có thể giúp bạn: Tìm sách theo chủ đề, tác giả hoặc thể loại; Tra cứu giờ mở cửa thư viện; Xem nội quy và quy định mượn sách. Bạn muốn làm gì?"),
+    (_keyword_pattern(["ok", "okay", "duoc", "duoc roi", "dc", "dk"]),
+     "Vâng! Nếu bạn cần gì thêm, cứ hỏi nhé!"),
+    (_keyword_pattern(["xin loi", "sorry"]),
+     "Không sao đâu! Bạn cần tìm sách gì cứ hỏi nhé!"),
+]
+
+# Matched against the diacritic-free query, so one unaccented spelling covers both
+_BOOK_RELATED_RE = _substring_pattern([
+    # Từ khóa sách
+    "sach", "cuon", "quyen", "tai lieu", "giao trinh", "truyen",
+    "tieu thuyet", "tac pham", "ebook", "pdf",
+    # Từ khóa tìm kiếm
+    "tim", "tim kiem", "goi y", "de xuat", "cho toi", "co khong",
+    # Thể loại sách
+    "python", "java", "programming", "lap trinh",
+    "machine learning", "ai", "deep learning", "data science",
+    "toan", "van", "lich su", "dia ly", "vat ly", "hoa hoc",
+    # Tiếng Anh
+    "book", "novel", "textbook", "recommend", "find", "search"
+])
+
+_FOLLOWUP_RE = _substring_pattern([
+    # Book reference keywords
+    "cuon nay", "cuon do", "cuon thu", "sach nay", "sach do",
+    "chi tiet", "no noi ve", "tac gia la ai", "gia bao nhieu",
+    "trong so", "cuon nao", "cai nao", "de hoc", "tot nhat",
+    "phu hop", "nen chon", "o tren", "vua roi", "trong danh sach",
+    "hay nhat", "hay hon", "tot hon", "noi ve gi", "ve cai gi",
+    "cua ai", "ai viet", "nam nao", "xuat ban nam", "may trang",
+    "nen doc", "doc truoc", "doc sau", "cuon dau", "cuon cuoi",
+
+    # FIX: Added missing keywords for collective follow-ups
+    "tom tat",          # tóm tắt
+    "tat ca",           # tất cả
+    "ca hai",           # cả hai
+    "ca 2", "ca 3",     # cả 2, cả 3
+    "moi cuon",         # mọi cuốn
+    "cac cuon",         # các cuốn
+    "nhung cuon",       # những cuốn
+    "so sanh",          # so sánh
+    "khac nhau",        # khác nhau
+])
+_FOLLOWUP_INDEX_RE = re.compile(r"(cuon|so|quyen)\s*\d+")
+
+# "bao nhieu ... sach", "tong so/so luong ... sach", "co ... bao nhieu", "co ... tat ca"
+_STATS_RE = re.compile(
+    r"bao nhieu.*(?:sach|cuon|quyen|tac pham)"
+    r"|(?:tong so|so luong).*(?:sach|cuon|quyen|tac pham)"
+    r"|co.*bao nhieu"
+    r"|co.*tat ca"
+)
+
+# Library info must be specific to RULES/POLICIES, not just actions:
+# "muon sach" alone is ambiguous (could be search), so the query must imply "how to" or "rules"
+_LIBRARY_INFO_RE = _substring_pattern([
+    "gio mo cua", "thoi gian mo cua", "lich mo cua",
+    "quy dinh", "noi quy", "luat thu vien",
+    "phi phat", "tien phat",
+    "cach muon", "thu tuc muon", "dieu kien muon", "luat muon", "huong dan muon",
+    "cach tra", "thu tuc tra", "luat tra", "huong dan tra",
+    "muon bao lau", "muon duoc may", "gia han"
+])
+
+# Hardcoded library info answers - KHONG CAN GOI AI. Checked in order:
+# SPECIFIC policies (borrow/return) before GENERAL rules
+_LIBRARY_INFO_ANSWERS = [
+    (_substring_pattern(["gio mo cua", "mo cua", "may gio"]), OPENING_HOURS_ANSWER),
+    (_substring_pattern(["muon sach", "muon", "borrow", "gia han"]), BORROW_POLICY_ANSWER),
+    (_substring_pattern(["tra sach", "tra", "return"]), RETURN_POLICY_ANSWER),
+    (_substring_pattern(["phi phat", "phat", "penalty"]), PENALTY_POLICY_ANSWER),
+    (_substring_pattern(["noi quy", "quy dinh", "luat"]), LIBRARY_RULES_ANSWER),
+]
+
+# Explicit title search; "sach" alone is too broad, require more specific patterns
+_TITLE_INDICATOR_RES = [
+    re.compile(r"(?:tim|co|muon|kiem)\s+cuon\s+([a-z0-9\s]{3,})"),  # "tìm cuốn [Title]"
+    re.compile(r"(?:cuon|quyen)\s+(?:ten|tua|co ten)\s+(?:la\s+)?([a-z0-9\s]{3,})"),  # "cuốn tên là [Title]"
+]
+_TITLE_CATEGORY_KEYWORDS = (
+    "toan", "ly", "hoa", "van", "su", "dia", "sinh",
+    "kinh te", "tai chinh", "marketing", "lap trinh",
+    "python", "java", "ai", "machine learning",
+    "van hoc", "lich su", "khoa hoc", "tam ly", "triet hoc",
+    "kinh doanh", "quan tri", "ky nang", "ngoai ngu"
+)
+
+
+@lru_cache(maxsize=1024)
+def _scan_local_intents(question: str) -> frozenset:
+    """
+    Intents decidable from the question text alone: "SMALLTALK", "STATS", "LIBRARY_INFO",
+    plus "FOLLOWUP" when the wording refers back to a previous list (only used if there is one).
+    Memoized: the CLI pre-check, generate_answer() and classify_intent() all ask about
+    the same question within a turn.
+    """
+    folded = _fold(question)
+    found = set()
+
+    # Normalize: lowercase, remove punctuation, remove diacritics ("xin chào" -> "xin chao")
+    q = _fold_clean(question)
+    # FIX: Exclude book-related help requests like "giúp tôi tìm sách python"
+    # If it has BOTH help AND book context, it's a book query, NOT smalltalk
+    # Single-word keywords match whole words only: "hi" should NOT match "chi tiet"
+    if not (_HELP_RE.search(q) and _BOOK_CONTEXT_RE.search(q)) and _SMALLTALK_RE.search(q):
+        found.add("SMALLTALK")
+    if _STATS_RE.search(folded):
+        found.add("STATS")
+    # If user says "toi muon muon sach", let it fall to SEARCH or generic AI which clarifies.
+    if _LIBRARY_INFO_RE.search(folded):
+        found.add("LIBRARY_INFO")
+    if _FOLLOWUP_RE.search(folded) or _FOLLOWUP_INDEX_RE.search(folded):
+        found.add("FOLLOWUP")
+    return frozenset(found)
+
+
+# Follow-ups about the whole list or a comparison always go to the LLM
+_COLLECTIVE_RE = _substring_pattern([
+    "tất cả", "cả hai", "cả 2", "cả 3", "mọi cuốn", "những cuốn này", "các cuốn",
+    "so sánh", "khác nhau", "giống nhau", "vs"
+])
+# 1-based positions; "cuối cùng" (last) is resolved against the result count
+_ORDINAL_WORDS = {
+    "một": 1, "hai": 2, "ba": 3, "bốn": 4, "năm": 5,
+    "nhất": 1, "nhì": 2, "đầu tiên": 1, "cuối cùng": -1
+}
+# One scan for either "thứ hai" (word) or "cuốn 2" (digit)
+_FOLLOWUP_IDX_RE = re.compile(
+    r"(?:thứ|số|cuốn|quyển)\s*(?P<word>" + "|".join(_ORDINAL_WORDS) + r")"
+    r"|(?:thứ|số|cuốn|quyển|^)\s*(?P<digit>\d+)"
+)
+
+_SYNTHESIS_RE = _substring_pattern([
+    "nên", "phù hợp", "gợi ý", "so sánh", "đánh giá",
+    "phân tích", "tổng hợp", "giải thích", "vì sao", "như thế nào"
+])
+
+
+# ==================================================
+# FILTER EXTRACTION TABLES (_extract_filters_from_text)
+# ==================================================
+
+# Filter extraction synonyms: map short/common terms to EXACT category names in DB
+# Dựa trên 15 thể loại thực tế trong DB (xem all_categories_analysis_20260127_161608.png):
+# Máy tính (91), CNTT (70), Kỹ năng (66), Kỹ thuật (59), Tài chính (54),
+# Khởi nghiệp (50), Kinh doanh (31), Kinh tế (30), Trí tuệ và Dữ liệu (21),
+# Văn học (12), Xã hội (9), Giáo dục (4), Khác (2), Lịch sử (2), Toán (1)
+_CATEGORY_MAP = {
+    # === MÁY TÍNH (91 sách) ===
+    "python": "Máy tính",
+    "java": "Máy tính",
+    "javascript": "Máy tính",
+    "lap trinh": "Máy tính",
+    "may tinh": "Máy tính",
+    "software": "Máy tính",
+    "phan mem": "Máy tính",
+    
+    # === CÔNG NGHỆ THÔNG TIN (70 sách) ===
+    "cntt": "Công nghệ thông tin",
+    "it": "Công nghệ thông tin",
+    "cong nghe thong tin": "Công nghệ thông tin",
+    "mang": "Công nghệ thông tin",
+    "bao mat": "Công nghệ thông tin",
+    
+    # === KỸ NĂNG (66 sách) ===
+    "ky nang": "Kỹ năng",
+    "ky nang song": "Kỹ năng",
+    "ky nang mem": "Kỹ năng",
+    "phat trien ban than": "Kỹ năng",
+    "giao tiep": "Kỹ năng",
+    "lanh dao": "Kỹ năng",
+    
+    # === KỸ THUẬT (59 sách) ===
+    "ky thuat": "Kỹ thuật",
+    "co khi": "Kỹ thuật",
+    "dien tu": "Kỹ thuật",
+    "xay dung": "Kỹ thuật",
+    
+    # === TÀI CHÍNH (54 sách) ===
+    "tai chinh": "Tài chính",
+    "ke toan": "Tài chính",
+    "ngan hang": "Tài chính",
+    "dau tu": "Tài chính",
+    "chung khoan": "Tài chính",
+    
+    # === KHỞI NGHIỆP (50 sách) ===
+    "khoi nghiep": "Khởi nghiệp",
+    "startup": "Khởi nghiệp",
+    "doanh nhan": "Khởi nghiệp",
+    
+    # === KINH DOANH (31 sách) ===
+    "kinh doanh": "Kinh doanh",
+    "quan tri": "Kinh doanh",
+    "quan ly": "Kinh doanh",
+    "business": "Kinh doanh",
+    
+    # === KINH TẾ (30 sách) ===
+    "kinh te": "Kinh tế",
+    "kinh te hoc": "Kinh tế",
+    "economics": "Kinh tế",
+    
+    # === TRÍ TUỆ VÀ DỮ LIỆU (21 sách) ===
+    "ai": "Trí tuệ và Dữ liệu",
+    "tri tue nhan tao": "Trí tuệ và Dữ liệu",
+    "machine learning": "Trí tuệ và Dữ liệu",
+    "hoc may": "Trí tuệ và Dữ liệu",
+    "data science": "Trí tuệ và Dữ liệu",
+    "khoa hoc du lieu": "Trí tuệ và Dữ liệu",
+    "big data": "Trí tuệ và Dữ liệu",
+    
+    # === VĂN HỌC (12 sách) ===
+    "van": "Văn học",
+    "van hoc": "Văn học",
+    
+    # === XÃ HỘI (9 sách) ===
+    "xa hoi": "Xã hội",
+    "tam ly": "Xã hội",  # Tâm lý → map vào Xã hội (không có category riêng)
+    "tam ly hoc": "Xã hội",
+    
+    # === GIÁO DỤC (4 sách) ===
+    "giao duc": "Giáo dục",
+    "su pham": "Giáo dục",
+    "hoc tap": "Giáo dục",
+    
+    # === LỊCH SỬ (2 sách) ===
+    "lich su": "Lịch sử",
+    "su": "Lịch sử",
+    
+    # === TOÁN (1 sách) ===
+    "toan": "Toán",
+    "toan hoc": "Toán",
+    
+    # === MARKETING (thuộc Kinh doanh?) ===
+    "marketing": "Kinh doanh",
+}
+# Word boundary avoids partial matches (e.g. "hoa" in "khoa hoc"); checked in map order
+_CATEGORY_KEY_RES = [(re.compile(r'\b' + re.escape(key) + r'\b'), category)
+                     for key, category in _CATEGORY_MAP.items()]
+
+# Capture "năm YYYY", "xuất bản YYYY" -> "nam", "xuat ban"
+_FILTER_YEAR_RES = [
+    re.compile(r"(?:nam|xuat ban|xb)\s+(\d{4})"),
+    re.compile(r"(\d{4})"),  # Standalone year check
+]
+
+# Capture Title explicitly: "cuốn X", "quyển X" -> "cuon X", "quyen X"
+# Note: "sach" is ambiguous (sach python -> category), so we avoid it for title unless "sách tên là"
+_FILTER_TITLE_RES = [
+    re.compile(r"(?:cuon|quyen|tac pham|tieu de|tua de)\s+(?:sach\s+)?(.+)"),
+    re.compile(r"sach\s+(?:ten|tua|co ten|co tua)\s+(?:la\s+)?(.+)"),
+]
+
+# Blacklist common category keywords that should NOT be titles
+_FILTER_TITLE_BLACKLIST_RE = _substring_pattern([
+    "toan", "ly", "hoa", "van", "su", "dia", "sinh",
+    "kinh te", "tai chinh", "marketing", "lap trinh", "cntt",
+    "python", "java", "ai", "machine learning", "data science",
+    "ky nang", "tam ly", "triet hoc", "van hoc", "khoa hoc"
+])
+
+# Capture "tác giả Y", "của Y" -> "tac gia Y", "cua Y"
+_FILTER_AUTHOR_RES = [
+    re.compile(r"(?:tac gia|boi|viet boi|cua|soan boi)\s+([\w\s]+)"),
+]
+
+# "sách về X" with X not in _CATEGORY_MAP: topic as typed (với dấu) for display...
+_UNKNOWN_CAT_ORIG_RES = [
+    re.compile(r"sách\s+về\s+(\w+)"),        # sách về X (với dấu)
+    re.compile(r"về\s+(\w+)"),                # về X
+    re.compile(r"thể loại\s+(\w+)"),          # thể loại X
+    re.compile(r"chủ đề\s+(\w+)"),            # chủ đề X
+]
+# ...and normalized for validation
+_UNKNOWN_CAT_NORM_RES = [
+    re.compile(r"sach\s+ve\s+(\w+)"),
+    re.compile(r"ve\s+(\w+)"),
+    re.compile(r"the loai\s+(\w+)"),
+    re.compile(r"chu de\s+(\w+)"),
+]
+
+
+# ==================================================
+# SESSION HISTORY WRITER (off the request thread)
+# ==================================================
+
+# (path, encoded JSONL lines) appended by ChatSession.add_message()
+_SESSION_WRITE_Q: "queue.Queue[Tuple[str, bytes]]" = queue.Queue()
+# path -> lines queued but not yet written, so loading one session only waits for its own file
+_SESSION_PENDING: Dict[str, int] = {}
+_SESSION_PENDING_CV = threading.Condition()
+
+
+@lru_cache(maxsize=256)
+def _ensure_dir(path: str):
+    """makedirs() once per directory per process instead of a mkdir/stat on every write."""
+    os.makedirs(path, exist_ok=True)
+
+
+def _write_session_batch(batch: List[Tuple[str, bytes]]):
+    """One open/write per file for everything queued since the last flush."""
+    by_path: Dict[str, List[bytes]] = {}
+    for path, data in batch:
+        by_path.setdefault(path, []).append(data)
+    for path, chunks in by_path.items():
+        try:
+            _ensure_dir(os.path.dirname(path))
+            with open(path, "ab", buffering=8192) as f:
+                f.write(b"".join(chunks))
+        except Exception as e:
+            logger.error(f"Failed to append session history {path}: {e}")
+
+
+def _session_writer():
+    while True:
+        batch = [_SESSION_WRITE_Q.get()]
+        # Debounce: collect for up to SESSION_FLUSH_INTERVAL_MS (or a full batch), then write together
+        deadline = time.monotonic() + SESSION_FLUSH_INTERVAL_MS / 1000
+        while len(batch) < SESSION_FLUSH_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_SESSION_WRITE_Q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_session_batch(batch)
+        with _SESSION_PENDING_CV:
+            for path, _ in batch:
+                _SESSION_PENDING[path] -= 1
+                if not _SESSION_PENDING[path]:
+                    del _SESSION_PENDING[path]
+            _SESSION_PENDING_CV.notify_all()
+        for _ in batch:
+            _SESSION_WRITE_Q.task_done()
+
+
+def flush_session_writes():
+    """Block until every queued history line is on disk (shutdown, reloading a session)."""
+    _SESSION_WRITE_Q.join()
+
+
+def _wait_session_writes(path: str):
+    """Block until the queued history lines of one session file are on disk."""
+    with _SESSION_PENDING_CV:
+        _SESSION_PENDING_CV.wait_for(lambda: path not in _SESSION_PENDING)
+
+
+_writer_thread = threading.Thread(target=_session_writer, name="session-writer", daemon=True)
+_writer_thread.start()
+# Daemon threads are killed at exit; wait for queued history to reach disk first
+atexit.register(flush_session_writes)
+
+
+def _read_tail_lines(path: str, n: int, block_size: int = 4096) -> Tuple[int, List[bytes]]:
+    """
+    Read the last n lines of a file backwards in blocks, without reading the rest.
+    Returns (byte offset where the first returned line starts, lines).
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        chunks: List[bytes] = []
+        newlines = 0
+        while pos > 0 and newlines <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            chunks.append(chunk)
+            newlines += chunk.count(b"\n")
+    lines = b"".join(reversed(chunks)).splitlines(keepends=True)
+    if pos > 0 and lines:
+        pos += len(lines.pop(0))  # Partial line cut by the block boundary
+    if len(lines) > n:
+        pos += sum(len(line) for line in lines[:-n])
+        lines = lines[-n:]
+    return pos, lines
+
+
+def _parse_history_lines(lines) -> List[Dict]:
+    history = []
+    for line in lines:
+        try:
+            history.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            continue  # Torn last line from an interrupted write
+    return history
+
+
+# Indexed by role == "user"
+_HISTORY_PREFIXES = ("Trợ lý: ", "Người dùng: ")
 
 
 class ChatSession:
     """
     Lưu trữ trạng thái hội thoại của một user/session.
-    Persists to disk to survive restarts.
+    Persists to disk to survive restarts:
+    - rag_{id}.jsonl: history, one message per line, appended by the background writer
+    - rag_{id}_state.json: last_search_results, rewritten only when they change (save())
     """
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.history: List[Dict] = []
         self.last_search_results: List[Dict] = []
-        self.file_path = os.path.join(
-            settings.DATA_PROCESSED_DIR,
-            "chat_sessions",
-            f"rag_{session_id}.json"
-        )
+        # {max_turns: (len(history) when rendered, text)}
+        self._history_cache: Dict[int, Tuple[int, str]] = {}
+        # last_search_results as last written to state_path (save() skips identical rewrites)
+        self._saved_results: List[Dict] = []
+        # load() only parses the tail of the log; bytes before this offset are not in history
+        self._history_offset = 0
+        session_dir = os.path.join(settings.DATA_PROCESSED_DIR, "chat_sessions")
+        self.history_path = os.path.join(session_dir, f"rag_{session_id}.jsonl")
+        self.state_path = os.path.join(session_dir, f"rag_{session_id}_state.json")
+        # Single-file format used before history was split out; migrated on load
+        self.legacy_path = os.path.join(session_dir, f"rag_{session_id}.json")
 
     def add_message(self, role: str, text: str):
-        self.history.append({"role": role, "text": text})
-        self.save()
+        message = {"role": role, "text": text}
+        self.history.append(message)
+        self._history_cache.clear()
+        self._append_messages([message])
+
+    def has_prior_turns(self) -> bool:
+        """
+        Whether anything precedes the question being answered. generate_answer() appends
+        that question before dispatching, so it alone does not make the session stateful.
+        """
+        return len(self.history) > 1 or self._history_offset > 0
 
     def get_history_text(self, max_turns: int = 8) -> str:
-        """Chuyển history thành text cho prompt (THÊM TỪ HEAD)"""
+        """
+        Chuyển history thành text cho prompt (THÊM TỪ HEAD)
+        Cached per max_turns until the history grows (several prompts per turn reuse it).
+        """
+        history_len = len(self.history)
+        cached = self._history_cache.get(max_turns)
+        if cached and cached[0] == history_len:
+            return cached[1]
         if not self.history:
             return "(chưa có lịch sử)"
-        lines = []
-        for h in self.history[-max_turns:]:
-            prefix = "Người dùng" if h["role"] == "user" else "Trợ lý"
-            lines.append(f"{prefix}: {h['text']}")
-        return "\n".join(lines)
+        text = "\n".join(
+            _HISTORY_PREFIXES[h["role"] == "user"] + h["text"]
+            for h in self.history[-max_turns:]
+        )
+        self._history_cache[max_turns] = (history_len, text)
+        return text
+
+    def _append_messages(self, messages: List[Dict], sync: bool = False):
+        """Queue history lines for the background writer (non-blocking unless sync)."""
+        data = b"".join(orjson.dumps(m) + b"\n" for m in messages)
+        if sync:
+            _write_session_batch([(self.history_path, data)])
+        else:
+            with _SESSION_PENDING_CV:
+                _SESSION_PENDING[self.history_path] = _SESSION_PENDING.get(self.history_path, 0) + 1
+            _SESSION_WRITE_Q.put((self.history_path, data))
 
     def save(self):
+        """
+        Persist last_search_results (history is appended by add_message()).
+        No-op when they are unchanged since the last save/load (e.g. a repeated cached answer).
+        """
+        if self.last_search_results == self._saved_results:
+            return
         try:
-            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            _ensure_dir(os.path.dirname(self.state_path))
             data = {
                 "session_id": self.session_id,
-                "history": self.history,
                 "last_search_results": self.last_search_results
             }
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with open(self.state_path, "wb") as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
+            self._saved_results = list(self.last_search_results)
         except Exception as e:
             logger.error(f"Failed to save session {self.session_id}: {e}")
 
     def load(self):
         try:
-            if os.path.exists(self.file_path):
-                with open(self.file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.history = data.get("history", [])
-                    self.last_search_results = data.get("last_search_results", [])
+            if not os.path.exists(self.history_path) and os.path.exists(self.legacy_path):
+                self._migrate_legacy()
+                return
+
+            if os.path.exists(self.history_path):
+                self._history_offset, lines = _read_tail_lines(
+                    self.history_path, SESSION_LOAD_TAIL_MESSAGES)
+                self.history = _parse_history_lines(lines)
+            if os.path.exists(self.state_path):
+                with open(self.state_path, "rb") as f:
+                    self.last_search_results = orjson.loads(f.read()).get("last_search_results", [])
+                self._saved_results = list(self.last_search_results)
         except Exception as e:
             logger.error(f"Failed to load session {self.session_id}: {e}")
 
+    def get_full_history(self) -> List[Dict]:
+        """Full history, parsing the older messages load() skipped on first use."""
+        if self._history_offset:
+            try:
+                with open(self.history_path, "rb") as f:
+                    head = f.read(self._history_offset)
+                self.history[:0] = _parse_history_lines(head.splitlines())
+                self._history_offset = 0
+                self._history_cache.clear()
+            except Exception as e:
+                logger.error(f"Failed to load full history of session {self.session_id}: {e}")
+        return self.history
+
+    def _migrate_legacy(self):
+        """Split an old rag_{id}.json into the history log + state file."""
+        with open(self.legacy_path, "rb") as f:
+            data = orjson.loads(f.read())
+        self.history = data.get("history", [])
+        self.last_search_results = data.get("last_search_results", [])
+        # Written synchronously: the legacy file is deleted right after
+        self._append_messages(self.history, sync=True)
+        self.save()
+        os.remove(self.legacy_path)
+        logger.info(f"Migrated session {self.session_id} to append-only history")
+
 
 class RAGEngine:
     """
@@ -195,25 +730,107 @@ class RAGEngine:
     def __init__(self, top_k: int = DEFAULT_TOP_K):
         # 1. SEARCH ENGINE
         self.search_engine = SearchEngine()
-        self.embedder = self.search_engine.embedder
+        # Concurrent sessions' query embeddings are coalesced into one forward pass
+        self.embedder = BatchingEmbedder(self.search_engine.embedder)
         self.vector_db = self.search_engine.vector_db
         self.top_k = top_k
 
         # 2. Model Manager (multi-key rotation)
         self.model_manager = ModelManager(
             api_keys=GEMINI_API_KEYS,
-            models=GEMINI_MODELS
+            models=GEMINI_MODELS,
+            rate_limits=GEMINI_RATE_LIMITS
         )
 
-        # 3. Session storage {session_id: ChatSession}
-        self.sessions: Dict[str, ChatSession] = {}
+        # 3. Session storage {session_id: ChatSession}, LRU bounded by SESSION_CACHE_SIZE
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # Evicted sessions still held by an in-flight request: reused instead of a second copy
+        self._live_sessions: "weakref.WeakValueDictionary[str, ChatSession]" = weakref.WeakValueDictionary()
+        self._sessions_lock = threading.Lock()
+
+        # 4. Per-thread token callback of the generate_answer() call in progress (streaming)
+        self._stream = threading.local()
+
+        # 5. LRU cache of smalltalk / general-QA replies {(intent, normalized question): answer}
+        self._response_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+
+        # 6. LRU cache of query embeddings {normalized query: vector}, persisted to SQLite
+        #    so returning users' queries skip the model after a restart too
+        # Vectors are held as float32 arrays (~4 bytes/dim) rather than lists of Python
+        # floats (~32 bytes/dim); callers still get lists
+        self._embed_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._embed_cache_lock = threading.Lock()
+        self._embed_cache_hits = 0
+        self._embed_cache_misses = 0
+        self._embed_db = self._open_embed_cache(
+            os.path.join(settings.DATA_PROCESSED_DIR, "query_embeddings.sqlite"))
+        # SQLite writes (and their fsync) run here, off the request thread. One worker keeps
+        # inserts and evictions in order and is the only user of _embed_db after startup.
+        self._embed_db_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-db")
+
+        # 7. Questions already written to query memory (bounded LRU used as a set)
+        self._query_memory_seen: "OrderedDict[str, None]" = OrderedDict()
+        self._query_memory_lock = threading.Lock()
+
+        # 8. Vector DB calls that overlap other work (speculative search, query-memory writes)
+        self._io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-io")
 
     def get_session(self, session_id: str) -> ChatSession:
-        if session_id not in self.sessions:
+        with self._sessions_lock:
+            session = self._cached_session(session_id)
+            if session is not None:
+                return session
+
+        # Disk reads happen outside the lock, so a cold load does not stall other users' lookups
+        session = ChatSession(session_id)
+        # An evicted session may still have history lines queued for the writer.
+        # Only this session's file is awaited: a new session does not wait on other users' writes.
+        _wait_session_writes(session.history_path)
+        session.load()
+
+        with self._sessions_lock:
+            # Loaded by another thread meanwhile: keep that copy, drop ours
+            cached = self._cached_session(session_id)
+            if cached is not None:
+                return cached
+            self._live_sessions[session_id] = session
+            self._cache_session(session_id, session)
+            return session
+
+    def _cached_session(self, session_id: str) -> Optional[ChatSession]:
+        """Session from the LRU, or an evicted one still in use (re-inserted). Caller holds _sessions_lock."""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            return session
+        session = self._live_sessions.get(session_id)
+        if session is not None:
+            self._cache_session(session_id, session)
+        return session
+
+    def _cache_session(self, session_id: str, session: ChatSession):
+        """Insert into the LRU and evict past SESSION_CACHE_SIZE. Caller holds _sessions_lock."""
+        self.sessions[session_id] = session
+        while len(self.sessions) > SESSION_CACHE_SIZE:
+            self.sessions.popitem(last=False)
+
+    def discard_session(self, session_id: str):
+        """Forget a session and delete its files (throwaway sessions, e.g. CLI prefetch)."""
+        with self._sessions_lock:
+            live = self._live_sessions.pop(session_id, None)
+            session = self.sessions.pop(session_id, None) or live
+        if session is None:
             session = ChatSession(session_id)
-            session.load()
-            self.sessions[session_id] = session
-        return self.sessions[session_id]
+        # Queued history lines would otherwise recreate the file after it is removed
+        _wait_session_writes(session.history_path)
+        for path in (session.history_path, session.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to delete session file {path}: {e}")
 
     # ==================================================
     # SMALLTALK DETECTION (THÊM TỪ HEAD)
@@ -227,122 +844,30 @@ class RAGEngine:
         Nhan dien cau hoi smalltalk / chao hoi.
         Ho tro ca tieng Viet co dau va khong dau (normalize thanh khong dau).
         """
-        # Normalize: lowercase, remove punctuation, remove diacritics
-        q = question.lower().strip()
-        q = re.sub(r'[?.!,;:]', '', q)
-        q = remove_diacritics(q)  # Convert "xin chào" -> "xin chao"
-        
-        # FIX: Exclude book-related help requests like "giúp tôi tìm sách python"
-        help_keywords = ["giup toi", "giup minh", "help", "help me", "ho tro"]
-        book_context_keywords = ["sach", "cuon", "quyen", "tim", "co", "muon"]
-        
-        # Check if query contains help keyword (substring match)
-        has_help = any(help_kw in q for help_kw in help_keywords)
-        # Check if query contains book keyword
-        has_book_context = any(book_kw in q for book_kw in book_context_keywords)
-        
-        # If it has BOTH help AND book context, it's a book query, NOT smalltalk
-        if has_help and has_book_context:
-            return False
-
-        smalltalk_keywords = [
-            # Chao hoi
-            "xin chao", "chao ban", "chao", "chao buoi sang", "chao buoi toi",
-            "chao buoi trua", "chao buoi chieu",
-            # Tieng Anh
-            "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
-            # Cam on
-            "cam on", "cam on ban", "cam on nhieu",
-            # Tieng Anh
-            "thank", "thanks", "thank you", "tks", "ty",
-            # Tam biet
-            "tam biet", "hen gap lai", "gap lai sau", "bye bye",
-            # Tieng Anh
-            "bye", "goodbye", "see you", "see ya",
-            # Hoi tham
-            "ban la ai", "ten gi", "khoe khong", "ban on khong", "ban co khoe khong",
-            # Tieng Anh
-            "how are you", "what's up", "who are you", "what is your name",
-            # Cac cau don gian
-            "alo", "yo", "hii", "hiii", "helloo", "helo",
-            # Xin loi / OK
-            "xin loi", "sorry", "ok", "okay", "duoc", "duoc roi", "dc", "dk",
-            # Giup do (only if no book context)
-            "giup toi", "giup minh", "help", "help me", "ho tro"
-        ]
-
-        if q in smalltalk_keywords:
-            return True
-
-        # Use simple word boundary check for all keywords to avoid false positives
-        # E.g. "hi" should NOT match "chi tiet"
-        q_words = set(q.split())
-        for k in smalltalk_keywords:
-            # If keyword is single word, check if it exists in word set
-            if " " not in k:
-                if k in q_words:
-                    return True
-            # If keyword matches exactly part of the phrase (simpler than regex)
-            elif k in q:
-                return True
-
-        return False
+        return "SMALLTALK" in _scan_local_intents(question)
 
     def answer_smalltalk(self, question: str, session: ChatSession) -> str:
         """
         Tra loi smalltalk. Uu tien tra loi san, chi goi AI khi can.
         """
-        q = remove_diacritics(question.lower().strip())
-        q = re.sub(r'[?.!,;:]', '', q)
+        q = _fold_clean(question)
 
         # Hardcoded responses - KHONG CAN GOI AI
-        greetings = ["xin chao", "chao ban", "chao", "hello", "hi", "hey", "alo", "yo"]
-        thanks = ["cam on", "cam on ban", "thanks", "thank you", "tks", "ty"]
-        goodbyes = ["tam biet", "bye", "goodbye", "see you", "hen gap lai"]
-        who_are_you = ["ban la ai", "ten gi", "who are you", "what is your name"]
-        how_are_you = ["khoe khong", "ban on khong", "how are you", "what's up"]
-        helps = ["giup toi", "giup minh", "help", "ho tro"]
-        oks = ["ok", "okay", "duoc", "duoc roi", "dc", "dk"]
-
-        q_words = set(q.split())
-
-        def check_keywords(keywords):
-            for k in keywords:
-                if " " not in k: # Single word -> check word set
-                    if k in q_words: return True
-                elif k in q: # Multi word -> check substring
-                    return True
-            return False
-
-        # Check and return hardcoded response
-        if check_keywords(greetings):
-            return "Xin chào! Tôi là trợ lý thư viện AI. Tôi có thể giúp bạn tìm sách, tra cứu thông tin thư viện. Bạn cần gì nào?"
-
-        if check_keywords(thanks):
-            return "Không có gì! Nếu bạn cần gì thêm, cứ hỏi nhé!"
-
-        if check_keywords(goodbyes):
-            return "Tạm biệt! Hẹn gặp lại bạn!"
-
-        if check_keywords(who_are_you):
-            return "Tôi là Trợ lý AI của Thư viện. Tôi có thể giúp bạn tìm sách, tra cứu giờ mở cửa, nội quy và các thông tin khác về thư viện."
-
-        if check_keywords(how_are_you):
-            return "Tôi vẫn khỏe! Cảm ơn bạn đã hỏi. Bạn cần tìm sách gì hôm nay?"
-
-        if check_keywords(helps):
-            return "Tôi có thể giúp bạn: Tìm sách theo chủ đề, tác giả hoặc thể loại; Tra cứu giờ mở cửa thư viện; Xem nội quy và quy định mượn sách. Bạn muốn làm gì?"
-
-        if check_keywords(oks):
-            return "Vâng! Nếu bạn cần gì thêm, cứ hỏi nhé!"
+        for pattern, reply in _SMALLTALK_REPLIES:
+            if pattern.search(q):
+                return reply
 
         # Fallback to AI for complex/unknown smalltalk
+        # (safety net: every _SMALLTALK_RE keyword currently has a hardcoded reply above)
         try:
-            prompt = SMALLTALK_PROMPT_TEMPLATE.format(
+            prompt = render_smalltalk_prompt(
                 history=session.get_history_text(),
                 question=question
             )
-            return self._call_gemini(prompt, temperature=0.7, max_tokens=150)
+            if session.has_prior_turns():
+                # The prompt carries this session's history: not reusable for other sessions
+                return self._call_gemini(prompt, temperature=0.7, max_tokens=150)
+            return self._call_gemini_cached("SMALLTALK", question, prompt, temperature=0.7, max_tokens=150)
         except Exception:
             return "Xin chào! Tôi là trợ lý thư viện AI. Tôi có thể giúp gì cho bạn?"
 
@@ -357,51 +882,32 @@ class RAGEngine:
         Kiểm tra xem câu hỏi có liên quan đến việc tìm/hỏi về sách không.
         Dùng để quyết định có nên dùng cache sách hay không.
         """
-        q = question.lower()
-        q = re.sub(r'[?.!,;:]', '', q)
-
-        book_keywords = [
-            # Từ khóa sách tiếng Việt
-            "sách", "cuốn", "quyển", "tài liệu", "giáo trình", "truyện",
-            "tiểu thuyết", "tác phẩm", "ebook", "pdf",
-            # Từ khóa sách không dấu
-            "sach", "cuon", "quyen", "tai lieu", "giao trinh", "truyen",
-            "tieu thuyet", "tac pham",
-            # Từ khóa tìm kiếm
-            "tìm", "tìm kiếm", "gợi ý", "đề xuất", "cho tôi", "có không",
-            "tim", "tim kiem", "goi y", "de xuat", "cho toi", "co khong",
-            # Thể loại sách
-            "python", "java", "programming", "lập trình", "lap trinh",
-            "machine learning", "ai", "deep learning", "data science",
-            "toán", "văn", "lịch sử", "địa lý", "vật lý", "hóa học",
-            "toan", "van", "lich su", "dia ly", "vat ly", "hoa hoc",
-            # Tiếng Anh
-            "book", "novel", "textbook", "recommend", "find", "search"
-        ]
-
-        return any(k in q for k in book_keywords)
+        q = _fold_clean(question)
+        return bool(_BOOK_RELATED_RE.search(q))
 
     # ==================================================
     # INTENT CLASSIFICATION (CẢI TIẾN)
     # ==================================================
     def classify_intent(self, query: str, session: ChatSession) -> str:
         q = query.strip().lower()
-        q_normalized = remove_diacritics(q)  # Normalize for keyword matching
 
         # 1. Garbage check
-        if len(q) < 2 or not re.search(r"[a-zA-Z\u00c0-\u1ef90-9]", q):
+        if len(q) < 2 or not _WORD_CHAR_RE.search(q):
             return "GARBAGE"
 
+        # One memoized scan answers the keyword checks below
+        local_intents = _scan_local_intents(query)
+
         # 1b. Library stats check: uu tien cao
-        if self.is_library_stats_query(query):
+        if "STATS" in local_intents:
             return "STATS"
 
         # 2. Smalltalk check
-        if self.is_smalltalk(query):
+        if "SMALLTALK" in local_intents:
             return "SMALLTALK"
 
         # 3. Library info check
-        if self.is_library_info_query(query):
+        if "LIBRARY_INFO" in local_intents:
             return "LIBRARY_INFO"
         
         # 3b. TITLE_SEARCH check (NEW - High Priority)
@@ -410,86 +916,14 @@ class RAGEngine:
             return "TITLE_SEARCH"
 
         # 4. Follow-up check
-        if session.last_search_results:
-            followup_keywords = [
-                # Book reference keywords
-                "cuon nay", "cuon do", "cuon thu", "sach nay", "sach do",
-                "chi tiet", "no noi ve", "tac gia la ai", "gia bao nhieu",
-                "trong so", "cuon nao", "cai nao", "de hoc", "tot nhat",
-                "phu hop", "nen chon", "o tren", "vua roi", "trong danh sach",
-                "hay nhat", "hay hon", "tot hon", "noi ve gi", "ve cai gi",
-                "cua ai", "ai viet", "nam nao", "xuat ban nam", "may trang",
-                "nen doc", "doc truoc", "doc sau", "cuon dau", "cuon cuoi",
-                
-                # FIX: Added missing keywords for collective follow-ups
-                "tom tat",          # tóm tắt
-                "tat ca",           # tất cả
-                "ca hai",           # cả hai
-                "ca 2", "ca 3",     # cả 2, cả 3
-                "moi cuon",         # mọi cuốn
-                "cac cuon",         # các cuốn
-                "nhung cuon",       # những cuốn
-                "cuon nao",         # cuốn nào
-                "so sanh",          # so sánh
-                "khac nhau",        # khác nhau
-            ]
-            if any(k in q_normalized for k in followup_keywords):
-                return "FOLLOWUP"
-            if re.search(r"(cuon|so|quyen)\s*\d+", q_normalized):
-                return "FOLLOWUP"
+        if session.last_search_results and "FOLLOWUP" in local_intents:
+            return "FOLLOWUP"
 
         # 5. Default
         return "SEARCH"
 
     def is_library_stats_query(self, q: str) -> bool:
-        ql = remove_diacritics(q.lower())
-        # Regex for flexible matching:
-        # 1. "bao nhieu" + anything + "sach/cuon/quyen/tac pham"
-        # 2. "tong so" + "sach"
-        # 3. "so luong" + "sach"
-        patterns = [
-            r"bao nhieu.*(?:sach|cuon|quyen|tac pham)",
-            r"(?:tong so|so luong).*(?:sach|cuon|quyen|tac pham)",
-            r"co.*bao nhieu", # "thu vien co bao nhieu"
-            r"co.*tat ca"      # "co tat ca bao nhieu..."
-        ]
-        
-        for p in patterns:
-            if re.search(p, ql):
-                return True
-        return False
-    
-    def is_library_info_query(self, q: str) -> bool:
-        """
-        Detect library information queries (opening hours, rules, policies).
-        """
-        ql = remove_diacritics(q.lower())
-        
-        # Opening hours - check ALL possible combinations
-        has_opening_words = any(word in ql for word in ["mo cua", "dong cua", "mo", "dong"])
-        has_time_words = any(word in ql for word in ["gio", "luc", "may", "thoi gian"])
-        
-        if has_opening_words and has_time_words:
-            return True
-        
-        if "gio" in ql and ("hoat dong" in ql or "lam viec" in ql):
-            return True
-        
-        # Rules and policies
-        if any(kw in ql for kw in ["noi quy", "quy dinh", "quy tac"]):
-            return True
-        
-        # Borrowing/returning
-        if ("muon sach" in ql or "muon" in ql) and ("the nao" in ql or "quy dinh" in ql):
-            return True
-        if ("tra sach" in ql or "tra" in ql) and ("the nao" in ql or "quy dinh" in ql):
-            return True
-        
-        # Penalties
-        if any(kw in ql for kw in ["phi phat", "phat", "penalty"]):
-            return True
-        
-        return False
+        return "STATS" in _scan_local_intents(q)
 
     def _is_title_search_query(self, query: str) -> bool:
         """
@@ -497,40 +931,24 @@ class RAGEngine:
         Examples: "tìm cuốn Sapiens", "có sách Clean Code không", "tìm sách Trò chuyện khoa học"
         NOTE: "tìm sách về toán" is NOT a title search (it's category search)
         """
-        q_norm = remove_diacritics(query.lower())
-        
-        # Patterns indicating explicit title search
-        # FIXED: "sach" alone is too broad; require more specific patterns
-        title_indicators = [
-            r"(?:tim|co|muon|kiem)\s+cuon\s+([a-z0-9\s]{3,})",  # "tìm cuốn [Title]" - cuốn is more specific
-            r"(?:cuon|quyen)\s+(?:ten|tua|co ten)\s+(?:la\s+)?([a-z0-9\s]{3,})",  # "cuốn tên là [Title]"
-        ]
-        
-        for pattern in title_indicators:
-            match = re.search(pattern, q_norm)
+        q_norm = _fold(query)
+
+        for pattern in _TITLE_INDICATOR_RES:
+            match = pattern.search(q_norm)
             if match:
                 potential_title = match.group(1).strip()
-                
-                # FIXED: Expanded category keywords list and use substring check
-                category_keywords = [
-                    "toan", "ly", "hoa", "van", "su", "dia", "sinh",
-                    "kinh te", "tai chinh", "marketing", "lap trinh",
-                    "python", "java", "ai", "machine learning",
-                    "van hoc", "lich su", "khoa hoc", "tam ly", "triet hoc",
-                    "kinh doanh", "quan tri", "ky nang", "ngoai ngu"
-                ]
-                
+
                 # FIXED: Check if potential_title starts with "ve " (common false positive)
                 if potential_title.startswith("ve "):
                     return False
-                
+
                 # FIXED: Use substring match instead of exact equality
-                is_category = any(kw in potential_title or potential_title in kw for kw in category_keywords)
-                
+                is_category = any(kw in potential_title or potential_title in kw for kw in _TITLE_CATEGORY_KEYWORDS)
+
                 # If captured text is NOT a category keyword, it's likely a title
                 if len(potential_title) >= 3 and not is_category:
                     return True
-        
+
         return False
 
     def _normalize_query(self, query: str) -> str:
@@ -562,7 +980,7 @@ class RAGEngine:
     def _normalize_book_query(self, question: str) -> str:
         """Chuan hoa mot so cau goi y de search trung chu de hon."""
         q = question.strip()
-        ql = remove_diacritics(q.lower())
+        ql = _fold(q)
 
         # Neu user hoi kieu: "Sach Machine Learning hay nhat"
         if "machine learning" in ql and "sach" in ql:
@@ -586,42 +1004,17 @@ class RAGEngine:
 
         # 1. Check for "all" / "summarize all" OR "Comparison"
         # Force LLM for these complex cases
-        collective_keywords = [
-            "tất cả", "cả hai", "cả 2", "cả 3", "mọi cuốn", "những cuốn này", "các cuốn",
-            "so sánh", "khác nhau", "giống nhau", "vs"
-        ]
-        
-        if any(k in q for k in collective_keywords):
-            books_text = "\n".join([
-                f"{i}. {d['title']} – {d['authors']}"
-                for i, d in enumerate(session.last_search_results, 1)
-            ])
-            # THÊM: Dùng FOLLOWUP_PROMPT_TEMPLATE thay vì prompt cứng
-            prompt = FOLLOWUP_PROMPT_TEMPLATE.format(
-                history=session.get_history_text(),
-                previous_books=books_text,
-                question=question
-            )
-            return self._call_gemini(prompt)
+        if _COLLECTIVE_RE.search(q):
+            return self._followup_with_llm(question, session)
 
         # 2. Extract specific index
         idx = -1
-        text_nums = {
-            "một": 1, "hai": 2, "ba": 3, "bốn": 4, "năm": 5,
-            "nhất": 1, "nhì": 2, "đầu tiên": 1,
-            "cuối cùng": len(session.last_search_results)
-        }
-
-        text_pattern = r"(thứ|số|cuốn|quyển)\s*(" + "|".join(text_nums.keys()) + r")"
-        match_text = re.search(text_pattern, q)
-        digit_pattern = r"(?:thứ|số|cuốn|quyển|^)\s*(\d+)"
-        match_digit = re.search(digit_pattern, q)
-
-        if match_text:
-            key = match_text.group(2)
-            idx = text_nums.get(key, 0) - 1
-        elif match_digit:
-            idx = int(match_digit.group(1)) - 1
+        m = _FOLLOWUP_IDX_RE.search(q)
+        if m and m["word"]:
+            position = _ORDINAL_WORDS[m["word"]]
+            idx = (len(session.last_search_results) if position < 0 else position) - 1
+        elif m:
+            idx = int(m["digit"]) - 1
 
         # 3. Return info if index valid
         if 0 <= idx < len(session.last_search_results):
@@ -636,33 +1029,22 @@ class RAGEngine:
 
         # 4. THÊM: Dùng LLM để trả lời follow-up phức tạp (từ HEAD)
         if session.last_search_results:
-            books_text = "\n".join([
-                f"{i}. {d['title']} – {d['authors']} ({d['publish_year']})"
-                for i, d in enumerate(session.last_search_results, 1)
-            ])
-            prompt = FOLLOWUP_PROMPT_TEMPLATE.format(
-                history=session.get_history_text(),
-                previous_books=books_text,
-                question=question
-            )
-            return self._call_gemini(prompt)
+            return self._followup_with_llm(question, session)
 
         return "Bạn muốn hỏi về cuốn sách số mấy? (Ví dụ: 'cuốn số 1', 'quyển đầu tiên')"
 
+    def _followup_with_llm(self, question: str, session: ChatSession) -> str:
+        """Follow-up answered by Gemini over the previous book list + history."""
+        # THÊM: Dùng FOLLOWUP_PROMPT_TEMPLATE thay vì prompt cứng
+        prompt = render_followup_prompt(
+            history=session.get_history_text(),
+            previous_books=format_books_block(session.last_search_results),
+            question=question
+        )
+        return self._call_gemini(prompt)
+
     def needs_synthesis(self, question: str) -> bool:
-        q = question.lower()
-        return any(k in q for k in [
-            "nên", "phù hợp", "gợi ý", "so sánh", "đánh giá",
-            "phân tích", "tổng hợp", "giải thích", "vì sao", "như thế nào"
-        ])
-
-    def _build_library_context(self) -> dict:
-        return {
-            "opening_hours": LIBRARY_INFO["opening_hours"],
-            "library_rules": "\n".join(f"- {r}" for r in LIBRARY_INFO["library_rules"]),
-            "borrow_policy": "\n".join(f"- {k}: {v}" for k, v in LIBRARY_INFO["borrow_policy"].items()),
-            "penalty_policy": "\n".join(f"- {k}: {v}" for k, v in LIBRARY_INFO["penalty_policy"].items()),
-        }
+        return bool(_SYNTHESIS_RE.search(question.lower()))
 
     def _extract_filters_from_text(self, query: str) -> dict:
         """
@@ -671,143 +1053,21 @@ class RAGEngine:
         Hỗ trợ nhận diện qua Regex và Keyword Matching.
         """
         extracted = {}
-        q_norm = remove_diacritics(query.lower())
+        q_norm = _fold(query)
         
         # 1. Get metadata source
         available_filters = self.search_engine.get_filters()
-        db_categories = available_filters.get("categories", [])
         db_authors = available_filters.get("authors", [])
-        
-        # Merge with hardcoded topics from Settings for better coverage
-        from config.settings import settings
-        all_categories = list(set(db_categories + settings.CRAWL_TOPICS))
-        
-        # 2. DEFINED MAPPINGS (Synonyms)
-        # Map short/common terms to EXACT category names in DB
-        # Dựa trên 15 thể loại thực tế trong DB (xem all_categories_analysis_20260127_161608.png):
-        # Máy tính (91), CNTT (70), Kỹ năng (66), Kỹ thuật (59), Tài chính (54),
-        # Khởi nghiệp (50), Kinh doanh (31), Kinh tế (30), Trí tuệ và Dữ liệu (21),
-        # Văn học (12), Xã hội (9), Giáo dục (4), Khác (2), Lịch sử (2), Toán (1)
-        category_map = {
-            # === MÁY TÍNH (91 sách) ===
-            "python": "Máy tính",
-            "java": "Máy tính",
-            "javascript": "Máy tính",
-            "lap trinh": "Máy tính",
-            "may tinh": "Máy tính",
-            "software": "Máy tính",
-            "phan mem": "Máy tính",
-            
-            # === CÔNG NGHỆ THÔNG TIN (70 sách) ===
-            "cntt": "Công nghệ thông tin",
-            "it": "Công nghệ thông tin",
-            "cong nghe thong tin": "Công nghệ thông tin",
-            "mang": "Công nghệ thông tin",
-            "bao mat": "Công nghệ thông tin",
-            
-            # === KỸ NĂNG (66 sách) ===
-            "ky nang": "Kỹ năng",
-            "ky nang song": "Kỹ năng",
-            "ky nang mem": "Kỹ năng",
-            "phat trien ban than": "Kỹ năng",
-            "giao tiep": "Kỹ năng",
-            "lanh dao": "Kỹ năng",
-            
-            # === KỸ THUẬT (59 sách) ===
-            "ky thuat": "Kỹ thuật",
-            "co khi": "Kỹ thuật",
-            "dien tu": "Kỹ thuật",
-            "xay dung": "Kỹ thuật",
-            
-            # === TÀI CHÍNH (54 sách) ===
-            "tai chinh": "Tài chính",
-            "ke toan": "Tài chính",
-            "ngan hang": "Tài chính",
-            "dau tu": "Tài chính",
-            "chung khoan": "Tài chính",
-            
-            # === KHỞI NGHIỆP (50 sách) ===
-            "khoi nghiep": "Khởi nghiệp",
-            "startup": "Khởi nghiệp",
-            "doanh nhan": "Khởi nghiệp",
-            
-            # === KINH DOANH (31 sách) ===
-            "kinh doanh": "Kinh doanh",
-            "quan tri": "Kinh doanh",
-            "quan ly": "Kinh doanh",
-            "business": "Kinh doanh",
-            
-            # === KINH TẾ (30 sách) ===
-            "kinh te": "Kinh tế",
-            "kinh te hoc": "Kinh tế",
-            "economics": "Kinh tế",
-            
-            # === TRÍ TUỆ VÀ DỮ LIỆU (21 sách) ===
-            "ai": "Trí tuệ và Dữ liệu",
-            "tri tue nhan tao": "Trí tuệ và Dữ liệu",
-            "machine learning": "Trí tuệ và Dữ liệu",
-            "hoc may": "Trí tuệ và Dữ liệu",
-            "data science": "Trí tuệ và Dữ liệu",
-            "khoa hoc du lieu": "Trí tuệ và Dữ liệu",
-            "big data": "Trí tuệ và Dữ liệu",
-            
-            # === VĂN HỌC (12 sách) ===
-            "van": "Văn học",
-            "van hoc": "Văn học",
-            
-            # === XÃ HỘI (9 sách) ===
-            "xa hoi": "Xã hội",
-            "tam ly": "Xã hội",  # Tâm lý → map vào Xã hội (không có category riêng)
-            "tam ly hoc": "Xã hội",
-            
-            # === GIÁO DỤC (4 sách) ===
-            "giao duc": "Giáo dục",
-            "su pham": "Giáo dục",
-            "hoc tap": "Giáo dục",
-            
-            # === LỊCH SỬ (2 sách) ===
-            "lich su": "Lịch sử",
-            "su": "Lịch sử",
-            
-            # === TOÁN (1 sách) ===
-            "toan": "Toán",
-            "toan hoc": "Toán",
-            
-            # === MARKETING (thuộc Kinh doanh?) ===
-            "marketing": "Kinh doanh",
-        }
 
-        # 3. REGEX EXTRACTION (Explicit Intent)
+        # 2. DEFINED MAPPINGS (Synonyms): _CATEGORY_MAP
+
+        # 3. REGEX EXTRACTION (Explicit Intent), patterns in _FILTER_*_RES
         # Note: Input `q_norm` has NO diacritics. Patterns must accept non-diacritic keywords.
-        
-        # Capture "chủ đề X", "sách về X" -> "chu de X", "sach ve X"
-        cat_patterns = [
-            r"(?:ve|chu de|mon|linh vuc|loai|the loai|danh muc)\s+([\w\s]+)",
-            r"sach\s+([\w\s]+)" 
-        ]
-        
-        # Capture "tác giả Y", "của Y" -> "tac gia Y", "cua Y"
-        auth_patterns = [
-            r"(?:tac gia|boi|viet boi|cua|soan boi)\s+([\w\s]+)"
-        ]
-
-        # Capture "năm YYYY", "xuất bản YYYY" -> "nam", "xuat ban"
-        year_patterns = [
-            r"(?:nam|xuat ban|xb)\s+(\d{4})",
-            r"(\d{4})" # Standalone year check
-        ]
-
-        # Capture Title explicitly: "cuốn X", "quyển X" -> "cuon X", "quyen X"
-        # Note: "sach" is ambiguous (sach python -> category), so we avoid it for title unless "sách tên là"
-        title_patterns = [
-            r"(?:cuon|quyen|tac pham|tieu de|tua de)\s+(?:sach\s+)?(.+)",
-            r"sach\s+(?:ten|tua|co ten|co tua)\s+(?:la\s+)?(.+)"
-        ]
 
         # 3a. Try extracting Year
         db_years = available_filters.get("years", [])
-        for pattern in year_patterns:
-            match = re.search(pattern, q_norm)
+        for pattern in _FILTER_YEAR_RES:
+            match = pattern.search(q_norm)
             if match:
                 y = match.group(1)
                 # Validation: Must be in DB years or reasonable range (1900-2030)
@@ -816,22 +1076,14 @@ class RAGEngine:
                     break
 
         # 3b. Try extracting Title (Prioritize explicit title indicators)
-        for pattern in title_patterns:
-            match = re.search(pattern, q_norm)
+        for pattern in _FILTER_TITLE_RES:
+            match = pattern.search(q_norm)
             if match:
                 raw_title = match.group(1).strip()
                 
                 # --- FIX: Prevent false positive title extraction ---
-                # Blacklist common category keywords that should NOT be titles
-                category_keywords = [
-                    "toan", "ly", "hoa", "van", "su", "dia", "sinh", 
-                    "kinh te", "tai chinh", "marketing", "lap trinh", "cntt",
-                    "python", "java", "ai", "machine learning", "data science",
-                    "ky nang", "tam ly", "triet hoc", "van hoc", "khoa hoc"
-                ]
-                
-                # Check if raw_title is a category-like keyword
-                is_category_keyword = any(kw in raw_title for kw in category_keywords)
+                # Check if raw_title is a category-like keyword (_FILTER_TITLE_BLACKLIST_RE)
+                is_category_keyword = bool(_FILTER_TITLE_BLACKLIST_RE.search(raw_title))
                 
                 # Also check if it matches "ve [topic]" pattern (common false positive)
                 is_ve_pattern = raw_title.startswith("ve ") or " ve " in raw_title
@@ -846,8 +1098,8 @@ class RAGEngine:
 
 
         # 3c. Try extracting Author via Regex
-        for pattern in auth_patterns:
-            match = re.search(pattern, q_norm)
+        for pattern in _FILTER_AUTHOR_RES:
+            match = pattern.search(q_norm)
             if match:
                 potential_auth = match.group(1).strip()
                 # Check validity against DB authors (partial match)
@@ -859,55 +1111,41 @@ class RAGEngine:
             if "authors" in extracted: break
 
         # 3c. Try extracting Category via Map ONLY (STRICT MODE)
-        # Only use explicit category_map - NO fuzzy matching to avoid false positives
-        for key, full_cat in category_map.items():
-            # Fix: Use word boundary to avoid partial match (e.g. "hoa" in "khoa hoc")
-            if re.search(r'\b' + re.escape(key) + r'\b', q_norm):
+        # Only use explicit _CATEGORY_MAP - NO fuzzy matching to avoid false positives
+        # Fix: Use word boundary to avoid partial match (e.g. "hoa" in "khoa hoc")
+        for key_re, full_cat in _CATEGORY_KEY_RES:
+            if key_re.search(q_norm):
                 extracted["category"] = full_cat
                 break
         
         
         # --- STRICT MODE: Detect unknown category requests (Option B) ---
-        # If user says "sách về X" but X is NOT in category_map → flag as unknown
+        # If user says "sách về X" but X is NOT in _CATEGORY_MAP → flag as unknown
         if "category" not in extracted:
             # Check if query matches "sách về X" or "về X" pattern
             # Use ORIGINAL query (with diacritics) for display purposes
             q_lower = query.lower()  # Keep diacritics for display
             
-            unknown_cat_patterns_orig = [
-                r"sách\s+về\s+(\w+)",        # sách về X (với dấu)
-                r"về\s+(\w+)",                # về X  
-                r"thể loại\s+(\w+)",          # thể loại X
-                r"chủ đề\s+(\w+)",            # chủ đề X
-            ]
-            # Also check normalized patterns
-            unknown_cat_patterns_norm = [
-                r"sach\s+ve\s+(\w+)",
-                r"ve\s+(\w+)",
-                r"the loai\s+(\w+)",
-                r"chu de\s+(\w+)",
-            ]
-            
             original_topic = None
             normalized_topic = None
             
             # First try to get original topic (với dấu)
-            for pattern in unknown_cat_patterns_orig:
-                match = re.search(pattern, q_lower)
+            for pattern in _UNKNOWN_CAT_ORIG_RES:
+                match = pattern.search(q_lower)
                 if match:
                     original_topic = match.group(1).strip()
                     break
             
             # Then check normalized for validation
-            for pattern in unknown_cat_patterns_norm:
-                match = re.search(pattern, q_norm)
+            for pattern in _UNKNOWN_CAT_NORM_RES:
+                match = pattern.search(q_norm)
                 if match:
                     normalized_topic = match.group(1).strip()
                     break
             
             if normalized_topic:
-                # Check if this topic exists in category_map keys
-                is_known = any(normalized_topic == key or key in normalized_topic for key in category_map.keys())
+                # Check if this topic exists in _CATEGORY_MAP keys
+                is_known = any(normalized_topic == key or key in normalized_topic for key in _CATEGORY_MAP)
                 if not is_known and len(normalized_topic) >= 2:
                     # Use original topic (với dấu) for display, fallback to normalized
                     display_topic = original_topic if original_topic else normalized_topic
@@ -924,7 +1162,7 @@ class RAGEngine:
         AI Semantic Steering: Bổ sung từ khóa tiếng Anh vào query
         để Vector Search hiểu rõ hơn ngữ cảnh (đặc biệt là Audience & Language).
         """
-        q_norm = remove_diacritics(query.lower())
+        q_norm = _fold(query)
         enriched_query = query
         
         # 1. AUDIENCE STEERING (Beginner vs Advanced)
@@ -942,11 +1180,64 @@ class RAGEngine:
             
         return enriched_query
 
-    def generate_answer(self, question: str, session_id: str = "default", filters: dict = None) -> Dict:
+    def generate_answer(self, question: str, session_id: str = "default", filters: dict = None,
+                        on_token: Optional[Callable[[str], None]] = None) -> Dict:
         """
         Generate answer for a chat question.
         Handles Search vs Info vs Smalltalk vs Stats.
+
+        on_token: Optional callback receiving answer text as Gemini streams it (CLI).
+            Anything it received is a prefix of the returned answer; answers that need
+            no LLM call are not streamed and are only returned.
+        """
+        self._stream.on_token = on_token
+        # No LLM call yet counts as success; _call_gemini() overwrites it per call
+        self._stream.last_call_ok = True
+        self._stream.context_free = True
+        try:
+            result = self._generate_answer(question, session_id, filters)
+        finally:
+            self._stream.on_token = None
+        # Whether the answer may be shared with other sessions (SemanticCache.put):
+        # not an LLM error text, and not built from this session's history
+        result["cacheable"] = self._stream.last_call_ok and self._stream.context_free
+        return result
+
+    def stream_answer(self, question: str, session_id: str = "default",
+                      filters: dict = None) -> Iterator[Dict]:
+        """
+        generate_answer() as an event stream (API /ai/chat/stream):
+        {"type": "token", "text": ...} as the answer is produced, then {"type": "done", **result}.
+        Search answers stream their book list first, then the synthesis; answers that need
+        no LLM call arrive as a single token.
         """
+        events: "queue.Queue" = queue.Queue()
+
+        def run():
+            try:
+                events.put(self.generate_answer(question, session_id, filters, on_token=events.put))
+            except Exception as e:
+                events.put(e)
+
+        threading.Thread(target=run, name="stream-answer", daemon=True).start()
+        streamed = []
+        while True:
+            item = events.get()
+            if isinstance(item, str):
+                streamed.append(item)
+                yield {"type": "token", "text": item}
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                break
+
+        shown = "".join(streamed)
+        rest = item["answer"][len(shown):] if item["answer"].startswith(shown) else ""
+        if rest:
+            yield {"type": "token", "text": rest}
+        yield {"type": "done", **item}
+
+    def _generate_answer(self, question: str, session_id: str, filters: dict) -> Dict:
         try:
             session = self.get_session(session_id)
             session.add_message("user", question)
@@ -1040,70 +1331,26 @@ class RAGEngine:
     # SUB-HANDLERS
     # ==================================================
     def is_library_info_query(self, q: str) -> bool:
-        ql = remove_diacritics(q.lower())
-        # Keywords for library info must be specific to RULES/POLICIES, not just actions
-        # "muon sach" alone is ambiguous (could be search), so query must imply "how to" or "rules"
-        keywords = [
-            "gio mo cua", "thoi gian mo cua", "lich mo cua",
-            "quy dinh", "noi quy", "luat thu vien",
-            "phi phat", "tien phat",
-            "cach muon", "thu tuc muon", "dieu kien muon", "luat muon", "huong dan muon",
-            "cach tra", "thu tuc tra", "luat tra", "huong dan tra",
-            "muon bao lau", "muon duoc may", "gia han"
-        ]
-        # Special check: "muon sach" only if NOT accompanied by specific book topics implies info request? 
-        # Actually safer to just rely on "cach/quy dinh/..." for INFO. 
-        # If user says "toi muon muon sach", let it fall to SEARCH or generic AI which clarifies.
-        
-        return any(k in ql for k in keywords)
+        return "LIBRARY_INFO" in _scan_local_intents(q)
 
     def _generate_library_info_answer(self, question: str, session: ChatSession) -> str:
         """
         Tra loi cau hoi ve thu vien. Uu tien tra loi san cho cau hoi pho bien.
         """
-        ql = remove_diacritics(question.lower())
+        ql = _fold(question)
 
         # Hardcoded responses - KHONG CAN GOI AI
-        if any(k in ql for k in ["gio mo cua", "mo cua", "may gio"]):
-            return f"Thư viện mở cửa: {LIBRARY_INFO['opening_hours']}. Ngoài giờ này thư viện đóng cửa."
-
-        # Check SPECIFIC policies first (Borrow/Return) before GENERAL rules
-        if any(k in ql for k in ["muon sach", "muon", "borrow", "gia han"]):
-            bp = LIBRARY_INFO['borrow_policy']
-            return f"Quy định mượn sách:\n- {bp['fee']}\n- {bp['duration']}\n- {bp['renew']}"
-
-        if any(k in ql for k in ["tra sach", "tra", "return"]):
-            pp = LIBRARY_INFO['penalty_policy']
-            return f"Quy định trả sách:\n- {pp['late_return']}\n- {pp['account_lock']}\n- {pp['lost_book']}"
-
-        if any(k in ql for k in ["phi phat", "phat", "penalty"]):
-            pp = LIBRARY_INFO['penalty_policy']
-            return f"Quy định phí phạt:\n- {pp['late_return']}\n- {pp['account_lock']}\n- {pp['lost_book']}"
-
-        # Only if no specific policy is matched, return general rules
-        if any(k in ql for k in ["noi quy", "quy dinh", "luat"]):
-            rules = "\n".join([f"- {r}" for r in LIBRARY_INFO['library_rules']])
-            return f"Nội quy thư viện:\n{rules}"
-
-        if any(k in ql for k in ["muon sach", "muon", "borrow"]):
-            bp = LIBRARY_INFO['borrow_policy']
-            return f"Quy định mượn sách:\n- {bp['fee']}\n- {bp['duration']}\n- {bp['renew']}"
-
-        if any(k in ql for k in ["tra sach", "tra", "return"]):
-            pp = LIBRARY_INFO['penalty_policy']
-            return f"Quy định trả sách:\n- {pp['late_return']}\n- {pp['account_lock']}\n- {pp['lost_book']}"
-
-        if any(k in ql for k in ["phi phat", "phat", "penalty"]):
-            pp = LIBRARY_INFO['penalty_policy']
-            return f"Quy định phí phạt:\n- {pp['late_return']}\n- {pp['account_lock']}\n- {pp['lost_book']}"
+        for pattern, answer in _LIBRARY_INFO_ANSWERS:
+            if pattern.search(ql):
+                return answer
 
         # Fallback to AI for complex library questions
+        # (safety net: every _LIBRARY_INFO_RE keyword currently has a hardcoded answer above)
         try:
-            ctx = self._build_library_context()
-            prompt = f"""{SYSTEM_PROMPT}\n{USER_PROMPT_TEMPLATE.format(question=question, books="(Khong ap dung)", **ctx)}"""
-            return self._call_gemini(prompt)
+            prompt = render_user_prompt(question=question, books="(Khong ap dung)")
+            return self._call_gemini(prompt, system_instruction=SYSTEM_PROMPT)
         except Exception:
-            return f"Thư viện mở cửa: {LIBRARY_INFO['opening_hours']}. Nếu cần thông tin cụ thể, vui lòng hỏi lại."
+            return LIBRARY_INFO_FALLBACK_ANSWER
 
     def _perform_book_search(self, question: str, session: ChatSession, filters: dict = None) -> tuple:
         """
@@ -1115,12 +1362,12 @@ class RAGEngine:
         search_query = self._enrich_query_context(question)
         # -------------------------------------------
         
-        q_vec = self.embedder.embed_text(search_query, is_query=True)
+        q_vec = self._embed_query(search_query)
         
         # --- FEATURE ADDED: Smart Cache Key Generation ---
         # Generate cache key from normalized query + filter hash
         # This allows "sách python" and "tìm cuốn sách về Python" to hit same cache
-        cache_key_base = remove_diacritics(search_query.lower()).strip()
+        cache_key_base = _fold(search_query).strip()
         if filters:
             # Include filters in cache key for unique filter combinations
             filter_str = "_".join(f"{k}:{v}" for k, v in sorted(filters.items()))
@@ -1129,9 +1376,17 @@ class RAGEngine:
             cache_key = cache_key_base
         # --------------------------------------------------
 
+        # Search với filters nếu được cung cấp
+        # q_vec is reused: the query was already embedded for the query-memory lookup
+        search_kwargs = dict(query=search_query, filters=filters, top_k=self.top_k * SEARCH_EXPAND_FACTOR,
+                             query_vector=q_vec)
+
         # THÊM: Smart cache skip (từ HEAD)
         # Skip cache nếu có filters (để đảm bảo kết quả chính xác)
-        if q_vec and not filters:
+        if q_vec and not filters and _QUERY_MEMORY_ENABLED:
+            # Both lookups only need q_vec: search speculatively while query memory is checked,
+            # so a miss costs max(lookup, search) instead of the sum
+            pending_search = self._io_pool.submit(self.search_engine.search, **search_kwargs)
             cached = self.vector_db.search_query_memory(q_vec, threshold=QUERY_CACHE_THRESHOLD)
             if cached:
                 # Skip cache nếu cache là sách nhưng query không liên quan sách
@@ -1142,9 +1397,9 @@ class RAGEngine:
                     logger.info("Query memory HIT")
                     # Cached response: return answer but no sources
                     return f"(Cache) {cached}", []
-
-        # Search với filters nếu được cung cấp
-        raw_docs = self.search_engine.search(query=search_query, filters=filters, top_k=self.top_k * SEARCH_EXPAND_FACTOR)
+            raw_docs = pending_search.result()
+        else:
+            raw_docs = self.search_engine.search(**search_kwargs)
         
         # --- FIX: STRICT CATEGORY FILTER ---
         # If user specified a category filter but no results found:
@@ -1159,13 +1414,14 @@ class RAGEngine:
             else:
                 # Only relax search for non-category filters (title, author, year)
                 logger.info("Search with filters yielded 0 results. Retrying with RELAXED search (no filters)...")
-                raw_docs = self.search_engine.search(query=search_query, filters=None, top_k=self.top_k * SEARCH_EXPAND_FACTOR)
+                raw_docs = self.search_engine.search(query=search_query, filters=None, top_k=self.top_k * SEARCH_EXPAND_FACTOR,
+                                                     query_vector=q_vec)
             
         if not raw_docs:
-            return self._gemini_fallback(question, session), []
+            return self._no_results_fallback(question, session, q_vec), []
 
         # --- FEATURE ADDED: SORTING LOGIC (Newest/Oldest) ---
-        q_norm = remove_diacritics(question.lower())
+        q_norm = _fold(question)
         if any(k in q_norm for k in ["moi nhat", "gan day", "nam nay", "latest", "newest"]):
             # Sort by publish_year desc (handling valid years)
             raw_docs.sort(key=lambda x: str(x.get('publish_year', '0')).isdigit() and int(x.get('publish_year', '0')) or 0, reverse=True)
@@ -1174,7 +1430,7 @@ class RAGEngine:
 
         best_score = max(d.get("score", 0) for d in raw_docs)
         if best_score < SCORE_THRESHOLD:
-            return self._gemini_fallback(question, session), []
+            return self._no_results_fallback(question, session, q_vec), []
 
         docs = raw_docs[:self.top_k]
 
@@ -1182,49 +1438,200 @@ class RAGEngine:
         session.last_search_results = docs
         session.save()
 
-        book_lines = [
-            f"{i}. {d['title']} – {d['authors']} ({d['publish_year']})"
-            for i, d in enumerate(docs, 1)
-        ]
-        books_text = "\n".join(book_lines)
+        books_text = format_books_block(docs)
 
         if not self.needs_synthesis(question):
             answer = f"Danh sách sách liên quan:\n\n{books_text}"
             if q_vec:
-                self.vector_db.add_query_memory(question, q_vec, answer, qtype="rag_list")
+                self._remember_query(question, q_vec, answer, qtype="rag_list")
             return answer, docs
 
-        ctx = self._build_library_context()
-        prompt = f"""{SYSTEM_PROMPT}\n{USER_PROMPT_TEMPLATE.format(question=question, books=books_text, **ctx)}"""
+        prompt = render_user_prompt(question=question, books=books_text)
 
-        synthesis = self._call_gemini(prompt)
-        answer = f"Danh sách sách liên quan:\n\n{books_text}\n\nTổng hợp:\n{synthesis}"
+        header = f"Danh sách sách liên quan:\n\n{books_text}\n\nTổng hợp:\n"
+        self._emit(header)  # Streamed answers must start with the book list too
+        synthesis = self._call_gemini(prompt, system_instruction=SYSTEM_PROMPT)
+        answer = header + synthesis
 
         if q_vec:
-            self.vector_db.add_query_memory(question, q_vec, answer, qtype="rag_synthesis")
+            self._remember_query(question, q_vec, answer, qtype="rag_synthesis")
         return answer, docs
 
+    def _no_results_fallback(self, question: str, session: ChatSession, q_vec) -> str:
+        """
+        _gemini_fallback() for searches with no usable books, reusing the answer of a
+        near-identical earlier no-result query ("sách nấu ăn kiểu Ý" / "sách ẩm thực Ý").
+        Only fallbacks without earlier turns are shared: the others depend on the session.
+        """
+        reusable = bool(q_vec) and not session.has_prior_turns()
+        if reusable:
+            cached = self.vector_db.search_query_memory(q_vec, threshold=FALLBACK_CACHE_THRESHOLD,
+                                                        qtype_filter="fallback_no_results")
+            if cached:
+                logger.info("Fallback memory HIT")
+                return cached
+
+        answer = self._gemini_fallback(question, session)
+        if reusable and getattr(self._stream, "last_call_ok", False):
+            self._remember_query(question, q_vec, answer, qtype="fallback_no_results")
+        return answer
+
     def _gemini_fallback(self, question: str, session: ChatSession) -> str:
         """THÊM: Dùng GENERAL_QA_PROMPT_TEMPLATE để trả lời thông minh hơn (từ HEAD)"""
-        prompt = GENERAL_QA_PROMPT_TEMPLATE.format(
+        prompt = render_general_qa_prompt(
             history=session.get_history_text(),
             question=question
         )
-        return self._call_gemini(prompt)
+        if session.has_prior_turns():
+            # Could be a follow-up: the answer depends on this session's history
+            self._stream.context_free = False
+            return self._call_gemini(prompt)
+        return self._call_gemini_cached("GENERAL_QA", question, prompt)
+
+    def _emit(self, text: str):
+        """Forward text to the streaming callback of the current generate_answer() call, if any."""
+        on_token = getattr(self._stream, "on_token", None)
+        if on_token:
+            on_token(text)
+
+    def _remember_query(self, question: str, q_vec, answer: str, qtype: str):
+        """add_query_memory() once per question; repeats of a recent question skip the Chroma upsert."""
+        with self._query_memory_lock:
+            if question in self._query_memory_seen:
+                self._query_memory_seen.move_to_end(question)
+                return
+            self._query_memory_seen[question] = None
+            while len(self._query_memory_seen) > QUERY_MEMORY_SEEN_MAX_ENTRIES:
+                self._query_memory_seen.popitem(last=False)
+        # The upsert is not part of the answer: run it off the request thread
+        self._io_pool.submit(self.vector_db.add_query_memory, question, q_vec, answer, qtype=qtype)
+
+    def _embed_query(self, query: str):
+        """embed_text(is_query=True) behind an LRU, so repeated / FAQ queries skip the model."""
+        key = " ".join(query.lower().translate(_PUNCT_TABLE).split())
+        with self._embed_cache_lock:
+            cached = self._embed_cache.get(key)
+            if cached is not None:
+                self._embed_cache.move_to_end(key)
+                self._embed_cache_hits += 1
+                return cached.tolist()
+            self._embed_cache_misses += 1
+
+        vec = self.embedder.embed_text(query, is_query=True)
+        if vec is not None:
+            packed = np.asarray(vec, dtype=np.float32)
+            evicted = []
+            with self._embed_cache_lock:
+                self._embed_cache[key] = packed
+                while len(self._embed_cache) > EMBED_CACHE_MAX_ENTRIES:
+                    evicted.append(self._embed_cache.popitem(last=False)[0])
+            self._embed_db_pool.submit(self._persist_query_vector, key, packed, evicted)
+        return vec
+
+    def _persist_query_vector(self, key: str, packed: np.ndarray, evicted: List[str]):
+        """Mirror one _embed_query() miss into SQLite (runs on _embed_db_pool)."""
+        try:
+            self._embed_db.executemany("DELETE FROM query_vectors WHERE key = ?", [(k,) for k in evicted])
+            self._embed_db.execute(
+                "INSERT OR REPLACE INTO query_vectors (key, created_at, vector) VALUES (?, ?, ?)",
+                (key, time.time(), packed.tobytes())
+            )
+            self._embed_db.commit()
+        except Exception as e:
+            logger.error(f"Failed to persist query embedding: {e}")
+
+    def embed_cache_info(self) -> Dict:
+        """Hit/miss counters of the query-embedding cache (like functools' cache_info())."""
+        with self._embed_cache_lock:
+            return {
+                "hits": self._embed_cache_hits,
+                "misses": self._embed_cache_misses,
+                "size": len(self._embed_cache),
+                "maxsize": EMBED_CACHE_MAX_ENTRIES,
+            }
 
-    def _call_gemini(self, prompt: str, temperature: float = None, max_tokens: int = None) -> str:
+    def _open_embed_cache(self, db_path: str) -> sqlite3.Connection:
+        """Open the query-embedding store and load its most recent entries into the LRU."""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Opened here, then only used by the _embed_db_pool worker thread
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_vectors ("
+            "key TEXT PRIMARY KEY, created_at REAL, vector BLOB)"
+        )
+        rows = conn.execute(
+            "SELECT key, vector FROM query_vectors ORDER BY created_at DESC LIMIT ?",
+            (EMBED_CACHE_MAX_ENTRIES,)
+        ).fetchall()
+        for key, vector in reversed(rows):
+            # Embedder outputs are float32, so the round trip is exact
+            self._embed_cache[key] = np.frombuffer(vector, dtype=np.float32)
+        logger.info(f"Loaded {len(rows)} cached query embeddings from {db_path}")
+        return conn
+
+    def _call_gemini_cached(self, intent: str, question: str, prompt: str, **kwargs) -> str:
+        """
+        _call_gemini() behind an LRU keyed on (intent, normalized question), for replies
+        that do not depend on retrieved books ("bạn thích đọc gì?", "2+2 bằng mấy?").
+        Failed or partial replies are not cached.
+        """
+        key = (intent, " ".join(question.lower().translate(_PUNCT_TABLE).split()))
+        with self._response_cache_lock:
+            answer = self._response_cache.get(key)
+            if answer is not None:
+                self._response_cache.move_to_end(key)
+                logger.info(f"Response cache HIT ({intent})")
+                return answer
+
+        answer = self._call_gemini(prompt, **kwargs)
+        if getattr(self._stream, "last_call_ok", False):
+            with self._response_cache_lock:
+                self._response_cache[key] = answer
+                while len(self._response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+                    self._response_cache.popitem(last=False)
+        return answer
+
+    def _call_gemini(self, prompt: str, temperature: float = None, max_tokens: int = None,
+                     system_instruction: str = None) -> str:
         """Call Gemini via ModelManager (handles rotation & rate limits)"""
+        self._stream.last_call_ok = False
+        if getattr(self._stream, "on_token", None):
+            return self._call_gemini_stream(prompt, temperature, max_tokens, system_instruction)
         try:
             result = self.model_manager.generate_content(
                 prompt=prompt,
                 temperature=temperature or TEMPERATURE,
-                max_tokens=max_tokens or MAX_OUTPUT_TOKENS
+                max_tokens=max_tokens or MAX_OUTPUT_TOKENS,
+                system_instruction=system_instruction
             )
+            self._stream.last_call_ok = bool(result)
             return result if result else "Xin lỗi, không có phản hồi."
         except Exception as e:
             logger.error(f"Gemini API error: {e}")
             return "Hệ thống đang bận hoặc gặp sự cố kết nối."
 
+    def _call_gemini_stream(self, prompt: str, temperature: float = None, max_tokens: int = None,
+                            system_instruction: str = None) -> str:
+        """Like _call_gemini(), but forwards chunks to the stream callback as they arrive."""
+        chunks = []
+        try:
+            for chunk in self.model_manager.generate_content_stream(
+                prompt=prompt,
+                temperature=temperature or TEMPERATURE,
+                max_tokens=max_tokens or MAX_OUTPUT_TOKENS,
+                system_instruction=system_instruction
+            ):
+                chunks.append(chunk)
+                self._emit(chunk)
+            self._stream.last_call_ok = bool(chunks)
+        except Exception as e:
+            logger.error(f"Gemini API error: {e}")
+            if not chunks:
+                return "Hệ thống đang bận hoặc gặp sự cố kết nối."
+        # Not stripped: the streamed text must stay an exact prefix of the answer.
+        # On mid-stream failure the partial output is what the user already saw.
+        return "".join(chunks) or "Xin lỗi, không có phản hồi."
+
     # ==================================================
     # SUGGESTED QUESTIONS (THÊM TỪ HEAD)
     # ==================================================
@@ -0,0 +1,182 @@
+"""
+Semantic answer cache for the chat loop.
+
+Two tiers in front of RAGEngine.generate_answer():
+1. Exact text (normalized question) -> answer, LRU bounded
+2. Query embedding cosine similarity >= threshold -> answer (paraphrases)
+
+Entries are persisted to SQLite so restarts keep the cache, and expire after a TTL.
+Keys are the question alone, not (question, session_id): a book search or library-info
+answer is the same for every session, so one user's answer serves the others.
+Only context-independent intents are cached (see CACHEABLE_INTENTS): follow-ups and
+smalltalk depend on the session history, so they always go through the engine.
+Results the engine marks as not cacheable (Gemini errors, answers built from the
+session history) are never stored.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import orjson
+
+from config.rag_config import (
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+)
+
+logger = logging.getLogger("SemanticCache")
+
+CACHEABLE_INTENTS = {"SEARCH", "TITLE_SEARCH", "LIBRARY_INFO"}
+
+
+class SemanticCache:
+    """
+    Exact + embedding-similarity cache of generate_answer() results.
+    Embeddings come from the engine's embedder (normalized, so cosine = dot product).
+    """
+
+    def __init__(self, embedder, db_path: str):
+        self.embedder = embedder
+        self.db_path = db_path
+
+        # key -> (created_at, result); insertion order doubles as LRU order
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Row i of _matrix is the embedding of _keys[i]
+        self._keys: List[str] = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        # Vectors of stored entries only (rows of _matrix come from here)
+        self._vectors: Dict[str, np.ndarray] = {}
+        # Computed ahead of time (suggestions) or by the last get() miss, for the put() that
+        # usually follows; kept apart so lookups that are never stored do not accumulate
+        self._pending: Dict[str, np.ndarray] = {}
+        self._last_miss: Optional[tuple] = None
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, created_at REAL, result TEXT, vector BLOB)"
+        )
+        self._load()
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _load(self):
+        """Load non-expired entries from SQLite, dropping expired ones."""
+        cutoff = time.time() - SEMANTIC_CACHE_TTL
+        self.conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,))
+        self.conn.commit()
+
+        rows = self.conn.execute(
+            "SELECT key, created_at, result, vector FROM answers ORDER BY created_at DESC LIMIT ?",
+            (SEMANTIC_CACHE_MAX_ENTRIES,)
+        ).fetchall()
+        for key, created_at, result, vector in reversed(rows):
+            self._entries[key] = (created_at, orjson.loads(result))
+            if vector:
+                self._vectors[key] = np.frombuffer(vector, dtype=np.float32)
+        self._rebuild_matrix()
+        logger.info(f"Loaded {len(self._entries)} cached answers from {self.db_path}")
+
+    def _rebuild_matrix(self):
+        self._keys = [k for k in self._entries if k in self._vectors]
+        if self._keys:
+            self._matrix = np.vstack([self._vectors[k] for k in self._keys])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def _embed(self, key: str) -> Optional[np.ndarray]:
+        vec = self._vectors.get(key)
+        if vec is None:
+            vec = self._pending.get(key)
+        if vec is None and self._last_miss is not None and self._last_miss[0] == key:
+            vec = self._last_miss[1]
+        if vec is None:
+            raw = self.embedder.embed_text(key, is_query=True)
+            if raw is None:
+                return None
+            vec = np.asarray(raw, dtype=np.float32)
+        return vec
+
+    def warm(self, questions: List[str]):
+        """
+        Pre-compute query embeddings (e.g. CLI suggestions) so their first lookup skips the model.
+        Embedded in one batch call rather than one call per question.
+        """
+        keys = [k for k in dict.fromkeys(self._key(q) for q in questions)
+                if k not in self._vectors and k not in self._pending]
+        if not keys:
+            return
+        for key, raw in zip(keys, self.embedder.embed_batch(keys, is_query=True)):
+            self._pending[key] = np.asarray(raw, dtype=np.float32)
+
+    def get(self, question: str) -> Optional[Dict]:
+        """Return a cached generate_answer() result for this question or a close paraphrase."""
+        key = self._key(question)
+        now = time.time()
+
+        # Tier 1: exact text
+        entry = self._entries.get(key)
+        if entry and now - entry[0] < SEMANTIC_CACHE_TTL:
+            self._entries.move_to_end(key)
+            logger.info("Semantic cache HIT (exact)")
+            return entry[1]
+
+        # Tier 2: embedding similarity
+        if not self._keys:
+            return None
+        q = self._embed(key)
+        if q is None:
+            return None
+        self._last_miss = (key, q)
+        if q.shape[0] != self._matrix.shape[1]:
+            return None
+
+        sims = self._matrix @ q
+        best = int(sims.argmax())
+        if sims[best] < SEMANTIC_CACHE_THRESHOLD:
+            return None
+
+        created_at, result = self._entries[self._keys[best]]
+        if now - created_at >= SEMANTIC_CACHE_TTL:
+            return None
+        logger.info(f"Semantic cache HIT (similarity={sims[best]:.3f})")
+        return result
+
+    def put(self, question: str, result: Dict):
+        """Store a generate_answer() result if its intent does not depend on session context."""
+        if result.get("intent") not in CACHEABLE_INTENTS or not result.get("cacheable"):
+            return
+
+        key = self._key(question)
+        vec = self._embed(key)
+        self._pending.pop(key, None)
+        if vec is not None:
+            self._vectors[key] = vec
+        created_at = time.time()
+
+        self._entries[key] = (created_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > SEMANTIC_CACHE_MAX_ENTRIES:
+            evicted, _ = self._entries.popitem(last=False)
+            self._vectors.pop(evicted, None)
+            self.conn.execute("DELETE FROM answers WHERE key = ?", (evicted,))
+        self._rebuild_matrix()
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO answers (key, created_at, result, vector) VALUES (?, ?, ?, ?)",
+            (key, created_at, orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+             vec.tobytes() if vec is not None else None)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -6,6 +6,13 @@ from src.vector_db import VectorDB
 
 logger = logging.getLogger("SearchEngine")
 
+# Optional: token_set_ratio handles word order better than difflib.
+# Resolved once here: a failed import inside the filter loop re-scanned sys.path per candidate.
+try:
+    from fuzzywuzzy import fuzz
+except ImportError:
+    fuzz = None
+
 
 class SearchEngine:
     """
@@ -26,7 +33,8 @@ class SearchEngine:
         self,
         query: str,
         filters: Optional[Dict] = None,
-        top_k: int = 10
+        top_k: int = 10,
+        query_vector: Optional[List[float]] = None
     ) -> List[Dict]:
         """
         Tìm kiếm sách theo ngữ nghĩa với optional filters.
@@ -41,6 +49,7 @@ class SearchEngine:
                     "publish_year": "2023"      # Năm xuất bản (exact match)
                 }
             top_k: Số kết quả trả về
+            query_vector: Vector của query nếu caller đã embed sẵn (bỏ qua bước embed)
 
         Returns:
             List[Dict]: Danh sách sách với score
@@ -51,7 +60,8 @@ class SearchEngine:
 
         # 1. Embed query
         logger.info(f"Searching for: '{query}' with filters: {filters}")
-        query_vector = self.embedder.embed_text(query, is_query=True)
+        if query_vector is None:
+            query_vector = self.embedder.embed_text(query, is_query=True)
 
         if not query_vector:
             logger.error("Failed to embed query")
@@ -82,7 +92,7 @@ class SearchEngine:
 
         # 6. Apply Python filters (partial match cho title/authors)
         if python_filters:
-            formatted = self._apply_python_filters(formatted, python_filters)
+            formatted = self._apply_python_filters(formatted, python_filters, limit=top_k)
 
             # 6b) If python filters yielded nothing, try a broader candidate set as a fallback
             # This helps when the author/title exists in the DB but was not within the
@@ -97,7 +107,7 @@ class SearchEngine:
                         where_filter=where_filter,
                     )
                     broad_formatted = self._format_search_results(broad_results)
-                    formatted = self._apply_python_filters(broad_formatted, python_filters)
+                    formatted = self._apply_python_filters(broad_formatted, python_filters, limit=top_k)
                 except Exception:
                     logger.exception("Fallback broad query failed")
 
@@ -265,77 +275,74 @@ class SearchEngine:
 
         return chromadb_filters, python_filters
 
-    def _apply_python_filters(self, results: List[Dict], python_filters: Dict) -> List[Dict]:
+    def _apply_python_filters(self, results: List[Dict], python_filters: Dict,
+                              limit: Optional[int] = None) -> List[Dict]:
         """
         Apply partial/fuzzy match filters trong Python.
         
         Args:
-            results: Formatted search results
+            results: Formatted search results (sorted by score)
             python_filters: Dict with title/authors/category filters
+            limit: Stop after this many matches (search() only keeps top_k),
+                instead of fuzzy-matching the whole candidate window
             
         Returns:
             Filtered results
         """
         filtered = []
+        filter_category = python_filters.get("category")
+        filter_title = python_filters.get("title")
+        filter_authors = python_filters.get("authors")
+        filter_words = set(filter_title.split()) if filter_title else set()
+        checked = 0
 
         for book in results:
-            match = True
+            checked += 1
 
             # FIX: Check category filter (partial match for compound categories)
             # VD: filter="khởi nghiệp" matches book_category="Tài chính, Khởi nghiệp, Kỹ năng"
-            if "category" in python_filters and match:
-                filter_category = python_filters["category"]
-                book_category = book.get("category", "").lower()
-                if filter_category not in book_category:
-                    match = False
+            if filter_category and filter_category not in book.get("category", "").lower():
+                continue
 
             # Check title filter (Fuzzy Logic - IMPROVED)
-            if "title" in python_filters and match:
-                filter_title = python_filters["title"]
-                book_title = book.get("title", "").lower()
-                
-                # 1. Check substring (Fast path)
-                if filter_title in book_title:
-                    pass  # Match found
-                else:
-                    # 2. Fuzzy matching using word-order-insensitive approach
-                    # Use token_set_ratio for better handling of word order
-                    # Import at top if not already: from fuzzywuzzy import fuzz
-                    try:
-                        from fuzzywuzzy import fuzz
-                        
-                        # token_set_ratio ignores word order and repeated words
-                        # e.g., "trò chuyện khoa học" matches "khoa học và trò chuyện" well
-                        similarity = fuzz.token_set_ratio(filter_title, book_title)
-                        
-                        # Boost score if all filter words appear in title (partial overlap)
-                        filter_words = set(filter_title.split())
-                        title_words = set(book_title.split())
-                        if filter_words.issubset(title_words):
-                            similarity = min(similarity + 10, 100)  # Bonus for full word coverage
-                        
-                        # Threshold: 70% (stricter than before for better precision)
-                        if similarity < 70:
-                            match = False
-                    except ImportError:
-                        # Fallback to difflib if fuzzywuzzy not available
-                        import difflib
-                        similarity = difflib.SequenceMatcher(None, filter_title, book_title).ratio() * 100
-                        if similarity < 65:
-                            match = False
+            if filter_title and not self._title_matches(filter_title, filter_words,
+                                                        book.get("title", "").lower()):
+                continue
 
             # Check authors filter (partial match, case-insensitive)
-            if "authors" in python_filters and match:
-                book_authors = book.get("authors", "").lower()
-                if python_filters["authors"] not in book_authors:
-                    match = False
+            if filter_authors and filter_authors not in book.get("authors", "").lower():
+                continue
 
-            if match:
-                filtered.append(book)
+            filtered.append(book)
+            if limit is not None and len(filtered) >= limit:
+                break
 
-        logger.info(f"Python filters (Fuzzy) reduced {len(results)} to {len(filtered)} results")
+        logger.info(f"Python filters (Fuzzy) kept {len(filtered)} of {checked} checked results")
         return filtered
 
+    @staticmethod
+    def _title_matches(filter_title: str, filter_words: set, book_title: str) -> bool:
+        # 1. Check substring (Fast path)
+        if filter_title in book_title:
+            return True
+
+        # 2. Fuzzy matching using word-order-insensitive approach
+        if fuzz is not None:
+            # token_set_ratio ignores word order and repeated words
+            # e.g., "trò chuyện khoa học" matches "khoa học và trò chuyện" well
+            similarity = fuzz.token_set_ratio(filter_title, book_title)
+
+            # Boost score if all filter words appear in title (partial overlap)
+            if filter_words.issubset(book_title.split()):
+                similarity = min(similarity + 10, 100)  # Bonus for full word coverage
+
+            # Threshold: 70% (stricter than before for better precision)
+            return similarity >= 70
+
+        # Fallback to difflib if fuzzywuzzy not available
+        similarity = difflib.SequenceMatcher(None, filter_title, book_title).ratio() * 100
+        return similarity >= 65
+
     def _build_where_clause(self, filters: Dict) -> Dict:
         """
         Chuyển filters dict thành ChromaDB where clause.
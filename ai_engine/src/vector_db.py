@@ -1,5 +1,6 @@
 import chromadb
 from chromadb.config import Settings as ChromaSettings
+import hashlib
 import logging
 import os
 import time
@@ -80,14 +81,16 @@ class VectorDB:
     # ==================================================
     # ⚡ QUERY MEMORY (NEW)
     # ==================================================
-    def search_query_memory(self, query_vector, threshold=0.95):
+    def search_query_memory(self, query_vector, threshold=0.95, qtype_filter=None):
         """
         Tìm câu hỏi tương tự trong query_memory.
+        qtype_filter: chỉ xét các câu hỏi đã lưu với type này (vd "fallback_no_results").
         """
         try:
             results = self.query_collection.query(
                 query_embeddings=[query_vector],
-                n_results=1
+                n_results=1,
+                where={"type": qtype_filter} if qtype_filter else None
             )
 
             if not results["ids"][0]:
@@ -111,7 +114,8 @@ class VectorDB:
         Lưu câu hỏi + trả lời vào query_memory.
         """
         try:
-            qid = f"q_{hash(query)}"
+            # Stable across processes (hash() is salted per run, which duplicated entries)
+            qid = "q_" + hashlib.sha1(query.encode("utf-8")).hexdigest()
             self.query_collection.upsert(
                 ids=[qid],
                 embeddings=[vector],
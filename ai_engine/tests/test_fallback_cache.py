@@ -0,0 +1,88 @@
+"""
+No-result fallback memory (RAGEngine._no_results_fallback).
+
+The engine is built without __init__ so no embedding model, Chroma or Gemini key is needed:
+vector_db and model_manager are small in-memory fakes.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.rag.rag_engine_new import ChatSession, RAGEngine
+
+
+class FakeVectorDB:
+    """query_memory with cosine lookup, as VectorDB does it through Chroma."""
+
+    def __init__(self):
+        self.rows = []  # (vector, answer, qtype)
+
+    def add_query_memory(self, query, vector, answer, qtype):
+        self.rows.append((np.asarray(vector, dtype=np.float32), answer, qtype))
+
+    def search_query_memory(self, query_vector, threshold=0.95, qtype_filter=None):
+        q = np.asarray(query_vector, dtype=np.float32)
+        for vector, answer, qtype in self.rows:
+            if qtype_filter and qtype != qtype_filter:
+                continue
+            if float(vector @ q) / (np.linalg.norm(vector) * np.linalg.norm(q)) >= threshold:
+                return answer
+        return None
+
+
+class FakeModelManager:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        return f"Gemini answer #{self.calls}"
+
+
+def make_engine():
+    engine = RAGEngine.__new__(RAGEngine)
+    engine.vector_db = FakeVectorDB()
+    engine.model_manager = FakeModelManager()
+    engine._stream = threading.local()
+    engine._response_cache = OrderedDict()
+    engine._response_cache_lock = threading.Lock()
+    engine._query_memory_seen = OrderedDict()
+    engine._query_memory_lock = threading.Lock()
+    engine._io_pool = ThreadPoolExecutor(max_workers=1)
+    return engine
+
+
+def make_session(session_id, *turns):
+    """Session as _generate_answer() leaves it: the current question already appended."""
+    session = ChatSession(session_id)
+    session.history = [{"role": "user" if i % 2 == 0 else "model", "text": t} for i, t in enumerate(turns)]
+    return session
+
+
+def test_fallback_reused_for_paraphrase_on_fresh_session():
+    engine = make_engine()
+    q_vec = [0.6, 0.8, 0.0]
+
+    first = engine._no_results_fallback("sách nấu ăn kiểu Ý", make_session("a", "sách nấu ăn kiểu Ý"), q_vec)
+    engine._io_pool.shutdown(wait=True)  # query memory is written off the request thread
+    engine._io_pool = ThreadPoolExecutor(max_workers=1)
+
+    second = engine._no_results_fallback("sách ẩm thực Ý", make_session("b", "sách ẩm thực Ý"), q_vec)
+
+    assert engine.model_manager.calls == 1
+    assert second == first
+    assert engine.vector_db.rows[0][2] == "fallback_no_results"
+
+
+def test_fallback_not_shared_when_session_has_prior_turns():
+    engine = make_engine()
+    q_vec = [0.6, 0.8, 0.0]
+    engine.vector_db.add_query_memory("sách nấu ăn kiểu Ý", q_vec, "cached", qtype="fallback_no_results")
+
+    session = make_session("c", "xin chào", "Xin chào!", "sách ẩm thực Ý")
+    answer = engine._no_results_fallback("sách ẩm thực Ý", session, q_vec)
+
+    assert answer != "cached"
+    assert engine.model_manager.calls == 1
@@ -152,7 +152,7 @@ CREATE TABLE authors (
     bio TEXT DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
 
-    INDEX idx_author_name (name)
+    UNIQUE KEY uq_authors_name (name)
 ) ENGINE=InnoDB;
 
 -- =========================================================